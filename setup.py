@@ -57,5 +57,5 @@ setup(name='uvotpy',
                    'Programming Language :: Python ::3.5'],
       # requires HEADAS, WCStools, internet connection
       # environment setup  requires UVOTPY to point to the installed uvotpy library and calfiles.
-      scripts=['uvotpy/scripts/uvotgrism','uvotpy/scripts/fileinfo','uvotpy/scripts/uvotmakermf','uvotpy/scripts/convert_sky2det2raw'],		   
+      scripts=['uvotpy/scripts/uvotgrism','uvotpy/scripts/fileinfo','uvotpy/scripts/uvotmakermf','uvotpy/scripts/convert_sky2det2raw','uvotpy/scripts/uvotbatch','uvotpy/scripts/uvotcalmap'],		   
       )
@@ -0,0 +1,50 @@
+'''tests of uvotpy.batchfit: a failing model function stops the fit'''
+from __future__ import division
+
+import numpy as np
+
+from uvotpy.batchfit import batchfit
+
+
+def _gaussian_problems(nprob=3, m=40):
+   x = np.arange(m, dtype=float)[np.newaxis,:] + np.zeros((nprob,1))
+   amp = np.array([10.,20.,30.])[:nprob,np.newaxis]
+   y = amp*np.exp(-((x-20.)/4.)**2) + 1.
+   err = np.ones((nprob,m))
+   p0 = np.array([[1.,5.,19.,3.5]]*nprob)
+   return p0, {'x':x, 'y':y, 'err':err}
+
+
+def _failing_model(failcall, failstatus=-3):
+   calls = [0]
+   def model(p, fjac=None, x=None, y=None, err=None):
+      calls[0] += 1
+      if calls[0] == failcall:
+         return [failstatus, None]
+      bg, amp, pos, sig = [z[:,np.newaxis] for z in p.T]
+      return [0, (y - bg - amp*np.exp(-((x-pos)/sig)**2))/err]
+   return model
+
+
+def test_fcn_fails_partway():
+   p0, fa = _gaussian_problems()
+   Z = batchfit(_failing_model(10), p0, functkw=fa)
+   assert (Z.status == -3).all()
+   assert Z.perror is None
+   assert all([msg.startswith('WARNING: premature termination') for msg in Z.errmsg])
+
+
+def test_fcn_fails_on_first_call():
+   p0, fa = _gaussian_problems()
+   Z = batchfit(_failing_model(1, failstatus=-2), p0, functkw=fa)
+   assert (Z.status == -2).all()
+   assert Z.perror is None
+   assert all([msg.startswith('ERROR: first call') for msg in Z.errmsg])
+
+
+def test_converged_without_failure():
+   p0, fa = _gaussian_problems()
+   Z = batchfit(_failing_model(-1), p0, functkw=fa)
+   assert (Z.status > 0).all()
+   assert np.allclose(Z.params[:,1], [10.,20.,30.])
+   assert np.isfinite(Z.perror).all()
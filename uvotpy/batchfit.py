@@ -0,0 +1,341 @@
+# -*- coding: iso-8859-15 -*-
+#
+# This software was written by N.P.M. Kuin (Paul Kuin)
+# Copyright N.P.M. Kuin
+# All rights reserved
+# This software is licenced under a 3-clause BSD style license
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#Redistributions of source code must retain the above copyright notice,
+#this list of conditions and the following disclaimer.
+#
+#Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#Neither the name of the University College London nor the names
+#of the code contributors may be used to endorse or promote products
+#derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+#THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+#PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+#CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+#EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+#OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+#OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+#ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+   Levenberg-Marquardt least squares fit of many small independent problems
+   at once.
+
+   batchfit() takes the same kind of arguments as mpfit.mpfit(), but with the
+   parameters, data and parinfo of nprob problems stacked along a first axis.
+   All problems are iterated together on arrays of shape (nprob,...), so the
+   cost of one iteration is a few numpy calls for the whole batch instead of
+   a python loop per problem.
+'''
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from future.builtins import range
+from future.builtins import object
+
+__version__ = '0.1 20170620'
+
+import numpy as np
+
+
+class batchfit(object):
+   '''Fit nprob independent problems with a projected Levenberg-Marquardt method.
+
+   Parameters
+   ----------
+   fcn : function
+      the model function ``fcn(p, fjac=None, **functkw)``, called with the
+      parameters p of all problems, shape (nprob,npar). It returns
+      ``[status, f]`` with the weighted deviates f = (y-model)/err of shape
+      (nprob,m). If fjac is not None (autoderivative=False) it must return
+      ``[status, f, pderiv]`` with pderiv (nprob,m,npar) the derivative of
+      the model (in the units of f) with respect to each parameter, as in
+      mpfit. A negative status stops the fit.
+      Problems with fewer than m data points are padded with points that
+      give f = 0, e.g., with err = inf.
+   xall : array (nprob,npar)
+      start values of the parameters
+   functkw : dict
+      keywords passed to fcn, e.g., {'x':x,'y':y,'err':err} with (nprob,m) arrays
+   parinfo : list
+      None, one mpfit parinfo list used for every problem, or a list of
+      nprob parinfo lists. The keys 'value', 'fixed', 'limited' and 'limits'
+      are used; 'tied', 'step' and 'mpside' are not supported.
+   ftol, xtol, gtol : float
+      the relative tolerances of the chi-squared, the parameters and the
+      gradient, as in mpfit
+   maxiter : int
+      maximum number of iterations
+   autoderivative : bool
+      if True, derivatives are computed by forward differences, with all
+      problems evaluated in one call of fcn per free parameter
+   quiet : bool
+      if False, print a summary of the status values
+
+   Attributes
+   ----------
+   params : array (nprob,npar)
+      the fitted parameters
+   perror : array (nprob,npar)
+      the 1-sigma errors from the covariance matrix; zero for fixed
+      parameters, for parameters held at a limit and for problems with
+      status <= 0. None if no problem has status > 0 (as mpfit).
+   status : array of int (nprob)
+      the mpfit status of each problem: 0 bad input, 1,2,3,4 converged
+      (ftol, xtol, both, gtol), 5 maximum number of iterations, 7 no further
+      improvement possible, -16 non-finite model values, <0 fcn stopped.
+   fnorm : array (nprob)
+      the chi-squared of each problem
+   niter : array of int (nprob)
+      the number of iterations of each problem
+   nfev : int
+      the number of calls of fcn
+   errmsg : list of str
+      the error message of each problem ('' if none)
+
+   Notes
+   -----
+   Each iteration solves the damped normal equations
+   (J^T J + lambda diag(J^T J)) dp = -J^T f for all problems with one call
+   of numpy.linalg.solve. Parameters are kept inside their limits by
+   clipping the step, and a parameter at a limit with the gradient pointing
+   outward is held there, as mpfit does. A step that does not decrease the
+   chi-squared of a problem is rejected and its damping increased; the
+   problems that have converged are no longer updated.
+
+   History
+   -------
+   2017-06-20 batched fit for the per-column gaussian fits of the spectra
+   '''
+
+   def __init__(self, fcn, xall, functkw={}, parinfo=None,
+         ftol=1.e-10, xtol=1.e-10, gtol=1.e-10, maxiter=200,
+         autoderivative=True, quiet=True):
+
+      p = np.array(xall, dtype=float, ndmin=2)
+      nprob, npar = p.shape
+      self.nfev = 0
+      self.niter = np.zeros(nprob, dtype=int)
+      self.status = np.zeros(nprob, dtype=int)
+      self.errmsg = ['']*nprob
+      self.perror = np.zeros((nprob,npar))
+      self.fnorm = np.zeros(nprob) + np.nan
+      self.params = p
+
+      fixed, lower, upper = parinfo_arrays(parinfo, nprob, npar)
+      free = ~fixed
+      machep = np.finfo(float).eps
+
+      # input checks as in mpfit, per problem
+      todo = np.ones(nprob, dtype=bool)
+      bad = (p < lower) | (p > upper)
+      todo = self._reject(todo, bad.any(axis=1), 'ERROR: parameters are not within PARINFO limits')
+      bad = (lower >= upper) & free
+      todo = self._reject(todo, bad.any(axis=1), 'ERROR: PARINFO parameter limits are not consistent')
+      todo = self._reject(todo, free.sum(axis=1) == 0, 'ERROR: no free parameters')
+
+      self.fcn = fcn
+      self.functkw = functkw
+      self.autoderivative = autoderivative
+      f, jac = self._evaluate(p, free, upper)
+      if type(f) == type(None):
+         # jac holds the status returned by fcn
+         for k in np.where(todo)[0]:
+            self.status[k] = jac
+            self.errmsg[k] = 'ERROR: first call to "'+str(fcn)+'" failed'
+         self.perror = None
+         return
+      npoints = (f != 0).sum(axis=1)
+      todo = self._reject(todo, npoints < free.sum(axis=1),
+         'ERROR: number of parameters must not exceed data')
+      todo = self._reject(todo, ~np.isfinite(f).all(axis=1),
+         'ERROR: parameter or function value(s) have become infinite', status=-16)
+
+      chi2 = (f*f).sum(axis=1)
+      damp = np.zeros(nprob) + 1.e-3
+      active = todo.copy()
+      for iter in range(maxiter):
+         if not active.any():
+            break
+         a = active
+         self.niter[a] += 1
+         J = _peg(jac[a], f[a], p[a], free[a], lower[a], upper[a])
+         A = np.einsum('kmi,kmj->kij', J, J)
+         g = np.einsum('kmi,km->ki', J, f[a])
+         diag = np.einsum('kii->ki', A).copy()
+         # gradient test (cosine between f and the columns of J)
+         with np.errstate(divide='ignore', invalid='ignore'):
+            gnorm = np.abs(g) / np.sqrt(diag*chi2[a][:,np.newaxis])
+         gnorm[~np.isfinite(gnorm)] = 0.
+         gdone = gnorm.max(axis=1) <= gtol
+         # damped step; parameters without derivative get a unit diagonal
+         diag[diag <= 0.] = 1.
+         M = A + (damp[a][:,np.newaxis]*diag)[:,:,np.newaxis]*np.eye(npar)
+         dp = -_solve(M, g)
+         pnew = np.clip(p[a] + dp, lower[a], upper[a])
+         dp = pnew - p[a]
+         fnew, jnew = self._evaluate(pnew, free[a], upper[a], subset=a)
+         if type(fnew) == type(None):
+            # fcn stopped the fit of the active problems (jnew is its status)
+            for k in np.where(a)[0]:
+               self.status[k] = jnew
+               self.errmsg[k] = 'WARNING: premature termination by "'+str(fcn)+'"'
+            active[:] = False
+            break
+         chi2new = (fnew*fnew).sum(axis=1)
+         finite = np.isfinite(chi2new)
+         accept = finite & (chi2new <= chi2[a])
+         step = np.abs(dp) <= xtol*(np.abs(p[a]) + xtol)
+         xdone = step.all(axis=1)
+         with np.errstate(divide='ignore', invalid='ignore'):
+            fdone = accept & ((chi2[a] - chi2new) <= ftol*chi2[a])
+         # update the accepted problems
+         idx = np.where(a)[0]
+         acc = idx[accept]
+         p[acc] = pnew[accept]
+         f[acc] = fnew[accept]
+         jac[acc] = jnew[accept]
+         chi2[acc] = chi2new[accept]
+         damp[acc] = np.maximum(damp[acc]*0.1, 1.e-12)
+         rej = idx[~accept]
+         damp[rej] = damp[rej]*10.
+         # termination
+         st = np.zeros(len(idx), dtype=int)
+         st[gdone] = 4
+         st[xdone] = 2
+         st[fdone] = 1
+         st[fdone & xdone] = 3
+         st[(st == 0) & ~accept & (damp[idx] > 1.e20)] = 7
+         st[(st == 0) & ~finite & (damp[idx] > 1.e20)] = -16
+         self.status[idx] = st
+         active[idx[st != 0]] = False
+      self.status[active] = 5
+
+      # the covariance matrix of the free parameters not held at a limit
+      ok = self.status > 0
+      if ok.any():
+         J = _peg(jac[ok], f[ok], p[ok], free[ok], lower[ok], upper[ok])
+         A = np.einsum('kmi,kmj->kij', J, J)
+         use = np.einsum('kii->ki', A) > 0.
+         A[~(use[:,:,np.newaxis] & use[:,np.newaxis,:])] = 0.
+         A += (~use)[:,:,np.newaxis]*np.eye(npar)
+         cov = _inverse(A)
+         var = np.einsum('kii->ki', cov)
+         var[~use] = 0.
+         self.perror[ok] = np.sqrt(np.abs(var))
+      else:
+         self.perror = None
+      self.params = p
+      self.fnorm = chi2
+      if not quiet:
+         for st in np.unique(self.status):
+            print("batchfit: %i problems with status %i"%((self.status == st).sum(),st))
+
+   def _reject(self, todo, bad, msg, status=0):
+      for k in np.where(todo & bad)[0]:
+         self.errmsg[k] = msg
+         self.status[k] = status
+      return todo & ~bad
+
+   def _call(self, p, functkw, fjac=None):
+      self.nfev += 1
+      return self.fcn(p, fjac=fjac, **functkw)
+
+   def _evaluate(self, p, free, upper, subset=None):
+      '''deviates and jacobian at p for the problems in subset (default all);
+      None and the status of fcn if fcn stops the fit'''
+      functkw = self.functkw
+      if subset is not None:
+         # select the subset from the data arrays of all problems
+         nprob = len(subset)
+         functkw = {}
+         for key, value in list(self.functkw.items()):
+            if isinstance(value, np.ndarray) and (value.ndim > 0) and (len(value) == nprob):
+               value = value[subset]
+            functkw[key] = value
+      if not self.autoderivative:
+         result = self._call(p, functkw, fjac=free.astype(float))
+         if result[0] < 0:
+            return None, result[0]
+         f = np.asarray(result[1], dtype=float)
+         jac = -np.asarray(result[2], dtype=float)*free[:,np.newaxis,:]
+         return f, jac
+      result = self._call(p, functkw)
+      if result[0] < 0:
+         return None, result[0]
+      f = np.asarray(result[1], dtype=float)
+      # forward differences, stepping away from an upper limit
+      eps = np.sqrt(np.finfo(float).eps)
+      h = eps*np.abs(p)
+      h[h == 0] = eps
+      h[p + h > upper] *= -1.
+      jac = np.zeros(f.shape+(p.shape[1],))
+      for j in range(p.shape[1]):
+         if not free[:,j].any():
+            continue
+         pj = p.copy()
+         pj[:,j] += h[:,j]
+         result = self._call(pj, functkw)
+         if result[0] < 0:
+            return None, result[0]
+         jac[:,:,j] = (np.asarray(result[1], dtype=float) - f)/h[:,j][:,np.newaxis]
+      jac *= free[:,np.newaxis,:]
+      return f, jac
+
+
+def parinfo_arrays(parinfo, nprob, npar):
+   '''convert mpfit parinfo lists into arrays fixed, lower and upper limits (nprob,npar)'''
+   fixed = np.zeros((nprob,npar), dtype=bool)
+   lower = np.zeros((nprob,npar)) - np.inf
+   upper = np.zeros((nprob,npar)) + np.inf
+   if parinfo is None:
+      return fixed, lower, upper
+   if (len(parinfo) > 0) and isinstance(parinfo[0], dict):
+      parinfo = [parinfo]*nprob
+   if len(parinfo) != nprob:
+      raise ValueError("batchfit: need one parinfo list per problem")
+   for k, pinfo in enumerate(parinfo):
+      if pinfo is None:
+         continue
+      for i, par in enumerate(pinfo):
+         fixed[k,i] = bool(par.get('fixed',0))
+         limited = par.get('limited',[0,0])
+         limits = par.get('limits',[0.,0.])
+         if limited[0]: lower[k,i] = limits[0]
+         if limited[1]: upper[k,i] = limits[1]
+   return fixed, lower, upper
+
+
+def _peg(jac, f, p, free, lower, upper):
+   '''zero the derivative of parameters at a limit where the fit pushes beyond the limit'''
+   g = np.einsum('kmi,km->ki', jac, f)
+   hold = ((p <= lower) & (g > 0)) | ((p >= upper) & (g < 0)) | ~free
+   return jac * ~hold[:,np.newaxis,:]
+
+
+def _solve(M, b):
+   try:
+      return np.linalg.solve(M, b[:,:,np.newaxis])[:,:,0]
+   except np.linalg.LinAlgError:
+      return np.einsum('kij,kj->ki', np.linalg.pinv(M), b)
+
+
+def _inverse(A):
+   try:
+      return np.linalg.inv(A)
+   except np.linalg.LinAlgError:
+      return np.linalg.pinv(A)
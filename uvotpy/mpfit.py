@@ -199,6 +199,25 @@ Perform Levenberg-Marquardt least-squares minimization, based on MINPACK-1.
  dimension should be the parameter dimension.  Example: fitting a
  50x50 image, "dp" should be 50x50xNPAR.
 
+ When the derivatives are computed by finite differences, the user
+ function is called once for each free parameter (twice for two-sided
+ derivatives).  With the VECTORIZED=1 keyword these calls are replaced
+ by a single call in which P is a 2-D array of shape [K, NPAR], one
+ perturbed parameter set per row.  The user function must then return
+ the deviates as an array of shape [K, M], row k being the deviates for
+ the parameters P[k].  All other calls pass a 1-D P as usual.  For
+ example, for a gaussian
+
+   def myfunct(p, fjac=None, x=None, y=None, err=None):
+	p = numpy.asarray(p)
+	amp, pos, sig = p[...,0,None], p[...,1,None], p[...,2,None]
+	model = amp*numpy.exp(-((x-pos)/sig)**2)
+	return [0, (y-model)/err]
+
+ Alternatively, with NTHREADS > 1 the calls for the jacobian columns
+ are made from a pool of threads.  This only helps when the user
+ function spends its time in code that releases the GIL.
+
 
 		   CONSTRAINING PARAMETER VALUES WITH THE PARINFO KEYWORD
 
@@ -450,6 +469,7 @@ from builtins import object
 from past.utils import old_div
 import numpy
 import types
+import scipy.linalg
 import scipy.linalg.blas
 
 #	 Original FORTRAN documentation
@@ -645,7 +665,8 @@ class mpfit(object):
 				 damp=0., maxiter=200, factor=100., nprint=1,
 				 iterfunct='default', iterkw={}, nocovar=0,
 				 rescale=0, autoderivative=1, quiet=0,
-				 diag=None, epsfcn=None, debug=0):
+				 diag=None, epsfcn=None, debug=0, linalg='lapack',
+				 vectorized=0, nthreads=0):
 		"""
   Inputs:
 	fcn:
@@ -740,6 +761,13 @@ class mpfit(object):
 		Set iterfunct=None if there is no user-defined routine and you don't
 		want the internal default routine be called.
 
+	 linalg:
+		The linear algebra used in each iteration. 'minpack' uses the python
+		translation of the MINPACK routines QRFAC, QRSOLV and LMPAR.
+		'lapack' does the same steps with the pivoted QR factorization and
+		the triangular solves of scipy.linalg (LAPACK), which is faster.
+		Default: 'lapack'
+
 	 maxiter:
 		The maximum number of iterations to perform.  If the number is exceeded,
 		then the status value is set to 5 and MPFIT returns.
@@ -757,6 +785,12 @@ class mpfit(object):
 		can be made in a single iteration.
 		Default value: 1
 
+	 nthreads:
+		If larger than 1, the finite difference jacobian is computed by
+		calling fcn from a pool of this many threads.  Use for expensive
+		user functions that release the GIL.
+		Default: 0  fcn is called from the main thread
+
 	 parinfo
 		Provides a mechanism for more sophisticated constraints to be placed on
 		parameter values.  When parinfo is not passed, then it is assumed that
@@ -782,6 +816,12 @@ class mpfit(object):
 
 		Note: DAMP doesn't work with autoderivative=0
 
+	 vectorized:
+		If set, fcn accepts a 2-D array of parameter sets and computes the
+		deviates for all of them in one call.  It is used for the finite
+		difference jacobian (see the USER FUNCTION section).
+		Default: clear (=0)
+
 	 xtol:
 		A nonnegative input variable. Termination occurs when the relative error
 		between two consecutive iterates is at most xtol (and status is
@@ -891,11 +931,18 @@ class mpfit(object):
 		self.nfev = 0
 		self.damp = damp
 		self.dof=0
+		self.linalg = linalg
+		self.vectorized = vectorized
+		self.nthreads = nthreads
 
 		if fcn==None:
 			self.errmsg = "Usage: parms = mpfit('myfunt', ... )"
 			return
 
+		if linalg not in ['minpack','lapack']:
+			self.errmsg = "ERROR: LINALG must be 'minpack' or 'lapack'"
+			return
+
 		if iterfunct == 'default':
 			iterfunct = self.defiter
 
@@ -1130,7 +1177,10 @@ class mpfit(object):
 							fjac[:,whupeg[i]] = 0
 
 			# Compute the QR factorization of the jacobian
-			[fjac, ipvt, wa1, wa2] = self.qrfac(fjac, pivot=1)
+			if self.linalg == 'lapack':
+				[fjac, ipvt, wa2, qtf] = self.qrfac_lapack(fjac, fvec)
+			else:
+				[fjac, ipvt, wa1, wa2] = self.qrfac(fjac, pivot=1)
 			
 			# On the first iteration if "diag" is unspecified, scale
 			# according to the norms of the columns of the initial jacobian
@@ -1149,26 +1199,28 @@ class mpfit(object):
 					delta = factor
 
 			# Form (q transpose)*fvec and store the first n components in qtf
+			# (qrfac_lapack returns qtf and the permuted triangle of R)
 			catch_msg = 'forming (q transpose)*fvec'
-			wa4 = fvec.copy()
-			for j in range(n):
-				lj = ipvt[j]
-				temp3 = fjac[j,lj]
-				if temp3 != 0:
-					fj = fjac[j:,lj]
-					wj = wa4[j:]
-					# *** optimization wa4(j:*)
-					wa4[j:] = wj - fj * sum(fj*wj) / temp3
-				fjac[j,lj] = wa1[j]
-				qtf[j] = wa4[j]
-			# From this point on, only the square matrix, consisting of the
-			# triangle of R, is needed.
-			fjac = fjac[0:n, 0:n]
-			fjac.shape = [n, n]
-			temp = fjac.copy()
-			for i in range(n):
-				temp[:,i] = fjac[:, ipvt[i]]
-			fjac = temp.copy()
+			if self.linalg != 'lapack':
+				wa4 = fvec.copy()
+				for j in range(n):
+					lj = ipvt[j]
+					temp3 = fjac[j,lj]
+					if temp3 != 0:
+						fj = fjac[j:,lj]
+						wj = wa4[j:]
+						# *** optimization wa4(j:*)
+						wa4[j:] = wj - fj * sum(fj*wj) / temp3
+					fjac[j,lj] = wa1[j]
+					qtf[j] = wa4[j]
+				# From this point on, only the square matrix, consisting of the
+				# triangle of R, is needed.
+				fjac = fjac[0:n, 0:n]
+				fjac.shape = [n, n]
+				temp = fjac.copy()
+				for i in range(n):
+					temp[:,i] = fjac[:, ipvt[i]]
+				fjac = temp.copy()
 
 			# Check for overflow.  This should be a cheap test here since FJAC
 			# has been reduced to a (small) square matrix, and the test is
@@ -1203,7 +1255,10 @@ class mpfit(object):
 
 				# Determine the levenberg-marquardt parameter
 				catch_msg = 'calculating LM parameter (MPFIT_)'
-				[fjac, par, wa1, wa2] = self.lmpar(fjac, ipvt, diag, qtf, delta, wa1, wa2, par=par)
+				if self.linalg == 'lapack':
+					[fjac, par, wa1, wa2] = self.lmpar_lapack(fjac, ipvt, diag, qtf, delta, par=par)
+				else:
+					[fjac, par, wa1, wa2] = self.lmpar(fjac, ipvt, diag, qtf, delta, wa1, wa2, par=par)
 				# Store the direction p and x+p. Calculate the norm of p
 				wa1 = -wa1
 
@@ -1534,6 +1589,41 @@ class mpfit(object):
 			return fcn(x, fjac=fjac, **functkw)
 	
 	
+	def call_block(self, fcn, xp, functkw):
+		"""Evaluate the deviates for each row of the 2-D parameter array xp.
+		
+		Returns [status, f] with f of shape [len(xp), m].
+		"""
+		if self.debug:
+			print('Entering call_block...')
+		if self.qanytied:
+			for k in range(len(xp)):
+				xp[k] = self.tie(xp[k], self.ptied)
+		self.nfev = self.nfev + len(xp)
+		if self.vectorized:
+			[status, f] = fcn(xp, fjac=None, **functkw)
+			f = numpy.asarray(f, dtype=float)
+		else:
+			def onecall(p):
+				return fcn(p, fjac=None, **functkw)
+			if self.nthreads > 1:
+				from multiprocessing.pool import ThreadPool
+				pool = ThreadPool(min(self.nthreads, len(xp)))
+				try:
+					res = pool.map(onecall, list(xp))
+				finally:
+					pool.close()
+					pool.join()
+			else:
+				res = [onecall(p) for p in xp]
+			status = numpy.min([r[0] for r in res])
+			f = numpy.array([numpy.ravel(r[1]) for r in res], dtype=float)
+		f.shape = [len(xp), f.size//len(xp)]
+		if self.damp > 0:
+			f = numpy.tanh(old_div(f,self.damp))
+		return [status, f]
+	
+	
 	def enorm(self, vec):
 		ans = self.blas_enorm(vec)
 		return ans
@@ -1565,9 +1655,12 @@ class mpfit(object):
 			mperr = 0
 			fjac = numpy.zeros(nall, dtype=float)
 			fjac[ifree] = 1.0  # Specify which parameters need derivatives
-			[status, fp] = self.call(fcn, xall, functkw, fjac=fjac)
+			[status, fp, pderiv] = self.call(fcn, xall, functkw, fjac=fjac)
+			if status < 0:
+				return None
+			fjac = numpy.array(pderiv, dtype=float)
 
-			if len(fjac) != m*nall:
+			if fjac.size != m*nall:
 				print('ERROR: Derivative matrix was not computed properly.')
 				return None
 
@@ -1580,7 +1673,7 @@ class mpfit(object):
 			if len(ifree) < nall:
 				fjac = fjac[:,ifree]
 				fjac.shape = [m, n]
-				return fjac
+			return fjac
 
 		fjac = numpy.zeros([m, n], dtype=float)
 
@@ -1615,6 +1708,27 @@ class mpfit(object):
 			wh = (numpy.nonzero(mask))[0]
 			if len(wh) > 0:
 				h[wh] = - h[wh]
+
+		if self.vectorized or (self.nthreads > 1):
+			# Evaluate all perturbed parameter sets in one block: the
+			# forward steps for each parameter, followed by the backward
+			# steps of the parameters with two-sided derivatives
+			twosided = numpy.abs(dside[ifree]) > 1
+			j2 = (numpy.nonzero(twosided))[0]
+			xp = numpy.tile(numpy.asarray(xall, dtype=float), (n+len(j2), 1))
+			xp[numpy.arange(n), ifree] = xp[numpy.arange(n), ifree] + h
+			xp[n+numpy.arange(len(j2)), ifree[j2]] = xp[n+numpy.arange(len(j2)), ifree[j2]] - h[j2]
+			[status, fp] = self.call_block(fcn, xp, functkw)
+			if status < 0:
+				return None
+			if fp.shape[1] != m:
+				print('ERROR: Block of deviates was not computed properly.')
+				return None
+			fjac = (old_div((fp[0:n] - fvec),h[:,numpy.newaxis])).T
+			if len(j2) > 0:
+				fjac[:,j2] = (old_div((fp[j2] - fp[n:]),(2*h[j2,numpy.newaxis]))).T
+			return fjac
+
 		# Loop through parameters, computing the derivative for each
 		for j in range(n):
 			xp = xall.copy()
@@ -2217,6 +2331,168 @@ class mpfit(object):
 		return [r, par, x, sdiag]
 
 	
+	# LAPACK versions of qrfac, qrsolv and lmpar.  They do the same steps
+	# as the MINPACK routines above, with the pivoted QR factorization,
+	# the triangular solves and the loops over columns replaced by calls
+	# to scipy.linalg and numpy.
+	
+	def qrfac_lapack(self, a, fvec):
+		"""QR factorization with column pivoting of the m by n jacobian a.
+		
+		Returns [r, ipvt, acnorm, qtf]: the n by n upper triangle r of the
+		factorization of the permuted columns (column j of r belongs to
+		parameter ipvt[j]), the column norms acnorm of a, and the first n
+		components of (q transpose)*fvec.  These are the quantities the
+		MINPACK path derives from the output of qrfac.
+		"""
+		if self.debug: print('Entering qrfac_lapack...')
+		n = a.shape[1]
+		acnorm = numpy.sqrt(numpy.sum(a*a, axis=0))
+		q, r, ipvt = scipy.linalg.qr(a, mode='economic', pivoting=True,
+			check_finite=False)
+		qtf = numpy.dot(q.T, fvec)[0:n]
+		return [r[0:n,0:n].copy(), ipvt, acnorm, qtf]
+
+	def qrsolv_lapack(self, r, ipvt, diag, qtb):
+		"""qrsolv with the diagonal matrix d eliminated by a QR factorization
+		of r stacked on p^T d p, instead of by givens rotations."""
+		if self.debug:
+			print('Entering qrsolv_lapack...')
+		n = r.shape[1]
+		rr = numpy.triu(r)
+		stack = numpy.concatenate((rr, numpy.diag(diag[ipvt])))
+		q, ss = scipy.linalg.qr(stack, mode='economic', check_finite=False)
+		wa = numpy.dot(q.T, numpy.concatenate((qtb, numpy.zeros(n))))
+		sdiag = numpy.diagonal(ss).copy()
+		
+		# Store the strict upper triangle of s (transposed) in the strict
+		# lower triangle of r; the upper triangle of r is unaltered
+		low = numpy.tril_indices(n, -1)
+		r = r.copy()
+		r[low] = ss.T[low]
+
+		# Solve the triangular system for z.  If the system is singular
+		# then obtain a least squares solution
+		nsing = n
+		wh = (numpy.nonzero(sdiag == 0))[0]
+		if len(wh) > 0:
+			nsing = wh[0]
+			wa[nsing:] = 0
+		if nsing >= 1:
+			wa[0:nsing] = scipy.linalg.solve_triangular(ss[0:nsing,0:nsing], wa[0:nsing],
+				check_finite=False)
+
+		# Permute the components of z back to components of x
+		x = numpy.zeros(n)
+		x[ipvt] = wa
+		return (r, x, sdiag)
+
+	def lmpar_lapack(self, r, ipvt, diag, qtb, delta, par=None):
+		"""lmpar with the triangular systems solved by scipy.linalg"""
+		if self.debug:
+			print('Entering lmpar_lapack...')
+		dwarf = self.machar.minnum
+		machep = self.machar.machep
+		n = r.shape[1]
+		rr = numpy.triu(r)
+
+		# Compute and store in x the gauss-newton direction.  If the
+		# jacobian is rank-deficient, obtain a least-squares solution
+		nsing = n
+		wa1 = qtb.copy()
+		# A zero or non-finite diagonal element ends the nonsingular part;
+		# solve_triangular does not divide by zero like the loop in lmpar
+		rdiag = numpy.abs(numpy.diagonal(r).copy())
+		rthresh = numpy.nanmax(numpy.append(rdiag,0.)) * machep
+		wh = (numpy.nonzero(~(rdiag > rthresh)))[0]
+		if len(wh) > 0:
+			nsing = wh[0]
+			wa1[wh[0]:] = 0
+		if nsing >= 1:
+			wa1[0:nsing] = scipy.linalg.solve_triangular(rr[0:nsing,0:nsing], wa1[0:nsing],
+				check_finite=False)
+
+		# Note: ipvt here is a permutation array
+		x = numpy.zeros(n)
+		x[ipvt] = wa1
+
+		# Initialize the iteration counter.  Evaluate the function at the
+		# origin, and test for acceptance of the gauss-newton direction
+		iter = 0
+		wa2 = diag * x
+		dxnorm = self.enorm(wa2)
+		fp = dxnorm - delta
+		sdiag = numpy.zeros(n)
+		if fp <= 0.1*delta:
+			return [r, 0., x, sdiag]
+
+		# If the jacobian is not rank deficient, the newton step provides a
+		# lower bound, parl, for the zero of the function.  Otherwise set
+		# this bound to zero.
+		parl = 0.
+		if nsing >= n:
+			wa1 = diag[ipvt] * wa2[ipvt] / dxnorm
+			wa1 = scipy.linalg.solve_triangular(rr, wa1, trans='T', check_finite=False)
+			temp = self.enorm(wa1)
+			parl = ((fp/delta)/temp)/temp
+
+		# Calculate an upper bound, paru, for the zero of the function
+		wa1 = numpy.dot(rr.T, qtb)/diag[ipvt]
+		gnorm = self.enorm(wa1)
+		paru = gnorm/delta
+		if paru == 0:
+			paru = dwarf/numpy.min([delta,0.1])
+
+		# If the input par lies outside of the interval (parl,paru), set
+		# par to the closer endpoint
+		par = numpy.max([par,parl])
+		par = numpy.min([par,paru])
+		if par == 0:
+			par = gnorm/dxnorm
+
+		# Beginning of an interation
+		while(1):
+			iter = iter + 1
+
+			# Evaluate the function at the current value of par
+			if par == 0:
+				par = numpy.max([dwarf, paru*0.001])
+			temp = numpy.sqrt(par)
+			wa1 = temp * diag
+			[r, x, sdiag] = self.qrsolv_lapack(r, ipvt, wa1, qtb)
+			wa2 = diag*x
+			dxnorm = self.enorm(wa2)
+			temp = fp
+			fp = dxnorm - delta
+
+			if (numpy.abs(fp) <= 0.1*delta) or \
+			   ((parl == 0) and (fp <= temp) and (temp < 0)) or \
+			   (iter == 10):
+			   break;
+
+			# Compute the newton correction: solve s^T wa1 = p^T d^2 x / dxnorm
+			wa1 = diag[ipvt] * wa2[ipvt] / dxnorm
+			ss = numpy.tril(r, -1) + numpy.diag(sdiag)
+			wa1 = scipy.linalg.solve_triangular(ss, wa1, lower=True, check_finite=False)
+
+			temp = self.enorm(wa1)
+			parc = ((fp/delta)/temp)/temp
+
+			# Depending on the sign of the function, update parl or paru
+			if fp > 0:
+				parl = numpy.max([parl,par])
+			if fp < 0:
+				paru = numpy.min([paru,par])
+
+			# Compute an improved estimate for par
+			par = numpy.max([parl, par+parc])
+
+			# End of an iteration
+
+		# Termination
+		return [r, par, x, sdiag]
+
+	
 	# Procedure to tie one parameter to another.
 	def tie(self, p, ptied=None):
 		if self.debug:
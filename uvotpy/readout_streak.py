@@ -452,17 +452,11 @@ def _lss_corr(obs,interactive=True,maxcr=False,figno=20,
    try:
       lss = 1.0
       band = obs['band']
-      caldb = os.getenv('CALDB')
-      command = "quzcif swift uvota - "+band.upper()+\
-         " SKYFLAT "+\
-         obs['dateobs'].split('T')[0]+"  "+\
-	 obs['dateobs'].split('T')[1]+" - > lssfile.1234.tmp"
-      print(command)
-      os.system(command)
-      f = open('lssfile.1234.tmp')
-      lssfile = f.readline()
-      f.close()
-      f = fits.getdata(lssfile.split()[0],ext=int(lssfile.split()[1]))
+      from uvotpy.uvotcaldb import quzcif, caldb_hdulist
+      lssfile, ext = quzcif("swift","uvota","-",band.upper(),"SKYFLAT",
+         obs['dateobs'].split('T')[0],obs['dateobs'].split('T')[1],"-")[0]
+      print(lssfile, ext)
+      f = caldb_hdulist(lssfile)[ext].data
       lss = f[ yloc,xloc]
       print("lss correction = ",lss,"  coords=",coord[0], (yloc+104,xloc+78))
       return lss, coord[0], (yloc+104,xloc+78) 
@@ -0,0 +1,250 @@
+# -*- coding: iso-8859-15 -*-
+#
+# This software was written by N.P.M. Kuin (Paul Kuin)
+# Copyright N.P.M. Kuin
+# All rights reserved
+# This software is licenced under a 3-clause BSD style license
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#Redistributions of source code must retain the above copyright notice,
+#this list of conditions and the following disclaimer.
+#
+#Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#Neither the name of the University College London nor the names
+#of the code contributors may be used to endorse or promote products
+#derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+#THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+#PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+#CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+#EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+#OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+#OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+#ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+   Batch extraction of grism spectra for a list of targets.
+
+   Each job is a call to uvotgetspec.getSpec() for one (RA, DEC, obsid, ext).
+   The jobs are run in a pool of worker processes which import the uvotpy
+   modules once, so that the calibration data read or fitted in a worker
+   are kept between the jobs run by that worker.
+'''
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from future.builtins import str
+from future.builtins import range
+
+__version__ = '0.1 20170620'
+
+# getSpec keywords set for every job unless the job gives them
+batch_defaults = {'interactive':False, 'wr_outfile':True, 'chatter':0}
+
+
+def read_job_table(file, commentsymb='#'):
+   '''Read a table of extraction jobs.
+
+   Parameters
+   ----------
+   file : str
+      path of the job table. Each line has the fields
+      ``RA DEC obsid ext [keyword=value ...]`` separated by blanks.
+      RA and DEC are in decimal degrees, obsid is the 11 digit observation
+      id, ext the extension number. The optional keywords are passed to
+      getSpec(), or, if it is one of the ExtractionContext parameters
+      (e.g., trackwidth, background_method), set in the context of the job.
+      Values are read as python literals, else as strings.
+   commentsymb : str
+      lines starting with this character are skipped
+
+   Returns
+   -------
+   jobs : list of dict
+      one dictionary per job with keys 'RA','DEC','obsid','ext' and 'options'
+
+   Example
+   -------
+   A job table ::
+
+      # RA         DEC        obsid        ext  options
+      254.7129625  34.3148667 00055900056  1    offsetlimit=[100,2]
+      254.7129625  34.3148667 00055900056  2    trackwidth=1.0 fit_second=True
+   '''
+   f = open(file)
+   lines = f.readlines()
+   f.close()
+   jobs = []
+   for k, line in enumerate(lines):
+      line = line.strip()
+      if (len(line) == 0) or (line[0] == commentsymb):
+         continue
+      fields = line.split()
+      if len(fields) < 4:
+         raise IOError("read_job_table: line %i of %s needs RA DEC obsid ext\n%s"%(k+1,file,line))
+      options = {}
+      for item in fields[4:]:
+         if not '=' in item:
+            raise IOError("read_job_table: option %s on line %i is not keyword=value"%(item,k+1))
+         key, value = item.split('=',1)
+         options[key] = _parse_value(value)
+      jobs.append({'RA':float(fields[0]), 'DEC':float(fields[1]),
+         'obsid':fields[2], 'ext':int(fields[3]), 'options':options})
+   return jobs
+
+
+def _parse_value(value):
+   '''convert a job table option value to a python object'''
+   import ast
+   try:
+      return ast.literal_eval(value)
+   except (ValueError, SyntaxError):
+      return value
+
+
+def _init_worker(chatter=0):
+   '''import the extraction modules once per worker process'''
+   import matplotlib
+   matplotlib.use('Agg')
+   from uvotpy import uvotgetspec, uvotio
+   if chatter > 1:
+      import os
+      print("uvotbatch: worker %i ready"%(os.getpid()))
+
+
+def run_job(job):
+   '''Run one extraction job and report the outcome.
+
+   Parameters
+   ----------
+   job : dict
+      as returned by read_job_table(), optionally with an 'index' key
+
+   Returns
+   -------
+   result : dict
+      'index', 'RA', 'DEC', 'obsid', 'ext' from the job,
+      'status' ('ok' or 'failed'), 'error' (None or the traceback text),
+      'time' (elapsed seconds), 'outputs' (list of output files written)
+      and 'pid' of the worker process.
+
+   Notes
+   -----
+   An exception raised by the extraction is caught and reported in the
+   result, so one failing job does not stop the batch.
+   '''
+   import os, time, traceback
+   from uvotpy import uvotgetspec
+
+   tstart = time.time()
+   result = {'index':job.get('index'), 'RA':job['RA'], 'DEC':job['DEC'],
+      'obsid':job['obsid'], 'ext':job['ext'], 'status':'failed', 'error':None,
+      'time':0.0, 'outputs':[], 'pid':os.getpid()}
+   kwargs = dict(batch_defaults)
+   ctxargs = {}
+   for key, value in list(job.get('options',{}).items()):
+      if key in uvotgetspec.ExtractionContext.parameters:
+         ctxargs[key] = value
+      else:
+         kwargs[key] = value
+   try:
+      ctx = uvotgetspec.ExtractionContext(**ctxargs)
+      uvotgetspec.getSpec(job['RA'],job['DEC'],job['obsid'],job['ext'],ctx=ctx,**kwargs)
+      result['status'] = 'ok'
+   except Exception:
+      result['error'] = traceback.format_exc()
+   result['outputs'] = _find_outputs(job['obsid'],job['ext'],kwargs.get('outfile'),tstart)
+   result['time'] = time.time()-tstart
+   return result
+
+
+def _find_outputs(obsid, ext, outfile, tstart):
+   '''output files of uvotio.writeSpectrum() for this job written since tstart'''
+   import glob, os
+   if outfile == None:
+      stub = 'sw'+obsid
+   else:
+      stub = outfile
+   found = []
+   for name in glob.glob(stub+'ug?_?ord_'+str(ext)+'_[fg]*'):
+      if os.path.getmtime(name) >= int(tstart):
+         found.append(os.path.abspath(name))
+   found.sort()
+   return found
+
+
+def run_batch(jobs, nproc=None, maxtasksperchild=None, chatter=1):
+   '''Run a list of extraction jobs in a pool of processes.
+
+   Parameters
+   ----------
+   jobs : list of dict
+      jobs as returned by read_job_table()
+   nproc : int
+      number of worker processes. Default is the number of CPUs.
+      With nproc=1 the jobs are run one after the other in this process.
+   maxtasksperchild : int
+      replace a worker after this many jobs. The default (None) keeps the
+      workers, and their calibration caches, for the whole batch.
+   chatter : int
+      verbosity
+
+   Returns
+   -------
+   results : list of dict
+      the result of run_job() for each job, in the order of `jobs`
+   '''
+   import multiprocessing
+
+   work = []
+   for k, job in enumerate(jobs):
+      job = dict(job)
+      job['index'] = k
+      work.append(job)
+   if nproc == None:
+      nproc = multiprocessing.cpu_count()
+   nproc = max(1,min(nproc,len(work)))
+
+   results = [None]*len(work)
+   if nproc == 1:
+      _init_worker(chatter)
+      for job in work:
+         results[job['index']] = _report(run_job(job),chatter)
+   else:
+      pool = multiprocessing.Pool(nproc, initializer=_init_worker, initargs=(chatter,),
+         maxtasksperchild=maxtasksperchild)
+      try:
+         for res in pool.imap_unordered(run_job, work):
+            results[res['index']] = _report(res,chatter)
+      finally:
+         pool.close()
+         pool.join()
+   return results
+
+
+def _report(result, chatter):
+   if chatter > 0:
+      print("uvotbatch: job %i %s+%i %s (%.1fs)"%(result['index'],result['obsid'],
+         result['ext'],result['status'],result['time']))
+      if (chatter > 1) & (result['error'] != None):
+         print(result['error'])
+   return result
+
+
+def write_summary(results, file):
+   '''Write a one-line-per-job summary of the batch results to `file`.'''
+   f = open(file,'w')
+   f.write("# index RA DEC obsid ext status time(s) outputs\n")
+   for res in results:
+      f.write("%i %12.7f %12.7f %s %i %s %8.1f %s\n"%(res['index'],res['RA'],res['DEC'],
+         res['obsid'],res['ext'],res['status'],res['time'],','.join(res['outputs'])))
+   f.close()
@@ -0,0 +1,300 @@
+# -*- coding: iso-8859-15 -*-
+#
+# This software was written by N.P.M. Kuin (Paul Kuin)
+# Copyright N.P.M. Kuin
+# All rights reserved
+# This software is licenced under a 3-clause BSD style license
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#Redistributions of source code must retain the above copyright notice,
+#this list of conditions and the following disclaimer.
+#
+#Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#Neither the name of the University College London nor the names
+#of the code contributors may be used to endorse or promote products
+#derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+#THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+#PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+#CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+#EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+#OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+#OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+#ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+   Look up calibration files in the CALDB without running quzcif.
+
+   The index of each mission/instrument (caldb.indx, found through the
+   caldb.config file) is read once and kept in memory, and the queries of
+   quzcif (instrument, detector, filter, codename, date, time, boundary
+   expression) are answered from it. Calibration files opened with
+   caldb_hdulist() are kept open for the next call.
+
+   Example
+   -------
+   >>> from uvotpy.uvotcaldb import quzcif, caldb_hdulist
+   >>> arf, ext = quzcif('swift','uvota','-','UGRISM','SPECRESP','now','now',
+   ...    'wheelpos.eq.160')[0]
+   >>> hdu = caldb_hdulist(arf)[ext]
+'''
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from future.builtins import str
+from future.builtins import range
+
+__version__ = '0.1 20170620'
+
+_caldb_config = {}   # caldb.config file -> {(MISSION,INSTRUMENT):(index file, CALDB)}
+_caldb_index = {}    # (index file, modification time) -> index columns
+_caldb_hdus = {}     # (calibration file, modification time) -> HDUList
+
+
+def caldb_config(caldb=None):
+   '''Read the caldb.config file.
+
+   Parameters
+   ----------
+   caldb : str, optional
+      the CALDB directory; default $CALDB
+
+   Returns
+   -------
+   config : dict
+      (MISSION, INSTRUMENT) : (path of the index file, CALDB directory)
+
+   Notes
+   -----
+   The file is $CALDBCONFIG, or else $CALDB/software/tools/caldb.config.
+   The lines have the fields ``mission instrument device dir file device dir``.
+   '''
+   import os
+   if caldb == None:
+      caldb = os.getenv('CALDB')
+   if caldb == None:
+      raise IOError("uvotcaldb: the CALDB environment variable has not been set")
+   configfile = os.getenv('CALDBCONFIG')
+   if (configfile == None) or (not os.access(configfile,os.R_OK)):
+      configfile = os.path.join(caldb,'software','tools','caldb.config')
+   if configfile in _caldb_config:
+      return _caldb_config[configfile]
+   config = {}
+   if os.access(configfile,os.R_OK):
+      f = open(configfile)
+      for line in f.readlines():
+         fields = line.split()
+         if (len(fields) < 5) or (fields[0][0] == '#'):
+            continue
+         config[(fields[0].upper(),fields[1].upper())] = (
+            os.path.join(_caldb_device(fields[2],caldb),fields[3],fields[4]),caldb)
+      f.close()
+   _caldb_config[configfile] = config
+   return config
+
+
+def _caldb_device(device, caldb):
+   '''directory of a caldb.config device: CALDB or an environment variable'''
+   import os
+   if device.upper() == 'CALDB':
+      return caldb
+   return os.getenv(device,device)
+
+
+def caldb_index(mission, instrument, caldb=None):
+   '''Return the calibration index of the mission and instrument.
+
+   Parameters
+   ----------
+   mission, instrument : str
+      e.g., 'swift', 'uvota'
+   caldb : str, optional
+      the CALDB directory; default $CALDB
+
+   Returns
+   -------
+   index : dict
+      the columns of the CIF extension of caldb.indx as arrays, string
+      values upper case and stripped, with 'PATH' the full path of the
+      calibration file; only the entries with CAL_QUAL = 0 are kept.
+
+   Notes
+   -----
+   The index is read once, and read again when the file has changed.
+   Without a caldb.config entry $CALDB/data/<mission>/<instrument>/caldb.indx
+   is used.
+   '''
+   import os
+   import numpy as np
+   from astropy.io import fits
+
+   if caldb == None:
+      caldb = os.getenv('CALDB')
+   key = (mission.upper(),instrument.upper())
+   config = caldb_config(caldb)
+   if key in config:
+      indexfile, caldb = config[key]
+   else:
+      indexfile = os.path.join(caldb,'data',mission.lower(),instrument.lower(),'caldb.indx')
+   cachekey = (indexfile, os.path.getmtime(indexfile))
+   if cachekey in _caldb_index:
+      return _caldb_index[cachekey]
+
+   f = fits.open(indexfile)
+   data = f[1].data
+   index = {}
+   for name in ['TELESCOP','INSTRUME','DETNAM','FILTER','CAL_DIR','CAL_FILE','CAL_CNAM']:
+      index[name] = np.array([str(z).strip().upper() for z in data.field(name)])
+   index['CAL_CBD'] = np.array([[str(z).strip().upper() for z in row] for row in data.field('CAL_CBD')])
+   index['CAL_XNO'] = np.array(data.field('CAL_XNO'),dtype=int)
+   index['REF_TIME'] = np.array(data.field('REF_TIME'),dtype=float)
+   quality = np.array(data.field('CAL_QUAL'),dtype=int)
+   calpath = [os.path.join(caldb,d,n) for d, n in
+      zip(data.field('CAL_DIR'),data.field('CAL_FILE'))]
+   index['PATH'] = np.array([z.strip() for z in calpath])
+   f.close()
+   for name in list(index.keys()):
+      index[name] = index[name][quality == 0]
+   _caldb_index[cachekey] = index
+   return index
+
+
+def quzcif(mission, instrument, detector, filter, codename, date, time, expr='-',
+   caldb=None, chatter=0):
+   '''Select calibration files from the CALDB index, like the quzcif ftool.
+
+   Parameters
+   ----------
+   mission, instrument : str
+      e.g., 'swift', 'uvota' or 'swift', 'sc'
+   detector, filter : str
+      detector and filter name, '-' for any
+   codename : str
+      calibration code name, e.g., 'SPECRESP'
+   date, time : str
+      'yyyy-mm-dd', 'hh:mm:ss' of the observation, or 'now'
+   expr : str
+      boundary expression, e.g., 'wheelpos.eq.160', conditions joined
+      with '.and.'; '-' for none
+   caldb : str, optional
+      the CALDB directory; default $CALDB
+   chatter : int
+      verbosity
+
+   Returns
+   -------
+   files : list of (path, extension)
+      the files valid at the date with the most recent start of validity;
+      empty if there is none.
+   '''
+   import numpy as np
+
+   index = caldb_index(mission, instrument, caldb=caldb)
+   q = (index['TELESCOP'] == mission.upper()) & (index['INSTRUME'] == instrument.upper()) & \
+       (index['CAL_CNAM'] == codename.upper())
+   for name, value in [('DETNAM',detector),('FILTER',filter)]:
+      if value != '-':
+         q &= (index[name] == value.upper()) | (index[name] == 'INDEF')
+   mjd = _caldb_mjd(date, time)
+   q &= index['REF_TIME'] <= mjd
+   conditions = _caldb_expression(expr)
+   for k in np.where(q)[0]:
+      q[k] = _caldb_boundaries(index['CAL_CBD'][k], conditions)
+   k = np.where(q)[0]
+   if len(k) == 0:
+      if chatter > 0:
+         print("uvotcaldb.quzcif: no %s file for %s %s %s %s %s %s"%(codename,instrument,
+            detector,filter,date,time,expr))
+      return []
+   k = k[index['REF_TIME'][k] == index['REF_TIME'][k].max()]
+   files = [(str(index['PATH'][j]), int(index['CAL_XNO'][j])) for j in k]
+   if chatter > 1:
+      print("uvotcaldb.quzcif: ",files)
+   return files
+
+
+def _caldb_mjd(date, time):
+   '''MJD of the date and time strings; 'now' is later than any date'''
+   import datetime
+   if date.lower() == 'now':
+      return float('inf')
+   if (time == '-') or (time.lower() == 'now'):
+      time = '00:00:00'
+   t = datetime.datetime.strptime(date.strip()+' '+time.strip()[:8],'%Y-%m-%d %H:%M:%S')
+   dt = t - datetime.datetime(1858,11,17)
+   return dt.days + dt.seconds/86400.0
+
+
+def _caldb_expression(expr):
+   '''the conditions (PARAMETER, operator, value) of a boundary expression'''
+   conditions = []
+   if (expr == None) or (expr.strip() in ['','-']):
+      return conditions
+   for term in expr.upper().split('.AND.'):
+      par, op, value = term.strip().split('.',2)
+      conditions.append((par, op, value))
+   return conditions
+
+
+def _caldb_boundaries(cbd, conditions):
+   '''True if the boundaries CAL_CBD 'PAR(value)unit' of an index entry
+   satisfy the conditions; a parameter without boundary always does'''
+   bounds = {}
+   for z in cbd:
+      if ('(' in z) and (')' in z):
+         bounds[z.split('(')[0].strip()] = z.split('(')[1].split(')')[0].strip()
+   for par, op, value in conditions:
+      if not par in bounds:
+         continue
+      if not _caldb_compare(bounds[par], op, value):
+         return False
+   return True
+
+
+def _caldb_compare(bound, op, value):
+   '''compare the boundary value (value, lo-hi range or a|b list) and the value'''
+   options = bound.split('|')
+   try:
+      v = float(value)
+      ranges = []
+      for opt in options:
+         # a range lo-hi, where lo and hi may be negative
+         k = opt.find('-',1)
+         if k > 0:
+            ranges.append((float(opt[:k]),float(opt[k+1:])))
+         else:
+            ranges.append((float(opt),float(opt)))
+   except ValueError:
+      if op == 'EQ': return value in options
+      if op == 'NE': return value not in options
+      return False
+   if op == 'EQ': return any([(lo <= v) & (v <= hi) for lo, hi in ranges])
+   if op == 'NE': return not any([(lo <= v) & (v <= hi) for lo, hi in ranges])
+   if op == 'LT': return any([lo < v for lo, hi in ranges])
+   if op == 'LE': return any([lo <= v for lo, hi in ranges])
+   if op == 'GT': return any([hi > v for lo, hi in ranges])
+   if op == 'GE': return any([hi >= v for lo, hi in ranges])
+   raise ValueError("uvotcaldb: unknown operator .%s. in boundary expression"%(op))
+
+
+def caldb_hdulist(filename):
+   '''Open a calibration file, or return it when it was opened before.
+
+   The HDUList is kept open for the next call (and read again if the file
+   has changed), so do not close it.
+   '''
+   import os
+   from astropy.io import fits
+   key = (os.path.abspath(filename), os.path.getmtime(filename))
+   if not key in _caldb_hdus:
+      _caldb_hdus[key] = fits.open(filename)
+   return _caldb_hdus[key]
@@ -0,0 +1,296 @@
+# -*- coding: iso-8859-15 -*-
+#
+# This software was written by N.P.M. Kuin (Paul Kuin)
+# Copyright N.P.M. Kuin
+# All rights reserved
+# This software is licenced under a 3-clause BSD style license
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#Redistributions of source code must retain the above copyright notice,
+#this list of conditions and the following disclaimer.
+#
+#Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#Neither the name of the University College London nor the names
+#of the code contributors may be used to endorse or promote products
+#derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+#THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+#PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+#CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+#EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+#OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+#OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+#ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+   Calibration maps of the grism modes over the whole field.
+
+   The first and second order anchor, the angle of the spectrum, the
+   dispersion coefficients from the wavelength calibration file, and the
+   curvature coefficients of spec_curvature() are evaluated on a dense grid
+   of the input angles (Xphi, Yphi) covering the field of the calibration
+   file. The grid contains the grid points of the calibration file, so that
+   a bilinear lookup in the map gives the same result as the bilinear
+   interpolation done by getCalData().
+
+   The map is written as a .npy file and read as a memory map, so that all
+   processes using a map share the same pages of the OS file cache.
+'''
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from future.builtins import str
+from future.builtins import range
+
+__version__ = '0.1 20170620'
+
+import numpy as np
+
+# the quantities in the map; curvN_k is the coefficient of x**k of the
+# curvature polynomial of order N (highest term first in spec_curvature)
+calmap_channels = ('xp1','yp1','theta','c14','c13','c12','c11','c10',
+   'xp2','yp2','c22','c21','c20',
+   'curv0_1','curv0_0','curv1_3','curv1_2','curv1_1','curv1_0',
+   'curv2_2','curv2_1','curv2_0','curv3_1','curv3_0')
+
+# wavecal file columns of the channels, except the curvature
+_calmap_columns = {'xp1':'DETX1ANK','yp1':'DETY1ANK','theta':'SP1SLOPE',
+   'c14':'DISP1_4','c13':'DISP1_3','c12':'DISP1_2','c11':'DISP1_1','c10':'DISP1_0',
+   'xp2':'DETX2ANK','yp2':'DETY2ANK','c22':'DISP2_2','c21':'DISP2_1','c20':'DISP2_0'}
+
+_calmaps = {}
+
+
+def calmap_file(wheelpos, calfile, mapdir=None):
+   '''Return the path of the map file for wheelpos made from calfile.
+
+   The name contains a hash of the calfile path and modification time,
+   so a changed calibration file needs a new map.
+   '''
+   import os
+   import hashlib
+   from .uvotgetspec import _calcache_dir
+   if mapdir == None:
+      mapdir = _calcache_dir()
+   calfile = os.path.abspath(calfile)
+   key = repr((calfile, os.path.getmtime(calfile)))
+   return os.path.join(mapdir, 'calmap_%04i_%s.npy'%(wheelpos,
+      hashlib.md5(key.encode('utf-8')).hexdigest()[:16]))
+
+
+def make_calmap(wheelpos, calfile=None, caldir=None, refine=8, mapdir=None, chatter=1):
+   '''Evaluate the calibration on a dense grid and write the map.
+
+   Parameters
+   ----------
+   wheelpos : int, {160,200,955,1000}
+      filter wheel position selects grism
+   calfile : str
+      wavelength calibration file (default from uvotgetspec.get_wavecal_file)
+   caldir : str
+      directory of the calibration files
+   refine : int
+      number of map intervals in each interval of the calibration file grid
+   mapdir : str
+      directory for the map (default the calibration cache directory)
+   chatter : int
+      verbosity
+
+   Returns
+   -------
+   mapfile : str
+      path of the map. The map is an array (channel, Yphi, Xphi) of the
+      quantities in `calmap_channels`; the grid and the channel names are
+      in a .npz file with the same name.
+
+   Notes
+   -----
+   The anchor, angle and dispersion are interpolated bilinearly from the
+   calibration file, as getCalData(mode='bilinear') does. The curvature
+   coefficients are computed with spec_curvature() at the first order
+   anchor of each grid point.
+   '''
+   import os
+   try:
+      from astropy.io import fits as pyfits
+   except:
+      import pyfits
+   from .uvotgetspec import get_wavecal_file, spec_curvature
+
+   if calfile == None:
+      calfile = get_wavecal_file(wheelpos, caldir=caldir, chatter=chatter)
+   mapfile = calmap_file(wheelpos, calfile, mapdir=mapdir)
+   if chatter > 0: print("make_calmap: map of %s for wheelpos %i"%(calfile,wheelpos))
+
+   cal = pyfits.open(calfile)
+   data = cal[1].data
+   N1 = int(np.sqrt(len(data)))
+   if N1**2 != len(data):
+      raise RuntimeError("make_calmap: calfile array not square")
+   xf = data.field('PHI_X').reshape(N1,N1)
+   yf = data.field('PHI_Y').reshape(N1,N1)
+   x = xf[0,:]
+   y = yf[:,0]
+   ix = x.argsort()
+   iy = y.argsort()
+   x = x[ix]
+   y = y[iy]
+   xmap = _refine_axis(x, refine)
+   ymap = _refine_axis(y, refine)
+   kx, tx = _axis_weights(x, xmap)
+   ky, ty = _axis_weights(y, ymap)
+   columns = [col.upper() for col in cal[1].columns.names]
+
+   nchan = len(calmap_channels)
+   cmap = np.zeros((nchan,len(ymap),len(xmap)))
+   for k, name in enumerate(calmap_channels):
+      if not name in _calmap_columns:
+         continue
+      if not _calmap_columns[name] in columns:
+         # e.g., no DISP1_4 for wheelpos 955
+         continue
+      f = np.asarray(data.field(_calmap_columns[name]),dtype=float).reshape(N1,N1)[iy,:][:,ix]
+      fx = f[:,kx]*(1.-tx) + f[:,kx+1]*tx
+      cmap[k] = fx[ky,:]*(1.-ty)[:,np.newaxis] + fx[ky+1,:]*ty[:,np.newaxis]
+   cal.close()
+
+   # the curvature at the first order anchor of each grid point
+   if wheelpos < 500:
+      kxp1 = calmap_channels.index('xp1')
+      kyp1 = calmap_channels.index('yp1')
+      for order, ncoef in ((0,2),(1,4),(2,3),(3,2)):
+         k0 = calmap_channels.index('curv%i_%i'%(order,ncoef-1))
+         for j in range(len(ymap)):
+            for i in range(len(xmap)):
+               cmap[k0:k0+ncoef,j,i] = spec_curvature(wheelpos,
+                  [cmap[kxp1,j,i],cmap[kyp1,j,i]],order=order)
+         if chatter > 1: print("make_calmap: curvature order %i done"%(order))
+
+   mapdir = os.path.dirname(mapfile)
+   if not os.path.isdir(mapdir):
+      os.makedirs(mapdir)
+   # write to temporary files first, since other processes may read the maps
+   tmpstub = mapfile+'.%i'%(os.getpid())
+   f = open(tmpstub+'.npz','wb')
+   np.savez(f, x=xmap, y=ymap, channels=np.array(calmap_channels), wheelpos=wheelpos,
+      calfile=os.path.abspath(calfile), refine=refine)
+   f.close()
+   f = open(tmpstub,'wb')
+   np.save(f, cmap)
+   f.close()
+   os.rename(tmpstub+'.npz', mapfile[:-4]+'.npz')
+   os.rename(tmpstub, mapfile)
+   if chatter > 0: print("make_calmap: written %s %s"%(mapfile,str(cmap.shape)))
+   return mapfile
+
+
+def _refine_axis(a, refine):
+   '''grid with `refine` equal intervals in each interval of a, including the points of a'''
+   t = np.arange(refine)/refine
+   fine = (a[:-1,np.newaxis] + (a[1:]-a[:-1])[:,np.newaxis]*t[np.newaxis,:]).ravel()
+   return np.append(fine, a[-1])
+
+
+def _axis_weights(a, v):
+   '''index of the interval of a containing v, and the fractional position in it'''
+   k = np.searchsorted(a, v, side='right') - 1
+   k = np.clip(k, 0, len(a)-2)
+   t = (v - a[k])/(a[k+1] - a[k])
+   return k, np.clip(t, 0., 1.)
+
+
+def get_calmap(wheelpos, calfile=None, caldir=None, mapdir=None, build=True, chatter=0):
+   '''Return the CalMap for wheelpos and calfile, making the map if needed.
+
+   The maps are kept open in the process, so a map is read only once.
+   '''
+   import os
+   from .uvotgetspec import get_wavecal_file
+   if calfile == None:
+      calfile = get_wavecal_file(wheelpos, caldir=caldir, chatter=chatter)
+   mapfile = calmap_file(wheelpos, calfile, mapdir=mapdir)
+   if mapfile in _calmaps:
+      return _calmaps[mapfile]
+   if not os.access(mapfile, os.R_OK):
+      if not build:
+         raise IOError("get_calmap: no calibration map %s"%(mapfile))
+      make_calmap(wheelpos, calfile=calfile, mapdir=mapdir, chatter=chatter)
+   _calmaps[mapfile] = CalMap(mapfile, chatter=chatter)
+   return _calmaps[mapfile]
+
+
+class CalMap(object):
+   '''
+   Calibration map of a grism mode, read as a memory map.
+
+   Parameters
+   ----------
+   mapfile : str
+      map made by make_calmap()
+   chatter : int
+      verbosity
+
+   Notes
+   -----
+   lookup() takes scalar or array input angles Xphi, Yphi and returns the
+   bilinear interpolation in the map. Check inside() first; outside the
+   map the values at the border are returned.
+   '''
+
+   def __init__(self, mapfile, chatter=0):
+      meta = np.load(mapfile[:-4]+'.npz')
+      self.x = meta['x']
+      self.y = meta['y']
+      self.channels = [str(name) for name in meta['channels']]
+      self.wheelpos = int(meta['wheelpos'])
+      self.calfile = str(meta['calfile'])
+      meta.close()
+      self.mapfile = mapfile
+      self.data = np.load(mapfile, mmap_mode='r')
+      if chatter > 1:
+         print("CalMap: %s wheelpos %i grid %ix%i"%(mapfile,self.wheelpos,len(self.x),len(self.y)))
+
+   def inside(self, Xphi, Yphi):
+      '''True where (Xphi, Yphi) is inside the map'''
+      Xphi = np.asarray(Xphi)
+      Yphi = np.asarray(Yphi)
+      return (Xphi > self.x[0]) & (Xphi < self.x[-1]) & (Yphi > self.y[0]) & (Yphi < self.y[-1])
+
+   def lookup(self, Xphi, Yphi, channels=None):
+      '''Return a dictionary with the value of each channel at (Xphi, Yphi).'''
+      Xphi, Yphi = np.broadcast_arrays(np.asarray(Xphi,dtype=float), np.asarray(Yphi,dtype=float))
+      shape = Xphi.shape
+      kx, tx = _axis_weights(self.x, Xphi.ravel())
+      ky, ty = _axis_weights(self.y, Yphi.ravel())
+      if channels == None:
+         channels = self.channels
+      # gather the four corners of all channels at once  
+      kc = np.array([self.channels.index(name) for name in channels])[:,np.newaxis]
+      d = self.data
+      v = (d[kc,ky,kx]*((1.-tx)*(1.-ty)) + d[kc,ky,kx+1]*(tx*(1.-ty)) +
+           d[kc,ky+1,kx+1]*(tx*ty) + d[kc,ky+1,kx]*((1.-tx)*ty))
+      result = {}
+      for k, name in enumerate(channels):
+         if len(shape) == 0:
+            result[name] = float(v[k,0])
+         else:
+            result[name] = v[k].reshape(shape)
+      return result
+
+   def curvature(self, Xphi, Yphi, order=1):
+      '''the curvature coefficients as returned by spec_curvature() at the anchor for (Xphi, Yphi)'''
+      ncoef = {0:2,1:4,2:3,3:2}[order]
+      names = ['curv%i_%i'%(order,k) for k in range(ncoef-1,-1,-1)]
+      r = self.lookup(Xphi, Yphi, channels=names)
+      if self.wheelpos > 500:
+         names = names[-2:]
+      return np.array([r[name] for name in names])
@@ -97,6 +97,8 @@ if __name__ != '__main__':
       give_result = False # with this set, a call to getSpec returns all data 
       give_new_result = False
       use_rectext = False
+      strip_rotation = True  # extractSpecImg: resample only the rotated strip (False: rotate padded image)
+      use_calmap = False  # getCalData: look up anchor, angle and dispersion in the precomputed uvotcalmap maps
       background_method = 'boxcar'  # alternatives 'splinefit' 'boxcar'
       background_smoothing = [50,7]   # 'boxcar' default smoothing in dispersion and across dispersion in pix
       background_interpolation = 'linear'
@@ -115,6 +117,71 @@ fileversion=2
 calmode=True
 typeNone = type(None)
 senscorr = True # do sensitivity correction
+calspline_cache = True    # getCalData: keep fitted calibration splines in memory and on disk
+calspline_cachedir = None # directory of the spline cache (default $UVOTPY_CACHE or ~/.uvotpy/cache)
+_calspline_tck = {}
+_pix_from_wave_tables = {}
+
+
+class ExtractionContext(object):
+   '''
+   Parameters and run state of one spectral extraction.
+
+   Parameters
+   ----------
+   kwargs : dict, optional
+      values that replace the defaults, e.g.,
+      ExtractionContext(trackwidth=1.0, background_method='splinefit')
+
+   Notes
+   -----
+   The defaults are copied from the global parameters of this module at
+   the moment the context is made, so that resetting, e.g.,
+   `uvotgetspec.trackwidth` in a session before calling getSpec() still
+   works. The context is passed as `ctx` to getSpec() and the routines
+   it calls, instead of reading and changing the globals. Each context
+   keeps its own list of temporary files, so that several extractions can
+   be run in one process, e.g., from threads or a pool of workers.
+   Use a new context for each extraction.
+   '''
+   parameters = ('anchor_preset','bg_pix_limits','bg_lower_','bg_upper_',
+      'offsetlimit','do_coi_correction','interactive','update_curve',
+      'contour_on_img','give_result','give_new_result','use_rectext','strip_rotation','use_calmap',
+      'background_method','background_smoothing','background_interpolation',
+      'trackcentroiding','trackwidth','bluetrackwidth','write_RMF',
+      'background_source_mag','zeroth_blim_offset','coi_half_width',
+      '_PROFILE_BACKGROUND_','fileversion','calmode','senscorr')
+
+   def __init__(self, **kwargs):
+      import copy
+      defaults = globals()
+      for name in self.parameters:
+         setattr(self, name, copy.copy(defaults.get(name)))
+      for name in kwargs:
+         if name not in self.parameters:
+            raise KeyError("ExtractionContext: unknown parameter '%s'"%(name))
+         setattr(self, name, kwargs[name])
+      self.tempnames = list()
+      self.tempntags = list()
+
+   def add_tempfile(self,name,tag):
+      '''record a temporary file name with a tag'''
+      self.tempnames.append(name)
+      self.tempntags.append(tag)
+
+   def get_tempfile(self,tag):
+      '''return the temporary file name for tag, or None'''
+      if tag in self.tempntags:
+         return self.tempnames[self.tempntags.index(tag)]
+      return None
+
+
+def _get_context(ctx):
+   '''return ctx, or a new ExtractionContext from the globals if ctx is None'''
+   if ctx is None:
+      return ExtractionContext()
+   return ctx
+
 
 print(66*"=")
 print("uvotpy module uvotgetspec version=",__version__)
@@ -130,12 +197,12 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
       background_template=None,
       fixed_angle=None, spextwidth=13, curved="update",
       fit_second=False, predict2nd=True, skip_field_src=False,      
-      optimal_extraction=False, catspec=None,write_RMF=write_RMF,
+      optimal_extraction=False, catspec=None,write_RMF=None,
       get_curve=None,fit_sigmas=True,get_sigma_poly=False, 
       lfilt1=None, lfilt1_ext=None, lfilt2=None, lfilt2_ext=None,  
-      wheelpos=None, interactive=interactive,  sumimage=None, set_maglimit=None,
+      wheelpos=None, interactive=None,  sumimage=None, set_maglimit=None,
       plot_img=True, plot_raw=True, plot_spec=True, zoom=True, highlight=False, 
-      clobber=False, chatter=1 ):
+      clobber=False, chatter=1, ctx=None ):
       
    '''Makes all the necessary calls to reduce the data. 
    
@@ -307,6 +374,12 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
         determining background. Must be in counts. Size and alignment 
         must exactly match detector image.  
         
+      - **ctx** : ExtractionContext
+      
+        parameters and state for this extraction. When not given, a new 
+        context is made from the global parameters (see below). 
+        The *interactive* and *write_RMF* parameters, when given, 
+        override those in the context. 
   
    Returns 
    -------   
@@ -330,6 +403,8 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
    **Global parameters**
 
    These parameters can be reset, e.g., during a (i)python session, before calling getSpec.
+   They are the defaults for a new ExtractionContext, which can also be passed 
+   in as `ctx` with other values, e.g., `ctx=ExtractionContext(trackwidth=1.0)`.
   
    - **trackwidth** : float
      width spectral extraction in units of sigma. The default is trackwidth = 2.5
@@ -357,6 +432,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
      Version 2014-08-04 NPMK(MSSL/UCL): expanded offsetlimit parameter with list option to specify y-range.  
      Version 2015-12-03 NPMK(MSSL/UCL): change input parameter 'get_curve' to accept a file name with coefficients
      Version 2016-01-16 NPMK(MSSL/UCL): added options for background; disable automated centroiding of spectrum
+     Version 2017-06-20 : parameters and temporary file names are kept in an ExtractionContext 
 
    Example
    -------
@@ -413,6 +489,17 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
    if (type(RA) == np.ndarray) | (type(DEC) == np.array): 
       raise IOError("RA, and DEC arguments must be of float type ")
 
+   ctx = _get_context(ctx)
+   if interactive == None: 
+      interactive = ctx.interactive
+   else:
+      ctx.interactive = interactive   
+   if write_RMF == None: 
+      write_RMF = ctx.write_RMF
+   else:
+      ctx.write_RMF = write_RMF   
+   trackwidth = ctx.trackwidth
+
    if type(offsetlimit) == list:
        if len(offsetlimit) != 2:
            raise IOError("offsetlimit list must be [center, distance from center] in pixels")
@@ -471,10 +558,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
    attime = datetime.datetime.now()
    logfile = 'uvotgrism_'+obsid+'_'+str(ext)+'_'+'_'+attime.isoformat()[0:19]+'.log'
    if type(fluxcalfile) == bool: fluxcalfile = None
-   tempnames.append(logfile)
-   tempntags.append('logfile')
-   tempnames.append('rectext_spectrum.img')
-   tempntags.append('rectext')
+   ctx.add_tempfile(logfile,'logfile')
    lfiltnames=np.array(['uvw2','uvm2','uvw1','u','b','v','wh'])
    ext_names =np.array(['uw2','um2','uw1','uuu','ubb','uvv','uwh'])
    filestub = 'sw'+obsid
@@ -653,17 +737,21 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
       else: 
          method = None   
       
-      if not senscorr: msg += "WARNING: No correction for sensitivity degradation applied.\n"    
+      if not ctx.senscorr: msg += "WARNING: No correction for sensitivity degradation applied.\n"    
       # retrieve the input angle relative to the boresight       
       Xphi, Yphi, date1, msg3, lenticular_anchors = findInputAngle( RA, DEC, filestub, ext, msg="", \
            wheelpos=wheelpos, lfilter=lfilt1, lfilter_ext=lfilt1_ext, lfilt2=lfilt2, lfilt2_ext=lfilt2_ext, \
-           method=method, attfile=attfile, catspec=catspec, indir=indir, chatter=chatter)
+           method=method, attfile=attfile, catspec=catspec, indir=indir, chatter=chatter, ctx=ctx)
       Yout.update({"Xphi":Xphi,"Yphi":Yphi}) 
       Yout.update({'lenticular_anchors':lenticular_anchors})
 
       # read the anchor and dispersion out of the wavecal file                
+      if ctx.use_calmap:
+         calmode_ = 'calmap'
+      else:
+         calmode_ = 'bilinear'   
       anker, anker2, C_1, C_2, angle, calibdat, msg4 = getCalData(Xphi,Yphi,wheelpos, date1, \
-         calfile=calfile, chatter=chatter)    
+         calfile=calfile, mode=calmode_, chatter=chatter)    
          
       hdrr = pyfits.getheader(specfile,int(ext))
       if (hdrr['aspcorr'] == 'UNKNOWN') & (not lfiltpresent):
@@ -818,7 +906,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
       # get background
       bg, bg1, bg2, bgsig, bgimg, bg_limits_used, bgextra = findBackground(extimg,
          background_lower=background_lower,
-         background_upper=background_upper,)
+         background_upper=background_upper, ctx=ctx)
       skip_field_src = True
       spnet = bg1  # placeholder
       expo = exposure
@@ -845,7 +933,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
       exSpIm = extractSpecImg(specfile,ext,ankerimg,angle,spwid=spextwidth,
               background_lower=background_lower, background_upper=background_upper,
               template = background_template, 
-              offsetlimit=offsetlimit,  chatter=chatter)              
+              offsetlimit=offsetlimit,  chatter=chatter, ctx=ctx)              
       dis         = exSpIm['dis'] 
       spnet       = exSpIm['spnet'] 
       bg          = exSpIm['bg']
@@ -913,7 +1001,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
    if (not skip_field_src) & (sumimage == None):
       if chatter > 2: print("================== locate zeroth orders due to field sources =============")
       if wheelpos > 500: zeroth_blim_offset = 2.5 
-      ZOpos = find_zeroth_orders(filestub, ext, wheelpos,indir=indir,set_maglimit=set_maglimit,clobber="yes", chatter=chatter, )
+      ZOpos = find_zeroth_orders(filestub, ext, wheelpos,indir=indir,set_maglimit=set_maglimit,clobber="yes", chatter=chatter, ctx=ctx)
       Xim,Yim,Xa,Yb,Thet,b2mag,matched,ondetector = ZOpos
       pivot_ori=np.array([(ankerimg)[0],(ankerimg)[1]])
       Y_ZOpos={"Xim":Xim,"Yim":Yim,"Xa":Xa,"Yb":Yb,"Thet":Thet,"b2mag":b2mag,"matched":matched,"ondetector":ondetector}
@@ -984,7 +1072,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
              angle=angle,offset=offset,  poly_1=poly_1,poly_2=poly_2,poly_3=poly_3,
              msg=msg, curved=curved, outfull=True, expmap=expmap, fit_second=fit_second, 
              fit_third=fit_second, C_1=C_1,C_2=C_2,dist12=dist12, 
-             dropout_mask=dropout_mask, chatter=chatter) 
+             dropout_mask=dropout_mask, chatter=chatter, ctx=ctx) 
          # fit_sigmas parameter needs passing 
          
       (present0,present1,present2,present3),(q0,q1,q2,q3), (
@@ -1025,7 +1113,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
              angle=angle,offset=offset,  outfull=True, expmap=expmap, \
              msg = msg, curved=curved, fit_second=fit_second, 
              fit_third=fit_second, C_1=C_1,C_2=C_2,dist12=dist12, 
-             dropout_mask=dropout_mask, chatter=chatter) 
+             dropout_mask=dropout_mask, chatter=chatter, ctx=ctx) 
              
       (present0,present1,present2,present3),(q0,q1,q2,q3), \
           (y0,dlim0L,dlim0U,sig0coef,sp_zeroth,co_zeroth),(
@@ -1378,7 +1466,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
                         anker=anker, 
                         #option=1, fudgespec=1.32,
                         frametime=framtime, 
-                        debug=False,chatter=1)
+                        debug=False,chatter=1, ctx=ctx)
             #flux1_err = 0.5*(rate2flux(,,rate+err,,) - rate2flux(,,rate-err,,))
             p1, = plt.plot(wav1[np.isfinite(flux1)],flux1[np.isfinite(flux1)],
                            color='darkred',label=u'curved') 
@@ -1414,7 +1502,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
                #trackwidth = trackwidth, 
                anker=anker, #option=1, fudgespec=1.32,
                frametime=framtime, 
-               debug=False,chatter=1)
+               debug=False,chatter=1, ctx=ctx)
             p3, = plt.plot(wav1, flux1,'g',alpha=0.5,ls='steps',lw=2,label='optimal' )
             p4, = plt.plot(wav1,flux1,'k',alpha=0.5,ls='steps',lw=2,label='_nolegend_' )
             plt.legend([p1,p2,p3],['curved','suspect','optimal'],loc=0,)
@@ -1437,7 +1525,7 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
                        co_sprate = co_second[q2[0]]/expospec[2,[q2[0]]],
                        co_bgrate = co_back [q2[0]]/expospec[2,[q2[0]]],
                        frametime=framtime, 
-                       spectralorder=2,swifttime=tstart,)
+                       spectralorder=2,swifttime=tstart, ctx=ctx)
                #flux1_err = rate2flux(wave,rate_err, wheelpos, spectralorder=1,)
                plt.cla()
                p1, = plt.plot(wav2,flux2,'r',label='curved')        
@@ -1492,13 +1580,13 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
                  offset,ank_c2,extimg, C_1, 
                  history=None,chatter=1,
                  clobber=clobber, 
-                 calibration_mode=calmode,
+                 calibration_mode=ctx.calmode,
                  interactive=interactive)  
                   
       elif not optimal_extraction:
-         if fileversion == 2:
+         if ctx.fileversion == 2:
             Y = Yout
-         elif fileversion == 1:
+         elif ctx.fileversion == 1:
             Y = (Y0,Y1,Y2,Y4)
          F = uvotio.writeSpectrum(RA,DEC,filestub,ext, Y,  
               fileoutstub=outfile, 
@@ -1507,9 +1595,9 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
               write_rmffile=write_RMF, fileversion=2,
               used_lenticular=use_lenticular_image,
               history=msg, 
-              calibration_mode=calmode,
+              calibration_mode=ctx.calmode,
               chatter=chatter, 
-              clobber=clobber ) 
+              clobber=clobber, ctx=ctx ) 
           
             
       elif optimal_extraction:
@@ -1524,8 +1612,8 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
    #   pass
        
    # clean up fake file 
-   if tempntags.__contains__('fakefilestub'):
-         filestub = tempnames[tempntags.index('fakefilestub')]
+   if ctx.tempntags.__contains__('fakefilestub'):
+         filestub = ctx.get_tempfile('fakefilestub')
          os.system('rm '+indir+filestub+'ufk_??.img ')
 
    # update Figure 3 to use the flux...
@@ -1542,8 +1630,8 @@ def getSpec(RA,DEC,obsid, ext, indir='./', wr_outfile=True,
    flog.write(msg2)
    flog.close()
        
-   if give_result: return Y0, Y1, Y2, Y3, Y4   
-   if give_new_result: return Yout
+   if ctx.give_result: return Y0, Y1, Y2, Y3, Y4   
+   if ctx.give_new_result: return Yout
 
 
 
@@ -1551,7 +1639,7 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
         searchwidth=35,spwid=13,offsetlimit=None, fixoffset=None, 
         background_lower=[None,None], background_upper=[None,None],
         template=None,
-        clobber=True,chatter=2):
+        clobber=True,chatter=2, ctx=None):
    '''
    extract the grism image of spectral orders plus background
    using the reference point at 2600A in first order.
@@ -1571,10 +1659,17 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       it should be set to a smaller value)      
    template : dictionary    
       template for the background. 
-      
    use_rectext : bool
-      If True then the HEADAS uvotimgrism program rectext is used to extract the image 
+      (from ctx) If True then the image is extracted with the flux conserving 
+      (area weighted) resampling of the strip used by the HEADAS uvotimgrism program 
+      rectext, computed in memory by area_rotate_strip(). 
       This is a better way than using ndimage.rotate() which does some weird smoothing.
+      
+   strip_rotation : bool
+      (from ctx) If True, only the 200 pixel wide strip around the rotated spectrum 
+      is resampled from the image, instead of rotating the whole padded image. 
+      The result is the same. The image, template and dropout mask 
+      are resampled together by rotate_strip_channels().  
    
    offsetlimit : None, float/int, list
       if None, search for y-offset predicted anchor to spectrum using searchwidth 
@@ -1582,6 +1677,9 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       if list, two elements, no more. [y-value, delta-y] for search of offset.
       if delta-y < 1, fixoffset = y-value. 
       
+   ctx : ExtractionContext
+      parameters (use_rectext, interactive) and temporary file names of the 
+      extraction. If None, a context is made from the global parameters. 
    
    History
    -------
@@ -1592,6 +1690,8 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
    2014-02-28 Add template for the background as an option 
    2014-08-04 add option to provide a 2-element list for the offsetlimit to constrain 
      the offset search range.   
+   2017-06-20 resample only the extracted strip (strip_rotation), all channels in one pass  
+   2017-06-20 use_rectext: in memory area weighted resampling replaces the rectext program
    ''' 
    import numpy as np
    import os, sys
@@ -1603,6 +1703,8 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
    
    #out_of_img_val = -1.0123456789 now a global 
    
+   ctx = _get_context(ctx)
+   use_rectext = ctx.use_rectext
    Tmpl = (template != None)
    if Tmpl:
       if template['sumimg']:
@@ -1649,6 +1751,20 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       c2 = int(c2)
       if chatter > 3: print('array info : ',img.shape,d1,d2,n1,n2,c1,c2)
    
+   if (not use_rectext) & ctx.strip_rotation:
+      # the padded array a (see below) is not made; the same mean of the padded 
+      # array replaces bad data
+      dropouts = False
+      img = np.array(img,dtype=float)
+      aanan = np.isnan(img)
+      npad = n1*n2 - img.size
+      aaave = (img[np.isfinite(img)].sum() + npad*cval)/(np.isfinite(img).sum() + npad) 
+      img[aanan] = aaave
+      if aanan.any():
+         dropouts = True
+         print("extractSpecImg WARNING: BAD IMAGE DATA fixed by setting to mean of good data whole image ") 
+         
+   elif not use_rectext:
       # the ankor is now centered in array a; initialize a with out_of_img_val
       a = np.zeros( (n1,n2), dtype=float) + cval
       if Tmpl : a_ = np.zeros( (n1,n2), dtype=float) + cval
@@ -1675,7 +1791,18 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       theta = 180.0 - angle
    else: theta = angle      
    
-   if not use_rectext:
+   if (not use_rectext) & ctx.strip_rotation:
+      e2 = int(0.5*n1)
+      rows = (e2-100,e2+100)
+      channels = [img, None, None]
+      if Tmpl: channels[1] = template['template']
+      if dropouts: channels[2] = aanan
+      c, c_, aanan_ = rotate_strip_channels(channels,theta,(n1,n2),(c1,c2),rows,
+         cval=[cval,cval,0])
+      if dropouts: aanan = aanan_
+      ank_c = [ (c.shape[0]-1)/2+1, (c.shape[1]-1)/2+1 , 0, c.shape[1]]
+      
+   elif not use_rectext:
       b = ndimage.rotate(a,theta,reshape = False,order = 1,mode = 'constant',cval = cval)
       if Tmpl: 
          b_ = ndimage.rotate(a_,theta,reshape = False,order = 1,mode = 'constant',cval = cval)
@@ -1689,9 +1816,7 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       
    if use_rectext:
       # history: rectext is a fortran code that maintains proper density of quantity when 
-      #   performing a rotation. 
-      # build the command for extracting the image with rectext   
-      outfile= tempnames[tempntags.index('rectext')]
+      #   performing a rotation. The same strip geometry is now resampled in memory.
       cosangle = np.cos(theta/180.*np.pi)
       sinangle = np.sin(theta/180.*np.pi)
       # distance anchor to pivot 
@@ -1706,21 +1831,21 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       x0 = anker[0] - dx_ank*cosangle  + dy/2.*sinangle
       y0 = anker[1] - dx_ank*sinangle  - dy/2.*cosangle
 
-      command= "rectext infile="+file+"+"+str(ext)
-      command+=" outfile="+outfile
-      command+=" angle="+str(theta)+" width="+str(dx)
-      command+=" height="+str(dy)+" x0="+str(x0)+" y0="+str(y0)
-      command+=" null="+str(cval)
-      command+=" chatter=5 clobber=yes"
-      print(command)
-      os.system(command)
-      c = extimg = pyfits.getdata(outfile,0)
+      if chatter > 1: 
+         print("area weighted strip: angle=%s width=%i height=%i x0=%s y0=%s"%(theta,dx,dy,x0,y0))
+      img = np.array(img,dtype=float)
+      aanan = np.isnan(img)
+      dropouts = aanan.any()
+      if dropouts:
+         img[aanan] = img[np.isfinite(img)].mean()
+         print("extractSpecImg WARNING: BAD IMAGE DATA fixed by setting to mean of good data whole image ") 
+      channels = [img, None, None]
+      if Tmpl: channels[1] = template['template']
+      if dropouts: channels[2] = aanan
+      c, c_, aanan_ = area_rotate_strip(channels,theta,x0,y0,dx,dy,cval=cval)
+      if dropouts: aanan = aanan_
+      extimg = c
       ank_c = np.array([100,dx_ank,0,extimg.shape[1]])
-      # out_of_img_val = 0.
-      if clobber:
-         os.system("rm "+outfile)
-      if Tmpl: 
-         raise("background_template cannot be used with use_rectext option")     
        
    # version 2016-01-16 revision:
    #   the background can be extracted via a method from the strip image 
@@ -1783,7 +1908,7 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
               if abs(offset) >= offsetlimit: 
                  offset = 0 
                  print('This is larger than the offsetlimit. The offset has been set to 0')
-                 if interactive: 
+                 if ctx.interactive: 
                     offset = float(input('Please give a value for the offset:  '))
    else: 
        offset = fixoffset       
@@ -1809,7 +1934,8 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
       print('Extraction limits across dispersion: splim1,splim2 = ',splim1,' - ',splim2)
       
    bg, bg1, bg2, bgsigma, bgimg, bg_limits, bgextras = findBackground(c, 
-       background_lower=background_lower, background_upper=background_upper,yloc_spectrum=ank_c[0] )
+       background_lower=background_lower, background_upper=background_upper,yloc_spectrum=ank_c[0],
+       ctx=ctx )
        
    bgmean = bg
    bg = 0.5*(bg1+bg2)
@@ -1834,6 +1960,232 @@ def extractSpecImg(file,ext,anker,angle,anker0=None,anker2=None, anker3=None,\
    
 
 
+def area_rotate_strip(channels,angle,x0,y0,width,height,cval=cval,subpix=4):
+   '''
+   Flux conserving (area weighted) resampling of a rotated strip, with the 
+   geometry of the HEADAS uvotimgrism program rectext.
+   
+   Parameters
+   ----------
+   channels : list 
+      2D arrays of the same shape, e.g., [image, background template, 
+      dropout mask]; None entries are passed through. 
+   angle : float
+      angle of the strip x-axis from the image x-axis, in degrees
+   x0, y0 : float
+      pivot: image position (FITS convention, first pixel centre at 1,1) 
+      of the corner of the strip at strip (x,y) = (0,0)  
+   width, height : int
+      size of the strip in pixels along and across the strip x-axis
+   cval : float
+      value for strip pixels mostly outside the image. Boolean channels 
+      use False.  
+   subpix : int
+      each strip pixel is sampled on a subpix x subpix grid
+      
+   Returns
+   -------
+   strips : list
+      the (height,width) strip of each channel. A float channel pixel is the 
+      area weighted mean of the image pixels it covers; a boolean channel 
+      pixel is True if any of the covered pixels is True.    
+      
+   Notes
+   -----
+   The strip pixel area covering each image pixel is estimated by counting 
+   the sub-pixel centres that fall in it, so the value of a strip pixel is 
+   the input averaged over its area, and the flux of the image is kept. 
+   Strip pixels with less than half their area on the image are set to 
+   `cval`; the partly covered ones are normalised by their area on the image.  
+   '''
+   import numpy as np
+   
+   used = [k for k in range(len(channels)) if type(channels[k]) != typeNone]
+   if len(used) == 0: 
+      return list(channels)
+   imgshape = np.asarray(channels[used[0]]).shape
+   stack = np.empty((len(used),imgshape[0]*imgshape[1]),dtype=float)
+   isbool = []
+   for i,k in enumerate(used):
+      ch = np.asarray(channels[k])
+      if ch.shape != imgshape: 
+         raise ValueError("area_rotate_strip: channel %i has shape %s, not %s"%(k,ch.shape,imgshape))
+      isbool.append(ch.dtype == bool)
+      stack[i] = ch.ravel()
+      
+   theta = angle*np.pi/180.
+   cs, sn = np.cos(theta), np.sin(theta)
+   u = np.arange(width,dtype=float)[np.newaxis,:]
+   v = np.arange(height,dtype=float)[:,np.newaxis]
+   total = np.zeros((len(used),height,width),dtype=float)
+   anyset = np.zeros((len(used),height,width),dtype=bool)
+   covered = np.zeros((height,width),dtype=float)
+   for k in range(subpix):
+      for l in range(subpix):
+         uu = u + (k+0.5)/subpix
+         vv = v + (l+0.5)/subpix
+         # array index of the image pixel containing the sub-pixel centre 
+         col = np.floor(x0 + uu*cs - vv*sn - 0.5).astype(int)
+         row = np.floor(y0 + uu*sn + vv*cs - 0.5).astype(int)
+         inside = (col >= 0) & (col < imgshape[1]) & (row >= 0) & (row < imgshape[0])
+         index = np.where(inside, row*imgshape[1]+col, 0)
+         values = stack[:,index]*inside
+         total += values
+         anyset |= (values != 0)
+         covered += inside
+   strips = list(channels)
+   good = covered >= 0.5*subpix*subpix
+   for i,k in enumerate(used):
+      if isbool[i]:
+         strips[k] = anyset[i] & good
+      else:
+         out = np.zeros((height,width),dtype=float) + cval
+         out[good] = total[i][good]/covered[good]
+         strips[k] = out
+   return strips
+      
+
+def strip_geometry(angle,shape,corner,rows,imgshape,npad=2):
+   '''
+   Bilinear sampling geometry of a rotated strip for rotate_strip_channels().
+   
+   Parameters
+   ----------
+   angle : float
+      rotation angle in degrees as used by scipy.ndimage.rotate()
+   shape : list
+      (n1,n2) shape of the padded array
+   corner : list
+      (c1,c2) position of img[0,0] in the padded array 
+   rows : list
+      first and last+1 row of the strip in the rotated padded array  
+   imgshape : list
+      shape of the input image(s)
+   npad : int
+      width of the `cval` border added around the input image(s)  
+   
+   Returns
+   -------
+   geometry : dict
+      'index' : flat index of the lower-left neighbour in the padded image, 
+      'weights' : the four bilinear weights (ll, lr, ul, ur), 
+      'outside' : boolean array of strip points outside the padded image,
+      'padshape' : shape of the padded image, 'npad' : border width,
+      'imgshape' : input image shape. 
+      
+   Notes
+   -----
+   The output coordinates of the strip are mapped back to the image with 
+   the same rotation matrix as ndimage.rotate(). Only (rows[1]-rows[0]) x n2 
+   points are computed, and the padded array is not made.   
+   '''
+   import numpy as np
+   
+   n1, n2 = shape
+   c1, c2 = corner
+   ny = imgshape[0]+2*npad
+   nx = imgshape[1]+2*npad
+   theta = angle*np.pi/180.
+   cs, sn = np.cos(theta), np.sin(theta)
+   ctr1 = 0.5*(n1-1) ; ctr2 = 0.5*(n2-1)
+   yy = np.arange(rows[0],rows[1],dtype=float)[:,np.newaxis] - ctr1 
+   xx = np.arange(n2,dtype=float)[np.newaxis,:] - ctr2
+   y =  cs*yy + sn*xx + ctr1 - c1 + npad 
+   x = -sn*yy + cs*xx + ctr2 - c2 + npad
+   outside = (y < 0) | (y > ny-1) | (x < 0) | (x > nx-1)
+   i0 = np.clip(np.floor(y),0,ny-2).astype(int)
+   j0 = np.clip(np.floor(x),0,nx-2).astype(int)
+   fy = y - i0
+   fx = x - j0
+   weights = ((1.-fy)*(1.-fx), (1.-fy)*fx, fy*(1.-fx), fy*fx)
+   return {'index':i0*nx+j0, 'weights':weights, 'outside':outside, 
+           'padshape':(ny,nx), 'npad':npad, 'imgshape':tuple(imgshape)}
+      
+
+def rotate_strip_channels(channels,angle,shape,corner,rows,cval=cval,geometry=None):
+   '''
+   Resample the rotated strip of several aligned images in one pass. 
+   
+   Parameters
+   ----------
+   channels : list 
+      2D arrays of the same shape, e.g., [image, background template, 
+      dropout mask]; None entries are passed through. 
+   angle, shape, corner, rows : 
+      as for strip_geometry()
+   cval : float or list
+      value outside the image, one for all channels or one per channel. 
+      Boolean channels always use False.  
+   geometry : dict
+      result of strip_geometry(), if already computed for these parameters 
+      
+   Returns
+   -------
+   strips : list
+      the rotated strip for each channel (None for None). Boolean channels 
+      are returned as boolean arrays, True where all four neighbours are True. 
+      
+   Notes
+   -----
+   For each float channel this gives (to rounding) ndimage.rotate(a,angle,reshape=False,
+   order=1,mode='constant',cval=cval)[rows[0]:rows[1],:], where `a` is an 
+   array of `shape` filled with `cval` with the channel placed at `corner`.
+   The coordinates and bilinear weights are computed only once, and the 
+   neighbouring pixels of all channels are taken together from a stack.
+   
+   A boolean channel (the dropout mask) is a superset of the ndimage.rotate() 
+   result: ndimage truncates the interpolated value to False unless it is 1, 
+   and inside a masked area the sum of the bilinear weights may come out 
+   1-1e-16, so some pixels with four True neighbours are dropped at random. 
+   Those pixels lie inside the bad data, so here they are kept in the mask 
+   (about 1-2% of the masked pixels; no other pixels differ).  
+   '''
+   import numpy as np
+   
+   used = [k for k in range(len(channels)) if type(channels[k]) != typeNone]
+   if len(used) == 0: 
+      return list(channels)
+   if np.isscalar(cval): 
+      cval = [cval]*len(channels)
+   imgshape = np.asarray(channels[used[0]]).shape
+   if geometry == None:
+      geometry = strip_geometry(angle,shape,corner,rows,imgshape)
+   ny, nx = geometry['padshape']
+   npad = geometry['npad']
+   
+   isbool = []
+   fill = np.empty((len(used),1))
+   stack = np.empty((len(used),ny,nx),dtype=float)
+   for i,k in enumerate(used):
+      ch = np.asarray(channels[k])
+      if ch.shape != imgshape: 
+         raise ValueError("rotate_strip_channels: channel %i has shape %s, not %s"%(k,ch.shape,imgshape))
+      isbool.append(ch.dtype == bool)
+      if isbool[-1]: 
+         fill[i] = 0.
+      else:
+         fill[i] = cval[k]   
+      stack[i,:,:] = fill[i]
+      stack[i,npad:npad+imgshape[0],npad:npad+imgshape[1]] = ch
+   stack = stack.reshape(len(used),ny*nx)
+   
+   index = geometry['index'].ravel()
+   w00,w01,w10,w11 = [w.ravel() for w in geometry['weights']]
+   values = ( w00*stack[:,index] + w01*stack[:,index+1] + 
+              w10*stack[:,index+nx] + w11*stack[:,index+nx+1] )
+   outside = geometry['outside'].ravel()
+   values[:,outside] = fill
+   values = values.reshape((len(used),)+geometry['outside'].shape)
+   
+   strips = list(channels)
+   for i,k in enumerate(used):
+      if isbool[i]:
+         strips[k] = values[i] > 1.0-1e-10
+      else:
+         strips[k] = values[i]
+   return strips
+   
+
 def sigclip1d_mask(array1d, sigma, badval=None, conv=1e-5, maxloop=30):
     """ 
     sigma clip array around mean, using number of sigmas 'sigma' 
@@ -1867,6 +2219,51 @@ def sigclip1d_mask(array1d, sigma, badval=None, conv=1e-5, maxloop=30):
     valid[valid] = y[valid] < ymean + sigma*yv.std()
     return valid 
 
+def sigclip_columns_mask(img, sigma, badval=None, conv=1e-5, maxloop=30):
+    """ 
+    sigma clip each column of img like sigclip1d_mask(), but for all 
+    columns at once: the clipping is iterated for the columns that have 
+    not yet converged.
+    
+    return good mask of the shape of img
+    """
+    import numpy as np
+    
+    y = np.asarray(img)
+    if badval != None: 
+        valid = (np.abs(y - badval) > 1e-6) & np.isfinite(y)
+    else:
+        valid = np.isfinite(y)
+    y = np.where(valid, y, 0.)
+    ymean, ystd = masked_column_stats(y, valid)
+    use = valid & (y < ymean + sigma*ystd) 
+    ym_ = ymean
+    ymean, ystd = masked_column_stats(y, use)
+    loop = np.abs(ym_-ymean) > conv*np.abs(ymean)
+    
+    while loop.any() & (maxloop > 0):
+         ym_ = np.where(loop, ymean, ym_)
+         use &= (y < ymean + sigma*ystd) | ~loop
+         ym, ys = masked_column_stats(y, use)
+         ymean = np.where(loop, ym, ymean)
+         ystd = np.where(loop, ys, ystd)
+         loop &= np.abs(ym_-ymean) > conv*np.abs(ymean)
+         maxloop -= 1
+          
+    return valid & (y < ymean + sigma*ystd)
+
+def masked_column_stats(img, mask):
+    """ 
+    return the mean and standard deviation of the pixels in each column
+    of img where mask is True (NaN for a column without such pixels) 
+    """
+    import numpy as np
+    n = mask.sum(axis=0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        mean = np.where(mask, img, 0.).sum(axis=0)/n
+        std = np.sqrt(np.where(mask, (img-mean)**2, 0.).sum(axis=0)/n)
+    return mean, std
+
 def background_profile(img, smo1=30, badval=None):
     """
     helper routine to determine for the rotated image 
@@ -1880,32 +2277,17 @@ def background_profile(img, smo1=30, badval=None):
     ny = bgimg.shape[0]  # width of the image
    
     # look at the summed rows of the image
-    u_ysum = []
-    for i in range(ny):
-       u_ysum.append(bgimg[i,:].mean())
-    u_ysum = np.asarray(u_ysum)   
+    u_ysum = bgimg.mean(axis=1)
     u_ymask = sigclip1d_mask(u_ysum, 2.5, badval=badval, conv=1e-5, maxloop=30)
     u_ymean = u_ysum[u_ymask].mean()
    
-    # look at the summed columns after filtering bad rows
+    # look at the summed columns after filtering bad rows; clip all columns at once
     u_yindex = np.where(u_ymask)[0]
-    u_xsum = []
-    u_std  = []
-    for i in range(nx): 
-        u_x1 = bgimg[u_yindex, i].squeeze()
-        # clip u_x1 
-        u_x1mask = sigclip1d_mask(u_x1, 2.5, badval=None, conv=1e-5, maxloop=30)
-        u_xsum.append(u_x1[u_x1mask].mean())
-        u_std.append(u_x1[u_x1mask].std())
-        #print u_x1[u_x1mask]
-        #if np.isfinite(u_x1mask.mean()) & len(u_x1[u_x1mask])>0:
-        #  print "%8.2f   %8.2f   %8.2f "%(u_x1[u_x1mask].mean(),u_x1[u_x1mask].std(),u_x1[u_x1mask].max())
+    u_x1 = bgimg[u_yindex, :]
+    u_x1mask = sigclip_columns_mask(u_x1, 2.5, badval=None, conv=1e-5, maxloop=30)
     # the best background estimate of the typical row is now u_xsum
     # fit a smooth spline through the u_xsum values (or boxcar?)
-    #print "u_x means "
-    #print u_xsum
-    u_xsum = np.asarray(u_xsum) 
-    u_std = np.asarray(u_std)
+    u_xsum, u_std = masked_column_stats(u_x1, u_x1mask)
     u_xsum_ok = np.isfinite(u_xsum)
     bg_tcp = interpolate.splrep(np.arange(nx)[u_xsum_ok],
              np.asarray(u_xsum)[u_xsum_ok], s=smo1)  
@@ -1916,7 +2298,7 @@ def background_profile(img, smo1=30, badval=None):
 
 
 def findBackground(extimg,background_lower=[None,None], background_upper=[None,None],yloc_spectrum=100, 
-    smo1=None, smo2=None, chatter=2):
+    smo1=None, smo2=None, chatter=2, ctx=None):
    '''Extract the background from the image slice containing the spectrum.
    
    Parameters
@@ -1935,6 +2317,9 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
       smoothing parameter passed to smoothing spline fitting routine. `None` for default. 
    chatter : int
       verbosity
+   ctx : ExtractionContext
+      parameters of the extraction (background_method, background_smoothing, 
+      _PROFILE_BACKGROUND_). If None, a context is made from the global parameters.  
       
    Returns
    -------
@@ -1955,7 +2340,7 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
    Notes
    -----
    
-   **Global parameter**
+   **Global parameter** (or from `ctx`)
    
      - **background_method** : {'boxcar','splinefit'}
 
@@ -1996,18 +2381,20 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
           A solution would be to derive a global background     
    -  30 Sep 2014: background fails in visible grism e.g., 57977004+1 nearby bright spectrum 
           new method added (4x slower processing) to screen the image using sigma clipping      
+   -  2017-06-20 clipping, filling and interpolation as whole-array operations
       '''
    import sys   
    import numpy as np   
-   try:
-     from convolve import boxcar
-   except:
-     from stsci.convolve import boxcar
+   from .uvotsmooth import boxcar
    from scipy import interpolate  
    import stsci.imagestats as imagestats    
      
    # initialize parameters
    
+   ctx = _get_context(ctx)
+   background_method = ctx.background_method
+   background_smoothing = ctx.background_smoothing
+   
    bgimg    = extimg.copy()
    out    = np.where( (np.abs(bgimg-cval) <= 1e-6) )
    in_img = np.where( (np.abs(bgimg-cval) >  1e-6) & np.isfinite(bgimg) )
@@ -2017,14 +2404,10 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
    # sigma screening of background taking advantage of the dispersion being 
    # basically along the x-axis 
    
-   if _PROFILE_BACKGROUND_:
+   if ctx._PROFILE_BACKGROUND_:
       bg, u_x, bg_sig = background_profile(bgimg, smo1=30, badval=cval)
-      u_mask = np.zeros((ny,nx),dtype=bool)
-      for i in range(ny):
-          u_mask[i,(bgimg[i,:].flatten() < u_x) & 
-                np.isfinite(bgimg[i,:].flatten())] = True
+      u_mask = (bgimg < u_x[np.newaxis,:]) & np.isfinite(bgimg)
                 
-      bkg_sc = np.zeros((ny,nx),dtype=float)
       # the following leaves larger disps in the dispersion but less noise; 
       # tested but not implemented, as it is not as fast and the mean results 
       # are comparable: 
@@ -2035,11 +2418,10 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
       #    ucol = bkg_sc[:,i]
       #    if len(ucol[ucol != cval]) > 0:
       #        ucol[ucol == cval] = ucol[ucol != cval].mean()   
-      for i in range(nx):
-          ucol = bgimg[:,i]
-          if len(ucol[u_mask[:,i]]) > 0: 
-              ucol[np.where(u_mask[:,i] == False)[0] ] = ucol[u_mask[:,i]].mean()
-          bkg_sc[:,i] = ucol                        
+      # fill the masked pixels of each column with the mean of the column
+      u_colmean, u_colstd = masked_column_stats(bgimg, u_mask)
+      u_fill = (~u_mask) & u_mask.any(axis=0)[np.newaxis,:]
+      bkg_sc = np.where(u_fill, u_colmean[np.newaxis,:], bgimg).astype(float)
       if background_method == 'sigmaclip':
           return bkg_sc  
       else:
@@ -2157,24 +2539,18 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
    if background_method == 'boxcar': 
       bg1 = bg1_dis = bg1.mean(0)
       bg2 = bg2_dis = bg2.mean(0)
-      bg1_dis_good = np.zeros(nx,dtype=bool)
-      bg2_dis_good = np.zeros(nx,dtype=bool)
-      for i in range(nx):
-        bg1_dis_good[i] = np.where(bool(int(bg1_good[:,i].mean(0))))
-        bg2_dis_good[i] = np.where(bool(int(bg2_good[:,i].mean(0))))
+      # the smoothed background is used in every column
+      bg1_dis_good = np.ones(nx,dtype=bool)
+      bg2_dis_good = np.ones(nx,dtype=bool)
       
    if background_method == 'splinefit':  
    
       #  mean bg1_dis, bg2_dis across dispersion 
       
-      bg1_dis = np.zeros(nx) ; bg2_dis = np.zeros(nx)
-      for i in range(nx):
-         bg1_dis[i] = bg1[:,i][bg1_good[:,i]].mean()
-         if not bool(int(bg1_good[:,i].mean())): 
-            bg1_dis[i] = cval      
-         bg2_dis[i] = bg2[:,i][bg2_good[:,i]].mean()  
-         if not bool(int(bg2_good[:,i].mean())): 
-            bg2_dis[i] = cval
+      # only columns that are good over the whole region are used; the 
+      # transposed copy makes the mean of each column a contiguous row mean
+      bg1_dis = np.where(bg1_good.all(axis=0), bg1.T.copy().mean(axis=1), cval)
+      bg2_dis = np.where(bg2_good.all(axis=0), bg2.T.copy().mean(axis=1), cval)
       
       # some parts of the background may have been masked out completely, so 
       # find the good points and the bad points   
@@ -2219,37 +2595,32 @@ def findBackground(extimg,background_lower=[None,None], background_upper=[None,N
    
    # image constructed from linear inter/extra-polation of bg1 and bg2
    
-   bgimg_lin = np.zeros(ny*nx).reshape(ny,nx)
    dbgdy = (bg2-bg1)/(ny-1)
-   for i in range(ny):
-      bgimg_lin[i,:] = bg1 + dbgdy*i
+   bgimg_lin = bg1 + dbgdy*np.arange(ny)[:,np.newaxis]
+   rows = np.arange(bgimg.shape[0])[:,np.newaxis]
       
    # interpolate background and generate smooth interpolation image 
    if ( (background_lower[0] == None) & (background_upper[0] == None)):
         # default background region
         dbgdy = (bg2-bg1)/150.0 # assuming height spectrum 200 and width extraction regions 30 pix each
-        for i9 in range(bgimg.shape[0]):
-           bgimg[i9,kx0:kx1] = bg1[kx0:kx1] + dbgdy[kx0:kx1]*(i9-25)
-           bgimg[i9,0:kx0] = bg2[0:kx0]
-           bgimg[i9,kx1:nx] = bg2[kx1:nx]
+        bgimg[:,kx0:kx1] = bg1[kx0:kx1] + dbgdy[kx0:kx1]*(rows-25)
+        bgimg[:,0:kx0] = bg2[0:kx0]
+        bgimg[:,kx1:nx] = bg2[kx1:nx]
         if chatter > 2: print("1..BACKGROUND DEFAULT from BG1 and BG2")   
    elif ((background_lower[0] != None) & (background_upper[0] == None)):
      # set background to lower background region   
-        for i9 in range(bgimg.shape[0]):
-           bgimg[i9,:] = bg1 
+        bgimg[:,:] = bg1 
         if chatter > 2: print("2..BACKGROUND from lower BG1 only")   
    elif ((background_upper[0] != None) & (background_lower[0] == None)):
      # set background to that of upper background region   
-        for i9 in range(bgimg.shape[0]):
-           bgimg[i9,:] = bg2
+        bgimg[:,:] = bg2
         if chatter > 2: print("3..BACKGROUND from upper BG2 only")   
    else:
      # linear interpolation of the two background regions  
         dbgdy = (bg2-bg1)/(background_upper[0]+0.5*background_upper[1]+background_lower[0]+0.5*background_lower[1]) 
-        for i9 in range(bgimg.shape[0]):
-           bgimg[i9,kx0:kx1] = bg1[kx0:kx1] + dbgdy[kx0:kx1]*(i9-int(100-(background_lower[0]+0.5*background_lower[1])))
-           bgimg[i9,0:kx0] =  bg2[0:kx0]    # assuming that the spectrum in not in the lower left corner 
-           bgimg[i9,kx1:nx] = bg2[kx1:nx]
+        bgimg[:,kx0:kx1] = bg1[kx0:kx1] + dbgdy[kx0:kx1]*(rows-int(100-(background_lower[0]+0.5*background_lower[1])))
+        bgimg[:,0:kx0] =  bg2[0:kx0]    # assuming that the spectrum in not in the lower left corner 
+        bgimg[:,kx1:nx] = bg2[kx1:nx]
         if chatter > 2: print("4..BACKGROUND from BG1 and BG2")   
       
    return bg, bg1, bg2, bgsig, bgimg, bg_limits_used, (bg1_good, bg1_dis, 
@@ -2627,7 +2998,7 @@ def makeXspecInput(lamdasp,countrate,error,lamda_response=None,chatter=1):
 
 
 def find_zeroth_orders(filestub, ext, wheelpos, region=False,indir='./',
-    set_maglimit=None, clobber="NO", chatter=0):
+    set_maglimit=None, clobber="NO", chatter=0, ctx=None):
    '''
    The aim is to identify the zeroth order on the grism image.  
    This is done as follows:
@@ -2635,6 +3006,9 @@ def find_zeroth_orders(filestub, ext, wheelpos, region=False,indir='./',
    We also grab the USNO B1 source list and predict the positions on the image using the WCSS header.
    Bases on a histogram of minimum distances, as correction is made to the WCSS header, and
    also to the USNO-B1 predicted positions. 
+   
+   The magnitude limit uses zeroth_blim_offset and background_source_mag 
+   from the ExtractionContext `ctx` (default from the global parameters).
        
    '''
    import os
@@ -2736,13 +3110,14 @@ def find_zeroth_orders(filestub, ext, wheelpos, region=False,indir='./',
       print('That is needed for the uvot Ftools ')
       return None
    
+   ctx = _get_context(ctx)
    if set_maglimit == None:  
       b_background = zp + 2.5*log10( (rate_bkg.std())*1256.6 )
       # some typical measure for the image
-      blim= b_background.mean() + b_background.std() + zeroth_blim_offset  
+      blim= b_background.mean() + b_background.std() + ctx.zeroth_blim_offset  
    else:
       blim = set_maglimit
-   if blim <  background_source_mag: blim = background_source_mag  
+   if blim <  ctx.background_source_mag: blim = ctx.background_source_mag  
       
    # if usno-b1 catalog is present for this position, 
    # do not retrieve again      
@@ -3015,13 +3390,15 @@ def spec_curvature(wheelpos,anchor,order=1,):
    wheelpos : int, {160,200,955,1000}
       grism filter position in filter wheel
    anchor : list, array
-      anchor position in detector coordinates (pixels)
+      anchor position in detector coordinates (pixels). The x and y 
+      coordinates may also be arrays of positions.
    order : int
       the desired spectral order  
          
    Returns
    -------
-      Provides the polynomial coefficients for y(x). 
+      Provides the polynomial coefficients for y(x). For arrays of anchor 
+      positions, each coefficient is an array. 
    
    Notes
    -----
@@ -3031,14 +3408,16 @@ def spec_curvature(wheelpos,anchor,order=1,):
    
    - 2011-03-07 Paul Kuin, initial version 
    - 2011-08-02 fixed nominal coefficients order=1
+   - 2017-06-20 arrays of anchor positions
    '''
    from scipy import interpolate
    from numpy import array
    xin = anchor[0] -104
    yin = anchor[1]  -78
+   bisplev = _bisplev_points
    if ((wheelpos == 1000) ^ (wheelpos == 955)):
       # return y = 0 + 0.0*x coefficient
-      return array([0.,0.])
+      return array([0.*xin,0.*xin])
 
    elif wheelpos == 160:
 
@@ -3069,8 +3448,8 @@ def spec_curvature(wheelpos,anchor,order=1,):
           2.20540397e-07,  -1.62674045e-07,   8.70230076e-08,\
          -1.13489556e-07]),3,3]
                      
-       coef = array([interpolate.bisplev(xin,yin,tck_c3),interpolate.bisplev(xin,yin,tck_c2),\
-                     interpolate.bisplev(xin,yin,tck_c1), 0.])
+       coef = array([bisplev(xin,yin,tck_c3),bisplev(xin,yin,tck_c2),\
+                     bisplev(xin,yin,tck_c1), 0.*xin])
        return coef
        
      elif order == 2: 
@@ -3111,8 +3490,8 @@ def spec_curvature(wheelpos,anchor,order=1,):
        #          array([    0.,     0.,  2048.,  2048.]), 
        #         array([ -9.99564069e-05, 8.89513468e-05, 4.77910984e-05, 1.44368445e-05]),1,1]
        
-        coef = array([interpolate.bisplev(xin,yin,tck_c2),interpolate.bisplev(xin,yin,tck_c1),\
-                     interpolate.bisplev(xin,yin,tck_c0)])
+        coef = array([bisplev(xin,yin,tck_c2),bisplev(xin,yin,tck_c1),\
+                     bisplev(xin,yin,tck_c0)])
         return coef
        
      elif order == 3: 
@@ -3126,7 +3505,7 @@ def spec_curvature(wheelpos,anchor,order=1,):
                  array([    0.,     0.,  2048.,  2048.]), 
                  array([-0.04768498, -0.02044308,  0.02984554, -0.04408517]), 1, 1]
  
-       coef = array([interpolate.bisplev(xin,yin,tck_c1),interpolate.bisplev(xin,yin,tck_c0)])             
+       coef = array([bisplev(xin,yin,tck_c1),bisplev(xin,yin,tck_c0)])             
        return coef
        
      elif order == 0:
@@ -3139,7 +3518,7 @@ def spec_curvature(wheelpos,anchor,order=1,):
                   array([    0.,     0.,  2048.,  2048.]),
                   array([ 0.08258587, -0.06696916, -0.09968132, -0.31579981]),1,1]
                   
-       coef = array([interpolate.bisplev(xin,yin,tck_c1),interpolate.bisplev(xin,yin,tck_c0)])            
+       coef = array([bisplev(xin,yin,tck_c1),bisplev(xin,yin,tck_c0)])            
        return  coef
      else: 
        raise (ValueError)    
@@ -3181,8 +3560,8 @@ def spec_curvature(wheelpos,anchor,order=1,):
         #
         #tck_c3 = [array([    0.,     0.,  2048.,  2048.]), array([    0.,     0.,  2048.,  2048.]), \
         #          array([ -1.75056810e-09,  -3.61606998e-08,  -6.00321832e-09, -1.39611943e-08]), 1, 1] 
-        coef = array([interpolate.bisplev(xin,yin,tck_c3),interpolate.bisplev(xin,yin,tck_c2),\
-                     interpolate.bisplev(xin,yin,tck_c1), 0.])
+        coef = array([bisplev(xin,yin,tck_c3),bisplev(xin,yin,tck_c2),\
+                     bisplev(xin,yin,tck_c1), 0.*xin])
         return coef
        
      elif order == 2: 
@@ -3199,8 +3578,8 @@ def spec_curvature(wheelpos,anchor,order=1,):
        tck_c2 =  [array([    0.,     0.,  2048.,  2048.]),
            array([    0.,     0.,  2048.,  2048.]),
            array([ -6.32035759e-05,   5.28407967e-05,  -8.87338917e-06, 8.58873870e-05]),1,1]
-       coef = array([interpolate.bisplev(xin,yin,tck_c2),interpolate.bisplev(xin,yin,tck_c1),\
-                     interpolate.bisplev(xin,yin,tck_c0)])
+       coef = array([bisplev(xin,yin,tck_c2),bisplev(xin,yin,tck_c1),\
+                     bisplev(xin,yin,tck_c0)])
        return coef
        
      elif order == 3:  
@@ -3214,7 +3593,7 @@ def spec_curvature(wheelpos,anchor,order=1,):
        tck_c1 = [array([    0.,     0.,  2048.,  2048.]),
                  array([    0.,     0.,  2048.,  2048.]),
                  array([-0.02591263, -0.03092398,  0.00352404, -0.01171369]), 1, 1]
-       coef = array([interpolate.bisplev(xin,yin,tck_c1),interpolate.bisplev(xin,yin,tck_c0)])             
+       coef = array([bisplev(xin,yin,tck_c1),bisplev(xin,yin,tck_c0)])             
        return coef
        
      elif order == 0:
@@ -3226,7 +3605,7 @@ def spec_curvature(wheelpos,anchor,order=1,):
                   array([    0.,     0.,  2048.,  2048.]),
                   array([ 0.54398146, -0.04547362, -0.63454342, -0.49417562]),1,1]
 
-       coef = array([interpolate.bisplev(xin,yin,tck_c1),interpolate.bisplev(xin,yin,tck_c0)])            
+       coef = array([bisplev(xin,yin,tck_c1),bisplev(xin,yin,tck_c0)])            
        return  coef
 
      else: 
@@ -3236,6 +3615,28 @@ def spec_curvature(wheelpos,anchor,order=1,):
       print('spec_curvature: illegal wheelpos value')
       raise (ValueError)   
       
+def _bisplev_points(x, y, tck):
+   '''Evaluate the spline tck at the points (x[i],y[i]). 
+   
+   interpolate.bisplev() evaluates on the grid x by y, so for arrays of points 
+   the B-spline basis in x and y is computed for each point instead. 
+   '''
+   import numpy as np
+   from scipy import interpolate
+   if np.isscalar(x) & np.isscalar(y):
+      return interpolate.bisplev(x, y, tck)
+   tx, ty, c, kx, ky = tck
+   tx = np.asarray(tx)
+   ty = np.asarray(ty)
+   x, y = np.broadcast_arrays(np.asarray(x,dtype=float), np.asarray(y,dtype=float))
+   nx = len(tx) - kx - 1
+   ny = len(ty) - ky - 1
+   bx = interpolate.BSpline(tx, np.eye(nx), kx)(x.ravel())
+   by = interpolate.BSpline(ty, np.eye(ny), ky)(y.ravel())
+   c = np.asarray(c)[:nx*ny].reshape(nx,ny)
+   return np.einsum('ni,ij,nj->n', bx, c, by).reshape(x.shape)
+      
+      
 def get_coi_box(wheelpos):
     # provide half-width, length coi-box and factor 
     #  typical angle spectrum varies with wheelpos
@@ -3246,6 +3647,52 @@ def get_coi_box(wheelpos):
                 '1000':(7.0,28,1.13),}
     return coistuff[str(wheelpos)]
 
+def aperture_sum(img, k1, k2, cols, mean=False):
+   '''Return the sums img[k1[j]:k2[j],cols[j]].sum() for all j.
+   
+   Parameters
+   ----------
+   img : 2D array
+      image (rows across the dispersion, columns along); a boolean image 
+      gives the number of True pixels. 
+   k1, k2 : array of int
+      lower and upper bounds of the slice in each column; they follow the 
+      python slice rules, so negative values count from the end
+   cols : array of int
+      columns
+   mean : bool
+      return the mean instead of the sum (NaN for an empty slice)
+      
+   Notes
+   -----
+   The columns with the same number of pixels in the slice are gathered 
+   into one array and summed along its rows together. Each row is summed 
+   like the slice itself, so the result is identical to the sum per column. 
+   '''
+   import numpy as np
+   img = np.asarray(img)
+   cols = np.asarray(cols,dtype=int)
+   n = img.shape[0]
+   # python slice rules for the bounds   
+   k1 = np.asarray(k1,dtype=int)
+   k2 = np.asarray(k2,dtype=int)
+   k1 = np.clip(np.where(k1 < 0, k1+n, k1), 0, n)
+   k2 = np.clip(np.where(k2 < 0, k2+n, k2), 0, n)
+   npix = np.maximum(k2-k1,0)
+   result = np.zeros(len(cols))
+   for m in np.unique(npix):
+      j = np.where(npix == m)[0]
+      if m == 0:
+         if mean: result[j] = np.nan
+         continue
+      slices = img[k1[j][:,np.newaxis]+np.arange(m), cols[j][:,np.newaxis]]   
+      if mean:
+         result[j] = slices.mean(axis=1)
+      else:   
+         result[j] = slices.sum(axis=1)
+   return result   
+
+
 def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
     anker0=None, anker2=None, anker3=None, angle=None, offsetlimit=None, \
     background_lower=[None,None], background_upper=[None,None],background_template=None,\
@@ -3254,7 +3701,7 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
     composite_fit=True, test=None, chatter=0, skip_field_sources=False,\
     predict_second_order=True, ZOpos=None,outfull=False, msg='',\
     fit_second=True,fit_third=True,C_1=None,C_2=None,dist12=None,
-    dropout_mask=None):
+    dropout_mask=None, sweep=False, ctx=None):
     
    '''This routine knows about the curvature of the spectra in the UV filters  
       can provide the coefficients of the tracks of the orders
@@ -3274,6 +3721,12 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
 
       output new array of sum across fixed number of pixels across spectrum for coincidence loss
       width of box depends on parameter coi_half_width
+      
+      sweep - with trackfull, fit the columns one by one along the dispersion, starting 
+      each fit from the solution of the previous column (caldefault only)
+      
+      ctx = ExtractionContext with the parameters trackwidth, trackcentroiding,
+      background_source_mag, and the background parameters (default from globals)
 
    NPMK, 2010-07-09 initial version  
          2012-02-20 There was a problem with the offset/track y1 position/borderup,borderdown consistency
@@ -3286,12 +3739,19 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
          2014-08-06 changed code to correctly adjust y1 position  
          2014-08-25 fixed error in curve of location orders except first one 
          2016-01-17 trackcentroiding parameter added to disable centroiding         
+         2017-06-20 parameters from ExtractionContext ctx instead of globals
+         2017-06-20 aperture sums for all columns at once (aperture_sum)
+         2017-06-20 trackfull sweep option: start each column fit from its neighbour 
    '''
    import pylab as plt
    from numpy import array,arange,where, zeros,ones, asarray, abs, int
    from .uvotplot import plot_ellipsoid_regions
    from . import uvotmisc
    
+   ctx = _get_context(ctx)
+   trackwidth = ctx.trackwidth
+   trackcentroiding = ctx.trackcentroiding
+   
    anky,ankx,xstart,xend = ank_c
    xstart -= ankx
    xend   -= ankx
@@ -3391,7 +3851,7 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
    bg, bg1, bg2, bgsig, bgimg, bg_limits, \
        (bg1_good, bg1_dis, bg1_dis_good, bg2_good, bg2_dis, bg2_dis_good,  bgimg_lin) \
        = findBackground(extimg,background_lower=background_lower, 
-         background_upper=background_upper,yloc_spectrum=anky, chatter=2)
+         background_upper=background_upper,yloc_spectrum=anky, chatter=2, ctx=ctx)
    if background_template != None:
        bgimg = background_template['extimg']    
 
@@ -3415,8 +3875,8 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
       pivot_ori=array([(anchor1)[0],(anchor1)[1]])
       pivot= array([ank_c[1],ank_c[0]])
 
-      # map down to 18th magnitude in B2 (use global variable uvotgetspec.background_source_mag)
-      m_lim = background_source_mag
+      # map down to 18th magnitude in B2 (use ctx.background_source_mag)
+      m_lim = ctx.background_source_mag
       map_all =  plot_ellipsoid_regions(Xim.copy(),Yim.copy(),Xa.copy(),Yb.copy(),Thet.copy(),\
          b2mag.copy(),matched.copy(), ondetector,pivot,pivot_ori,dims,m_lim,img_angle=angle-180.0,\
          lmap=True,makeplot=False,chatter=chatter) 
@@ -3453,7 +3913,7 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
    x3 = x[q3]
    if present3:  y3[q3] += polyval(coef3,x[q3])
    
-   if trackcentroiding:   # global (default = True)
+   if trackcentroiding:   # from ctx (default = True)
        # refine the offset by determining where the peak in the 
        # first order falls. 
        # We NEED a map to exclude zeroth orders that fall on/near the spectrum 
@@ -3618,108 +4078,55 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
       k1 = int(anky-3*coi_half_width+0.5)
       co_back = bgimg[k1:k1+int(6*coi_half_width),:].sum(axis=0)/3.0
 
-      if present0:
-         for i in range(nx): 
-            sphalfwid = trackwidth*polyval(sig0coef,x[i])
-            spwid = 2*sphalfwid
-            #splim1 = 100+offset-sphalfwid+1    changes 19-feb-2012
-            #splim2 = splim1 + spwid
-            #k1 = splim1+y0[i]-anky
-            k1 = int(y0[i] - sphalfwid + 0.5)
-            k2 = k1 + int(spwid+0.5)
-            k3 = int(y0[i] - coi_half_width + 0.5)
-            k4 = k1 + int(2*coi_half_width)         
-            if i in q0[0]: 
-               co_zeroth[i] = extimg[k3:k4,i].sum()
-               sp_zeroth[i] = extimg[k1:k2,i].sum()
-               bg_zeroth[i] = bgimg[k1:k2,i].sum()
-               borderup[0,i]   = k2
-               borderdown[0,i] = k1
-               apercorr[0,i] = x_aperture_correction(k1,k2,sig0coef,x[i],norder=0)
-               if len(expmap) == 1: expospec[0,i] = expmap[0]
-               else: expospec[0,i] = expmap[k1:k2,i].mean()
-      
-      if present1:
-         for i in range(nx): 
-            sphalfwid = trackwidth *polyval(sig1coef,x[i])
-            # if (x[i] < 30): sphalfwid *= bluetrackwidth
-            spwid = 2*sphalfwid
-            #splim1 = 100+offset-sphalfwid+1   changes 19-feb-2012
-            #splim2 = splim1 + spwid           
-            #k1 = int(splim1+y1[i]-anky+0.5)   
-            k1 = int(y1[i] - sphalfwid + 0.5)   
-            k2 = k1 + int(spwid+0.5)        
-            k3 = int(y1[i] - coi_half_width + 0.5)
-            k4 = k1 + int(2*coi_half_width)         
-            if i in q1[0]: 
-               co_first[i] = extimg[k3:k4,i].sum()
-               sp_first[i] = extimg[k1:k2,i].sum()
-               bg_first[i] = bgimg[k1:k2,i].sum()
-               borderup[1,i]   = k2
-               borderdown[1,i] = k1
-               apercorr[1,i] = x_aperture_correction(k1,k2,sig1coef,x[i],norder=1)
-               if len(expmap) == 1: expospec[1,i] = expmap[0]
-               else:  expospec[1,i] = expmap[k1:k2,i].mean()
-               if dropout_mask != None:
-                   at3[i] = dropout_mask[k1:k2,i].any() 
-               if set_qual:              
-                   k5 = int(y1[i] - 49 + 0.5)   
-                   k6 = k1 + int(98+0.5)            
-                   if ny > 20: 
-                 # all zeroth orders of sources within coi-distance: 
-                       at1[i] = (map_all[i,k3:k4] == False).any()
-                   if ny > 100:
-                 # strong sources: circle 49 pix radius hits the centre of the track 
-                       at2[i] = (map_strong[i,k5:k6] == False).any()
-                   quality[at1] = qflag['weakzeroth']
-                   quality[at2] = qflag['zeroth']        
-                   quality[at3] = qflag['bad']  
+      # the sums over the aperture of each column are done for all columns 
+      # of an order at once 
+      orders = ((present0,q0,y0,sig0coef,sp_zeroth,bg_zeroth,co_zeroth),
+                (present1,q1,y1,sig1coef,sp_first, bg_first, co_first ),
+                (present2,q2,y2,sig2coef,sp_second,bg_second,co_second),
+                (present3,q3,y3,sig3coef,sp_third, bg_third, co_third ))
+      for norder in range(4):
+         present_, q_, y_, sigcoef_, sp_, bg_, co_ = orders[norder]
+         if not present_: continue
+         q = q_[0]
+         sphalfwid = trackwidth*polyval(sigcoef_,x)
+         spwid = 2*sphalfwid
+         k1 = (y_ - sphalfwid + 0.5).astype(int)
+         k2 = k1 + (spwid+0.5).astype(int)
+         k3 = (y_ - coi_half_width + 0.5).astype(int)
+         k4 = k1 + int(2*coi_half_width)
+         co_[q] = aperture_sum(extimg,k3[q],k4[q],q)
+         sp_[q] = aperture_sum(extimg,k1[q],k2[q],q)
+         bg_[q] = aperture_sum(bgimg, k1[q],k2[q],q)
+         borderup[norder,q]   = k2[q]
+         borderdown[norder,q] = k1[q]
+         apercorr[norder,q] = x_aperture_correction(k1[q],k2[q],sigcoef_,x[q],norder=norder)
+         if len(expmap) == 1: 
+            expospec[norder,q] = expmap[0]
+         else:
+            expo = aperture_sum(expmap,k1[q],k2[q],q,mean=True)
+            qe = np.isfinite(expo)
+            expospec[norder,q[qe]] = expo[qe]
+            
+         if norder == 1:   
+            if type(dropout_mask) != typeNone:
+               at3[q] = aperture_sum(dropout_mask,k1[q],k2[q],q) > 0 
+            if set_qual & (len(q) > 0):              
+               k5 = (y_ - 49 + 0.5).astype(int)   
+               k6 = k1 + int(98+0.5)            
+               if ny > 20: 
+                  # all zeroth orders of sources within coi-distance: 
+                  at1[q] = aperture_sum((map_all == False).T,k3[q],k4[q],q) > 0
+               if ny > 100:
+                  # strong sources: circle 49 pix radius hits the centre of the track 
+                  at2[q] = aperture_sum((map_strong == False).T,k5[q],k6[q],q) > 0
+               quality[at1] = qflag['weakzeroth']
+               quality[at2] = qflag['zeroth']        
+               quality[at3] = qflag['bad']  
                
-      if present2:
-         for i in range(nx): 
-            sphalfwid = trackwidth * polyval(sig2coef,x[i])
-            spwid = 2*sphalfwid
-            #splim1 = 100+offset-sphalfwid+1   changes 19-feb-2012
-            #splim2 = splim1 + spwid
-            #k1 = int(splim1+y2[i]-anky+0.5)
-            k1 = int(y2[i] - sphalfwid +0.5)
-            k2 = k1 + int(spwid+0.5)
-            k3 = int(y2[i] - coi_half_width + 0.5)
-            k4 = k1 + int(2*coi_half_width)         
-            if i in q2[0]: 
-               co_second[i] = extimg[k3:k4,i].sum()
-               sp_second[i] = extimg[k1:k2,i].sum()
-               bg_second[i] = bgimg[k1:k2,i].sum()
-               borderup[2,i]   = k2
-               borderdown[2,i] = k1
-               apercorr[2,i] = x_aperture_correction(k1,k2,sig2coef,x[i],norder=2)
-               if len(expmap) == 1: expospec[2,i] = expmap[0]
-               else:  expospec[2,i] = expmap[k1:k2,i].mean()
-
-            y1_y2 = np.abs(0.5*(k2+k1) - 0.5*(borderup[1,i]-borderdown[1,i]))
-            s1_s2 = 0.5*(np.polyval(sig1coef,x[i]) + np.polyval(sig2coef, x[i]) )
-            if ( y1_y2 < s1_s2) : quality[i] += qflag.get('overlap') 
-   
-      if present3:
-         for i in range(nx): 
-            sphalfwid = trackwidth * polyval(sig3coef,x[i])
-            spwid = 2*sphalfwid
-            #splim1 = 100+offset-sphalfwid+1
-            #splim2 = splim1 + spwid
-            #k1 = int(splim1+y3[i]-anky+0.5)
-            k1 = int(y3[i] - sphalfwid +0.5)
-            k2 = k1 + int(spwid+0.5)
-            k3 = int(y3[i] - coi_half_width + 0.5)
-            k4 = k1 + int(2*coi_half_width)         
-            if i in q3[0]: 
-               co_third[i] = extimg[k3:k4,i].sum(axis=0)
-               sp_third[i] = extimg[k1:k2,i].sum(axis=0)
-               bg_third[i] = bgimg[k1:k2,i].sum(axis=0)
-               borderup[3,i]   = k2
-               borderdown[3,i] = k1
-               apercorr[3,i] = x_aperture_correction(k1,k2,sig3coef,x[i],norder=3)
-               if len(expmap) == 1: expospec[3,i] = expmap[0]
-               else: expospec[3,i] = expmap[k1:k2,i].mean()
+         if norder == 2:   
+            y1_y2 = np.abs(0.5*(k2+k1) - 0.5*(borderup[1,:]-borderdown[1,:]))
+            s1_s2 = 0.5*(np.polyval(sig1coef,x) + np.polyval(sig2coef, x) )
+            quality[y1_y2 < s1_s2] += qflag.get('overlap') 
 
       # y0,y1,y2,y3 now reflect accurately the center of the slit used.
             
@@ -3756,80 +4163,70 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
         ileft = test[0]
         irite = test[1] 
       
-      for i in range(ileft,irite):
-         if chatter > 3: print("uvotgetspec.curved_extraction [trackfull] fitting i = %2i x=%6.2f"%(i,x[i]))
-         # do the zeroth order 
-         if i in q0[0]: 
-            Ypos = (array( [y0[i]])).flatten()
-            Xpos = arange(i-2,i+3)
-            sigmas = sig0coef
-            (par, flag), junk = get_components(Xpos,spimg,Ypos,wheelpos,\
-                         caldefault=caldefault,sigmas=sigmas)
-            flags = str(flag[0])+str(flag[1])+str(flag[2])+str(flag[3])+str(flag[4])+str(flag[5])
-            iflags = int(flags)
-            gfit[0,:,i] = [i,0,par[0],par[1],par[2],iflags]
-            if chatter > 3: print(i, par, flag)
-
-         # do the first order  
-         if ((i in q1[0]) & (i not in q2[0])) :
-            Ypos = array( [y1[i]] ).flatten()
-            Xpos = arange(i-2,i+3)
-            sigmas = sig1coef
-            (par, flag), junk = get_components(Xpos,spimg,Ypos,wheelpos,\
-                                caldefault=caldefault,sigmas=sigmas)
-            flags = str(flag[0])+str(flag[1])+str(flag[2])+str(flag[3])+str(flag[4])+str(flag[5])
-            iflags = int(flags)
-            gfit[1,:,i] = [i,1,par[0],par[1],par[2],iflags]
-            if chatter > 3: print(i, par, flag)
-            
-         # do the second order  
-         if ((i in q1[0]) & (i in q2[0]) & (i not in q3[0])):
-            Ypos = array( [y1[i],y2[i]]).flatten()
-            Xpos = arange(i-3,i+4)
-            sigmas = array([ sig1coef[0], sig2coef[0] ])
-            if chatter > 3: print('++++ second order Xpos:',Xpos,'  Ypos: ', Ypos,' wheelpos ',wheelpos)
-            Z = get_components(Xpos,spimg,Ypos,wheelpos,composite_fit=composite_fit,\
-                caldefault=caldefault,sigmas=sigmas)
-            par, flag = Z[0]
-            flags = str(flag[0])+str(flag[1])+str(flag[2])+str(flag[3])+str(flag[4])+str(flag[5])
-            iflags = int(flags)
-            gfit[1,:,i] = [i,1,par[0],par[1],par[2],iflags]
-            if len(par) == 6:
-               gfit[2,:,i] = [i,2,par[3],par[4],par[5],iflags]
-            if chatter > 3: print(i); print(par[0:3]); print(par[3:6]); print(flag)
-            
-         # do the third order  
-         if ((i in q1[0]) & (i in q2[0]) & (i in q3[0])):
-            Ypos = array([y1[i],y2[i],y3[i]]).flatten()
-            Xpos = arange(i-4,i+5)
-            sigmas = array([sig1coef[0], sig2coef[0], sig3coef[0]])
-            if chatter > 3: print('+++++ third order Xpos:',Xpos,'  Ypos: ', Ypos,' * * * 3 3 3 3 3 * * *')
-            width = abs( polyval(array([2.0e-05, 0.034, -70]),(anchor2[1]-1200.)))+5.0 # rough limits
-            
+      # the slices to fit for each combination of orders present: 
+      #   (orders, columns, half width of the slice, positions, sigmas)
+      cols = arange(ileft,irite)
+      in0 = np.isin(cols,q0[0]) 
+      in1 = np.isin(cols,q1[0]) 
+      in2 = np.isin(cols,q2[0]) 
+      in3 = np.isin(cols,q3[0])
+      slices = [((0,),      cols[in0],                2, (y0,),       sig0coef),
+                ((1,),      cols[in1 & ~in2],         2, (y1,),       sig1coef),
+                ((1,2),     cols[in1 & in2 & ~in3],   3, (y1,y2),     array([sig1coef[0],sig2coef[0]])),
+                ((1,2,3),   cols[in1 & in2 & in3],    4, (y1,y2,y3),  array([sig1coef[0],sig2coef[0],sig3coef[0]]))]
+      width = abs( polyval(array([2.0e-05, 0.034, -70]),(anchor2[1]-1200.)))+5.0 # rough limits 3rd order
+      
+      for orders, icol, hw, ypos, sigmas in slices:
+         if len(icol) == 0: continue
+         if chatter > 3: 
+            print("uvotgetspec.curved_extraction [trackfull] fitting orders ",orders," in %i columns"%(len(icol)))
+         Xpos = [arange(i-hw,i+hw+1) for i in icol]
+         Ypos = array([yp[icol] for yp in ypos]).T
+         results = None
+         if caldefault & (not sweep):
+            # fit all columns at once 
             try:
-               Z = get_components(Xpos,spimg,Ypos,wheelpos,chatter=chatter,width=width,\
-                   composite_fit=composite_fit,caldefault=caldefault,sigmas=sigmas)
-               par, flag = Z[0] 
-               
+               results = get_components_batch(Xpos,spimg,Ypos,wheelpos,sigmas=sigmas,
+                   fiterrors=False,chatter=chatter)
             except:
-               print("failed 3rd order fitting width = ",width)
-               print("Ypos = ",Ypos)
-               print("Xpos range ",i-4,i+5, "   sigmas = ",sigmas, " wheelpos = ",wheelpos)
-               print("composite_fit:",composite_fit,"  caldefault:",caldefault)
-               print(par)
-               print(flag)
-               par = array([0.,y1[i],3.,0.,y2[i],4.,0.,y3[i],6.])   
-               flag = array([9,9,9,9,9,9])
-               
+               if chatter > 1: print("curved_extraction [trackfull]: batch fit failed; fitting each column")
+         if results == None:   
+            results = []
+            start = None
+            for k in range(len(icol)):
+               try:
+                  if len(orders) == 1:
+                     Z = get_components(Xpos[k],spimg,Ypos[k],wheelpos,caldefault=caldefault,
+                         sigmas=sigmas,fiterrors=False,start=start)
+                  else:   
+                     Z = get_components(Xpos[k],spimg,Ypos[k],wheelpos,chatter=chatter,width=width,
+                         composite_fit=composite_fit,caldefault=caldefault,sigmas=sigmas,fiterrors=False,
+                         start=start)
+               except:
+                  if len(orders) < 3: raise
+                  print("failed 3rd order fitting width = ",width)
+                  print("Ypos = ",Ypos[k])
+                  print("Xpos range ",Xpos[k][0],Xpos[k][-1]+1, "   sigmas = ",sigmas, " wheelpos = ",wheelpos)
+                  print("composite_fit:",composite_fit,"  caldefault:",caldefault)
+                  Z = (array([0.,y1[icol[k]],3.,0.,y2[icol[k]],4.,0.,y3[icol[k]],6.]),
+                       array([9,9,9,9,9,9])), None
+               results.append(Z)  
+               # sweep: start the fit of the next column from this solution, shifted 
+               # by the change in the predicted positions 
+               start = None
+               if sweep & caldefault & (k+1 < len(icol)) & (Z[1] != None):
+                  if (icol[k+1]-icol[k] == 1) & (Z[0][1][5] > 0):
+                     start = array(Z[0][0],dtype=float).reshape(-1,3)
+                     start[:,1] += Ypos[k+1] - Ypos[k]
+         
+         for i, Z in zip(icol, results):
+            par, flag = Z[0]
             flags = str(flag[0])+str(flag[1])+str(flag[2])+str(flag[3])+str(flag[4])+str(flag[5])
             iflags = int(flags)
-            gfit[1,:,i] = [i,1,par[0],par[1],par[2],iflags]
-            if len(par) > 4: 
-               gfit[2,:,i] = [i,2,par[3],par[4],par[5],iflags]
-            if len(par) == 9:   
-               gfit[3,:,i] = [i,3,par[6],par[7],par[8],iflags]
-            if chatter > 3: 
-               print(i); print(par[0:3]) ; print(par[3:6]) ; print(par[6:9]) ; print(iflags)
+            for k, order in enumerate(orders): 
+               if len(par) >= 3*k+3:
+                  gfit[order,:,i] = [i,order,par[3*k],par[3*k+1],par[3*k+2],iflags]
+            if chatter > 3: print(i, par, flag)
                
          # thing not covered (properly): 
          #  -- the second order falls on the first and the third order not
@@ -3839,18 +4236,147 @@ def curved_extraction(extimg,ank_c,anchor1, wheelpos, expmap=None, offset=0., \
                       
       return fitorder, gfit, (bgimg,)
 
+# The aperture correction for the first order. The tables give the fraction 
+# of the count rate in an aperture of half-width 'sig' (in units of the 
+# track width sigma), normalised to 1 at 2.5 sigma (low coi, best curves 
+# from the apertures using aperture.py plots WD1657+343). 
+aperture_tables = {
+   '160_low': { 
+   # half-width in units of sig
+    "sig": [0.00,0.30,0.51,0.700,0.90,1.000,1.100,1.200,1.400,
+            1.600,1.800,2.000,2.20,2.5,2.900,3.31,4.11,6.00], 
+   # aperture correction, normalised 
+    "ape": [0.00,0.30,0.52,0.667,0.77,0.818,0.849,0.872,0.921,
+            0.947,0.968,0.980,0.99,1.0,1.008,1.01,1.01,1.01]
+   },
+   '200_low': {
+    "sig": [0.0,0.300,0.510,0.700,0.800,0.900,1.000,1.10,1.20,
+            1.40, 1.60, 1.80, 2.0,  2.2,  2.5, 2.7, 3.0,4.0,6.0],
+    "ape": [0.0,0.308,0.533,0.674,0.742,0.780,0.830,0.86,0.89,
+            0.929,0.959,0.977,0.986,0.991,1.0,1.002,1.003,1.004,1.005 ]
+   },
+   '1000_low': {
+    "sig": [0.0, 0.3, 0.5, 0.7, 0.8, 0.9, 1.0, 1.2, 1.4, 1.6,  2.0,2.2,2.5,3.0  ,4.0 ,6.0 ],
+    "ape": [0.0,0.37,0.55,0.68,0.74,0.80,0.85,0.91,0.96,0.98,0.995,1. ,1. ,1.004,1.01,1.01]     
+   },
+   '955_med': {
+    "sig": [0.0,0.30,0.60,0.80,1.00,1.30,1.60,1.80,2.00,2.50,3.00, 4.00,6.00],
+    "ape": [0.0,0.28,0.47,0.64,0.75,0.86,0.93,0.96,0.97,1.00,1.013,1.02,1.02]
+   },
+   '1000_med': {
+    "sig": [0.0,0.30,0.50,0.70,0.80,0.90,1.00,1.20,1.40,1.60,
+            1.80,2.00,2.20,2.50,3.00,4.00,6.00],
+    "ape": [0.0,0.34,0.46,0.63,0.68,0.73,0.76,0.87,0.90,0.94,
+            0.96,0.98,0.99,1.00,1.015,1.027,1.036]
+   }
+   }
+# the table used for each wheelpos   
+aperture_table_of_wheelpos = {160:'160_low', 200:'200_low', 955:'955_med', 1000:'1000_low'}
+# fitted polynomials to the aperture (low-coi) for 0<aperture<6 sig
+aperture_polycoef = {
+   160: np.array([  1.32112392e-03,  -2.69269447e-02,   2.10636905e-01,
+        -7.89493710e-01,   1.43691688e+00,  -2.43239325e-02]),
+   200: np.array([  1.29297314e-03,  -2.66018405e-02,   2.10241179e-01,
+        -7.93941262e-01,   1.44678036e+00,  -2.51078365e-02]),
+   # for aperture  <= 2.2 sig, and for larger: '1000b'   
+   1000: np.array([ 0.00260494, -0.04792046,  0.33581242, -1.11237223,  1.74086898,
+       -0.04026319]),
+   '1000b': np.array([ 0.00128903,  0.00107042,  0.98446801]),
+   # for aperture < 4 sig
+   955: np.array([ 0.00213156, -0.03953134,  0.28146284, -0.96044626,  1.58429093,
+       -0.02412411]),
+   }
+# calibration done with aperture correction 1.043 (sig=2.5)   
+aperture_renormal = 1.0430 
+# 2012-02-21 PSF best fit at 3500 from cal_psf aper05+aper08 valid for 0.5 < xx < 4.5  
+# the function does not rise as steeply so has more prominent wings
+aperture_psf_tck = (np.array([ 0. ,  0. ,  0. ,  0. ,  0.2,  0.3,  0.4,  0.5,  0.6,  0.7,  0.8,
+     0.9,  1. ,  1.1,  1.2,  1.3,  1.4,  1.5,  1.6,  1.7,  1.8,  1.9,
+     2. ,  2.1,  2.2,  2.3,  2.4,  2.5,  2.6,  2.7,  2.8,  2.9,  3. ,
+     3.1,  3.2,  3.3,  3.4,  3.5,  3.6,  3.7,  3.8,  3.9,  4. ,  4.1,
+     4.2,  4.3,  4.4,  4.5,  4.6,  4.7,  4.8,  5. ,  5. ,  5. ,  5. ]),
+     np.array([ -6.45497898e-19,   7.97698047e-02,   1.52208991e-01,
+      2.56482414e-01,   3.31017197e-01,   4.03222197e-01,
+      4.72064814e-01,   5.37148347e-01,   5.97906198e-01,
+      6.53816662e-01,   7.04346413e-01,   7.48964617e-01,
+      7.87816053e-01,   8.21035507e-01,   8.48805502e-01,
+      8.71348421e-01,   8.88900296e-01,   9.03143354e-01,
+      9.16085646e-01,   9.28196443e-01,   9.38406001e-01,
+      9.45971114e-01,   9.51330905e-01,   9.54947930e-01,
+      9.57278503e-01,   9.58780477e-01,   9.59911792e-01,
+      9.60934825e-01,   9.62119406e-01,   9.63707446e-01,
+      9.66045076e-01,   9.69089467e-01,   9.73684854e-01,
+      9.75257929e-01,   9.77453939e-01,   9.81061451e-01,
+      9.80798098e-01,   9.82633805e-01,   9.83725248e-01,
+      9.84876762e-01,   9.85915295e-01,   9.86929684e-01,
+      9.87938594e-01,   9.88979493e-01,   9.90084808e-01,
+      9.91288321e-01,   9.92623448e-01,   9.94123703e-01,
+      9.96388866e-01,   9.98435907e-01,   1.00000000e+00,
+      0.00000000e+00,   0.00000000e+00,   0.00000000e+00,
+      0.00000000e+00]), 3)
+
+
+def aperture_correction(xx, norder=1, mode='best', coi=None, wheelpos=None):
+   '''Returns the aperture correction factor for the aperture half-width xx.
+   
+   Parameters
+   ----------
+   xx : float or array
+      half width of the aperture in units of the track width sigma
+   norder: int
+      order of the spectrum
+   mode : 'best'|'gaussian'
+      'gaussian' option causes first order to be treated as a gaussian PSF
+   coi : None
+      not implemented
+   wheelpos : 160|200|955|1000
+      filter wheel position; without it the first order uses the PSF fit 
+      `aperture_psf_tck`, with it the table of `aperture_tables`.
+      
+   Notes
+   -----
+   The first order uses the measured cumulative profile normal to the 
+   dispersion for xx <= 4.5, the orders zero, second, and third a gaussian.
+   All array elements are done in one call. 
+   '''
+   from . import uvotmisc
+   from scipy.interpolate import splev
+   import numpy as np
+   
+   scalar = np.ndim(xx) == 0
+   xx = np.asarray(xx,dtype=float)
+   apercorr = np.ones(xx.shape)
+   with np.errstate(divide='ignore',invalid='ignore'):
+      if norder in [0,1,2,3]:
+         gaussian = 1.0/uvotmisc.GaussianHalfIntegralFraction( xx )
+      if norder in [0,2,3]:
+         apercorr = gaussian
+      if norder == 1: 
+         if wheelpos != None:
+            # low coi for wheelpos = 160,200; medium coi for wheelpos = 955, 1000
+            if (wheelpos in aperture_table_of_wheelpos) & ((type(coi) == typeNone) or (coi < 0.1)):
+               tab = aperture_tables[aperture_table_of_wheelpos[wheelpos]]
+               apercorr = aperture_renormal / np.interp(xx, tab['sig'], tab['ape'])
+         else:
+            apercorr = 1.0/splev( xx, aperture_psf_tck,)
+         apercorr = np.where((mode == 'gaussian') | (xx > 4.5), gaussian, apercorr)
+   if scalar:
+      return float(apercorr)
+   return apercorr 
+   
+
 def x_aperture_correction(k1,k2,sigcoef,x,norder=None, mode='best', coi=None, wheelpos=None):
    '''Returns the aperture correction factor 
    
       parameters
       ----------
-      k1,k2 : int
+      k1,k2 : int or array
          k1 edge of track, k2 opposite track edge 
          in pixel coordinates
       sigcoef : list
          polynomial coefficient of the fit to the track width
          so that sigma = polyval(sigcoef,x)
-      x : float
+      x : float or array
          pixel/channel position
       norder: int
          order of the spectrum
@@ -3866,6 +4392,7 @@ def x_aperture_correction(k1,k2,sigcoef,x,norder=None, mode='best', coi=None, wh
       The aperture correction is returned for given sigcoef and position x       
       Using the measured cumulative profile normal to the dispersion for the
       first order (faint spectrum) or gaussians for orders zero,second, third. 
+      See aperture_correction(). 
    
       History:
       2012-02-20  Split out in preparation of non-gaussian aperture correction factor
@@ -3874,126 +4401,16 @@ def x_aperture_correction(k1,k2,sigcoef,x,norder=None, mode='best', coi=None, wh
                changing the PSF (no further action)
                
       2013-12-15  revised aperture functions, one for each grism (low coi)
+      
+      2017-06-20  tables at module level; arrays k1, k2, x in one call 
    '''
-   from . import uvotmisc
-   import scipy
-   from scipy.interpolate import interp1d, splev
    import numpy as np
    
-   
-   apercorr = 1.0
-   
-   if norder == 0:       
-      apercorr = 1.0/uvotmisc.GaussianHalfIntegralFraction( 0.5*(k2-k1)/np.polyval(sigcoef,x) )
-   if norder == 1:  
-      # low coi apertures (normalised to 1 at aperture with half-width 2.5 sigma
-
-      # low coi apertures (normalised to 1 at aperture with half-width 2.5 sigma
-      # fitted polynomials to the aperture (low-coi) 
-      #for 0<aperture<6 sig
-      polycoef160 = np.array([  1.32112392e-03,  -2.69269447e-02,   2.10636905e-01,
-        -7.89493710e-01,   1.43691688e+00,  -2.43239325e-02])   
-      
-      polycoef200 = np.array([  1.29297314e-03,  -2.66018405e-02,   2.10241179e-01,
-        -7.93941262e-01,   1.44678036e+00,  -2.51078365e-02])   
-      #y200 = polyval(polycoef200,x)    
-       
-      polycoef1000a = np.array([ 0.00260494, -0.04792046,  0.33581242, -1.11237223,  1.74086898,
-       -0.04026319]) # for aperture  <= 2.2 sig, and for larger:
-      polycoef1000b = np.array([ 0.00128903,  0.00107042,  0.98446801])
+   if not norder in [0,1,2,3]:
+      return 1.0
+   xx = 0.5*(np.asarray(k2)-np.asarray(k1))/np.polyval(sigcoef,x) # half track width in units of sig 
+   return aperture_correction(xx, norder=norder, mode=mode, coi=coi, wheelpos=wheelpos)
 
-      polycoef955 = np.array([ 0.00213156, -0.03953134,  0.28146284, -0.96044626,  1.58429093,
-       -0.02412411]) # for aperture < 4 sig
- 
-      # best curves for the apertures (using aperture.py plots WD1657+343)   
-      aper_160_low = { 
-      # half-width in units of sig
-       "sig": [0.00,0.30,0.51,0.700,0.90,1.000,1.100,1.200,1.400,
-               1.600,1.800,2.000,2.20,2.5,2.900,3.31,4.11,6.00], 
-      # aperture correction, normalised 
-       "ape": [0.00,0.30,0.52,0.667,0.77,0.818,0.849,0.872,0.921,
-               0.947,0.968,0.980,0.99,1.0,1.008,1.01,1.01,1.01]
-      }   
-      aper_200_low = {
-       "sig": [0.0,0.300,0.510,0.700,0.800,0.900,1.000,1.10,1.20,
-               1.40, 1.60, 1.80, 2.0,  2.2,  2.5, 2.7, 3.0,4.0,6.0],
-       "ape": [0.0,0.308,0.533,0.674,0.742,0.780,0.830,0.86,0.89,
-               0.929,0.959,0.977,0.986,0.991,1.0,1.002,1.003,1.004,1.005 ]
-      }
-      aper_1000_low = {
-       "sig": [0.0, 0.3, 0.5, 0.7, 0.8, 0.9, 1.0, 1.2, 1.4, 1.6,  2.0,2.2,2.5,3.0  ,4.0 ,6.0 ],
-       "ape": [0.0,0.37,0.55,0.68,0.74,0.80,0.85,0.91,0.96,0.98,0.995,1. ,1. ,1.004,1.01,1.01]     
-      }
-      aper_955_med = {
-       "sig": [0.0,0.30,0.60,0.80,1.00,1.30,1.60,1.80,2.00,2.50,3.00, 4.00,6.00],
-       "ape": [0.0,0.28,0.47,0.64,0.75,0.86,0.93,0.96,0.97,1.00,1.013,1.02,1.02]
-      }
-      aper_1000_med = {
-       "sig": [0.0,0.30,0.50,0.70,0.80,0.90,1.00,1.20,1.40,1.60,
-               1.80,2.00,2.20,2.50,3.00,4.00,6.00],
-       "ape": [0.0,0.34,0.46,0.63,0.68,0.73,0.76,0.87,0.90,0.94,
-               0.96,0.98,0.99,1.00,1.015,1.027,1.036]
-      }
-      renormal = 1.0430 # calibration done with aperture correction 1.043 (sig=2.5)
-      sig = np.polyval(sigcoef,x)  # half width parameter sig in pixels
-      xx = 0.5*(k2-k1)/sig         # half track width in units of sig 
-
-      if (mode == 'gaussian') | (xx > 4.5):     
-         apercorr = 1.0/uvotmisc.GaussianHalfIntegralFraction( xx )
-      elif (wheelpos != None):
-          # low coi for wheelpos = 160,200; medium coi for wheelpos = 955, 1000
-          if wheelpos == 160:
-              if (type(coi) == typeNone) | (coi < 0.1) :
-                 apercf1 = interp1d(aper_160_low['sig'],aper_160_low['ape'],)
-                 apercorr = renormal / apercf1(xx)         
-          if wheelpos == 200:
-              if (type(coi) == typeNone) | (coi < 0.1) :
-                 apercf2 = interp1d(aper_200_low['sig'],aper_200_low['ape'],) 
-                 apercorr = renormal / apercf2(xx)         
-          if wheelpos == 955:
-              if (type(coi) == typeNone) | (coi < 0.1) :
-                 apercf3 = interp1d(aper_955_med['sig'],aper_955_med['ape'],)
-                 apercorr = renormal / apercf3(xx)          
-          if wheelpos == 1000:
-              if (type(coi) == typeNone) | (coi < 0.1) :
-                 apercf4 = interp1d(aper_1000_low['sig'],aper_1000_low['ape'],)
-                 apercorr = renormal / apercf4(xx)                       
-      else: 
-       # when xx<4.5, mode !gaussian, wheelpos==None use the following
-       # 2012-02-21 PSF best fit at 3500 from cal_psf aper05+aper08 valid for 0.5 < xx < 4.5  
-       # the function does not rise as steeply so has more prominent wings
-        tck = (np.array([ 0. ,  0. ,  0. ,  0. ,  0.2,  0.3,  0.4,  0.5,  0.6,  0.7,  0.8,
-             0.9,  1. ,  1.1,  1.2,  1.3,  1.4,  1.5,  1.6,  1.7,  1.8,  1.9,
-             2. ,  2.1,  2.2,  2.3,  2.4,  2.5,  2.6,  2.7,  2.8,  2.9,  3. ,
-             3.1,  3.2,  3.3,  3.4,  3.5,  3.6,  3.7,  3.8,  3.9,  4. ,  4.1,
-             4.2,  4.3,  4.4,  4.5,  4.6,  4.7,  4.8,  5. ,  5. ,  5. ,  5. ]),
-             np.array([ -6.45497898e-19,   7.97698047e-02,   1.52208991e-01,
-         2.56482414e-01,   3.31017197e-01,   4.03222197e-01,
-         4.72064814e-01,   5.37148347e-01,   5.97906198e-01,
-         6.53816662e-01,   7.04346413e-01,   7.48964617e-01,
-         7.87816053e-01,   8.21035507e-01,   8.48805502e-01,
-         8.71348421e-01,   8.88900296e-01,   9.03143354e-01,
-         9.16085646e-01,   9.28196443e-01,   9.38406001e-01,
-         9.45971114e-01,   9.51330905e-01,   9.54947930e-01,
-         9.57278503e-01,   9.58780477e-01,   9.59911792e-01,
-         9.60934825e-01,   9.62119406e-01,   9.63707446e-01,
-         9.66045076e-01,   9.69089467e-01,   9.73684854e-01,
-         9.75257929e-01,   9.77453939e-01,   9.81061451e-01,
-         9.80798098e-01,   9.82633805e-01,   9.83725248e-01,
-         9.84876762e-01,   9.85915295e-01,   9.86929684e-01,
-         9.87938594e-01,   9.88979493e-01,   9.90084808e-01,
-         9.91288321e-01,   9.92623448e-01,   9.94123703e-01,
-         9.96388866e-01,   9.98435907e-01,   1.00000000e+00,
-         0.00000000e+00,   0.00000000e+00,   0.00000000e+00,
-         0.00000000e+00]), 3)
-         
-        apercorr = 1.0/splev( xx, tck,)
-      
-   if norder == 2:       
-      apercorr = 1.0/uvotmisc.GaussianHalfIntegralFraction( 0.5*(k2-k1)/np.polyval(sigcoef,x) )
-   if norder == 3:       
-      apercorr = 1.0/uvotmisc.GaussianHalfIntegralFraction( 0.5*(k2-k1)/np.polyval(sigcoef,x) )
-   return apercorr
 
 def clipmask(f,sigclip=2.5,fpos=False):
    '''Provides mask to clip bad data.
@@ -4051,7 +4468,7 @@ def clipmask(f,sigclip=2.5,fpos=False):
       
 def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
    sigmas=None,noiselevel=None,width=40.0,composite_fit=True, fiterrors = True, \
-   smoothpix=1, amp2lim=None,fixsig=False,fixpos=False):
+   smoothpix=1, amp2lim=None,fixsig=False,fixpos=False,start=None,linear=False):
    ''' extract the spectral components for an image slice 
        at position(s) xpos (dispersion axis) using the Ypositions 
        of the orders. The value of Ypositions[0] should be the main peak.
@@ -4088,6 +4505,20 @@ def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
 
          amp2lim: second order prediction of a (minimum, maximum) valid for all xpos 
 
+         start: (amplitude, position, sigma) for each order to start the fit from 
+                instead of the maximum of f_meas, Ypositions and sigmas, e.g., the 
+                solution for the neighbouring slice. The parameter limits are still 
+                set by Ypositions and sigmas. If the fit fails, it is repeated from 
+                the default guesses. Only used with caldefault=True.
+
+         linear: with caldefault=True, keep the positions and sigmas at Ypositions and
+                 sigmas and solve only for the amplitudes and the background, which 
+                 are linear parameters (see fit_amplitudes). flag[5] is set to 1.
+                 This is not the same as fixsig=True, fixpos=True, which still let the 
+                 sigma move by 0.2 and the position by 0.05 pixel: where the fit would 
+                 move them, the amplitudes differ (by a few percent, more in faint 
+                 or blended columns).
+
    NPMK, 2010-07-15 Fecit
    NPMK, 2011-08-16 adding smoothing for improved fitting   
    NPMK  2011-08-26 replace leastsq with mpfit based routines; clip image outside spectrum width
@@ -4095,10 +4526,7 @@ def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
    '''
    import numpy
    from numpy import array, arange,transpose, where, abs, min, zeros, atleast_1d, atleast_2d, sqrt
-   try:
-      from convolve import boxcar
-   except:
-      from stsci.convolve import boxcar
+   from .uvotsmooth import boxcar
    
    xpos = atleast_1d(xpos)
    ori_img = atleast_2d(ori_img)
@@ -4157,14 +4585,24 @@ def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
       else:
          # the positions of the centre of the fits are given in Ypositions
          sigmaas = atleast_1d(sigmas)    
+         if linear:
+            params, perror = fit_amplitudes(f_meas[:,numpy.newaxis],f_err[:,numpy.newaxis]**2,
+                [0],Ypositions,sigmaas[:nypos])
+            flag[5] = 1
+            if fiterrors: return  (params[0],perror[0],flag), (y,f_meas)
+            else:         return  (tuple(params[0,2:]),flag), (y,f_meas)
          if nypos == 1: 
             if chatter > 3: print('len Ypositions == 1')
             sig0 = sigmaas[0]
             p0  = Ypositions[0]
             a0  = max(f_meas)
-            f_mask[p0-4*sig0:p0+4*sig0] = True 
+            f_mask[int(p0-4*sig0):int(p0+4*sig0)] = True 
                
             Z = runfit1(y[f_mask],f_meas[f_mask],f_err[f_mask],bg,a0,p0,sig0,\
+                       fixsig=fixsig,fixpos=fixpos,start=start)
+            if (type(start) != typeNone) and (Z.status <= 0):
+               # warm start failed; fit again from the guess   
+               Z = runfit1(y[f_mask],f_meas[f_mask],f_err[f_mask],bg,a0,p0,sig0,\
                        fixsig=fixsig,fixpos=fixpos)
             flag[5] = Z.status    
             if Z.status > 0:
@@ -4181,9 +4619,12 @@ def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
             p0, p1  = Ypositions
             a0  = 0.9 * max(f_meas)
             a1 = 0.5*a0 
-            f_mask[p0-4*sig0:p0+4*sig0] = True 
-            f_mask[p1-4*sig1:p1+4*sig1] = True 
+            f_mask[int(p0-4*sig0):int(p0+4*sig0)] = True 
+            f_mask[int(p1-4*sig1):int(p1+4*sig1)] = True 
             Z = runfit2(y[f_mask],f_meas[f_mask],f_err[f_mask],bg,a0,p0,sig0,a1,p1,sig1,\
+                       fixsig=fixsig,fixpos=fixpos,amp2lim=amp2lim,start=start)
+            if (type(start) != typeNone) and (Z.status <= 0):
+               Z = runfit2(y[f_mask],f_meas[f_mask],f_err[f_mask],bg,a0,p0,sig0,a1,p1,sig1,\
                        fixsig=fixsig,fixpos=fixpos,amp2lim=amp2lim)
             flag[5] = Z.status
             if Z.status > 0:
@@ -4197,9 +4638,12 @@ def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
             a0  = 0.9* max(f_meas)
             a1 = a0 
             a2 = a1 
-            f_mask[p0-4*sig0:p0+4*sig0] = True 
-            f_mask[p2-4*sig2:p2+4*sig2] = True 
+            f_mask[int(p0-4*sig0):int(p0+4*sig0)] = True 
+            f_mask[int(p2-4*sig2):int(p2+4*sig2)] = True 
             Z = runfit3(y[f_mask],f_meas[f_mask],f_err[f_mask],bg,a0,p0,sig0,a1,p1,sig1,a2,p2,sig2,\
+                   fixsig=fixsig,fixpos=fixpos,amp2lim=amp2lim,start=start)
+            if (type(start) != typeNone) and (Z.status <= 0):
+               Z = runfit3(y[f_mask],f_meas[f_mask],f_err[f_mask],bg,a0,p0,sig0,a1,p1,sig1,a2,p2,sig2,\
                    fixsig=fixsig,fixpos=fixpos,amp2lim=amp2lim)
             flag[5] = Z.status
             if Z.status > 0:
@@ -4444,6 +4888,216 @@ def get_components(xpos,ori_img,Ypositions,wheelpos,chatter=0,caldefault=False,\
       return Yout
       
 
+def get_components_batch(xpos,ori_img,Ypositions,wheelpos,sigmas=None,fiterrors=True,
+   amp2lim=None,fixsig=False,fixpos=False,chatter=0):
+   '''get_components(caldefault=True) for many image slices at once
+   
+   Parameters
+   ----------
+   xpos : list of arrays
+      for each slice the columns of ori_img to average
+   ori_img : 2D array
+      the (smoothed) image 
+   Ypositions : array (nslice, norder)
+      for each slice the y positions of the 1, 2, or 3 orders; the first 
+      is the main peak 
+   wheelpos : int
+      filter wheel position
+   sigmas : array (norder)
+      first guess of the sigma of each order; default [3.1,4.3,4.6]
+   fiterrors, amp2lim, fixsig, fixpos : 
+      as in get_components(); amp2lim and sigmas are used for all slices
+   chatter : int
+      verbosity
+      
+   Returns
+   -------
+   list with the result of get_components(caldefault=True) for each slice
+   
+   Notes
+   -----
+   The start values and limits are those of runfit1/runfit2/runfit3, but all 
+   slices are fitted together by batchfit.batchfit() with the model 
+   fit_gaussians(). The slices have a different number of points and are 
+   padded with points of infinite error. 
+   
+   History
+   -------
+   2017-06-20 batched version of the caldefault fits in get_components 
+   '''
+   import numpy as np
+   from .batchfit import batchfit
+   
+   Ypositions = np.atleast_2d(Ypositions)
+   nslice, nypos = Ypositions.shape
+   if not nypos in [1,2,3]:
+      raise ValueError("get_components_batch: Ypositions must give 1, 2, or 3 orders")
+   if type(sigmas) == typeNone: 
+      sigmas = np.array([3.1,4.3,4.6])
+   sigmaas = np.atleast_1d(sigmas)
+   y = np.arange(ori_img.shape[0],dtype=float)  # pixel number 
+   
+   p0 = [] ; parinfo = [] ; data = [] ; meas = []
+   for k in range(nslice):
+      xp = np.atleast_1d(xpos[k]).flatten()
+      xp = xp[ np.where(xp < ori_img.shape[1])[0] ]
+      if len(xp) < 1:
+         raise ValueError("get_components_batch: xpos must be at least one number")
+      f_meas = ori_img[:,xp].mean(axis=1).flatten()
+      f_pos = f_meas >= 0
+      f_err = 9.99e+9 * np.ones(len(f_meas))
+      f_err[f_pos] = 1.4*np.sqrt(f_meas[f_pos])
+      f_mask = clipmask( f_meas, fpos=True)
+      bg = f_meas[f_mask].mean()         
+      if nypos == 1:
+         sig0 = sigmaas[0]
+         pos0 = Ypositions[k,0]
+         a0  = max(f_meas)
+         f_mask[int(pos0-4*sig0):int(pos0+4*sig0)] = True 
+         p_, pinfo = runfit1_parinfo(bg,a0,pos0,sig0,fixsig=fixsig,fixpos=fixpos)
+         # fit1 returns 1e8*(y-model)
+         err = 1.0e-8*np.ones(f_mask.sum())
+      elif nypos == 2:
+         sig0, sig1 = sigmaas[0], sigmaas[1]
+         pos0, pos1  = Ypositions[k]
+         a0  = 0.9 * max(f_meas)
+         a1 = 0.5*a0 
+         f_mask[int(pos0-4*sig0):int(pos0+4*sig0)] = True 
+         f_mask[int(pos1-4*sig1):int(pos1+4*sig1)] = True 
+         p_, pinfo = runfit2_parinfo(bg,a0,pos0,sig0,a1,pos1,sig1,
+             fixsig=fixsig,fixpos=fixpos,amp2lim=amp2lim)
+         err = f_err[f_mask]
+      else:
+         sig0,sig1,sig2 = sigmaas[:3]
+         pos0, pos1, pos2  = Ypositions[k]
+         a0  = 0.9* max(f_meas)
+         a1 = a0 
+         a2 = a1 
+         f_mask[int(pos0-4*sig0):int(pos0+4*sig0)] = True 
+         f_mask[int(pos2-4*sig2):int(pos2+4*sig2)] = True 
+         p_, pinfo = runfit3_parinfo(bg,a0,pos0,sig0,a1,pos1,sig1,a2,pos2,sig2,
+             fixsig=fixsig,fixpos=fixpos,amp2lim=amp2lim)
+         err = f_err[f_mask]
+      p0.append(p_)   
+      parinfo.append(pinfo)
+      data.append((y[f_mask],f_meas[f_mask],err))
+      meas.append(f_meas)
+      
+   # stack the data of the slices    
+   m = max([len(d[0]) for d in data])
+   x_ = np.zeros((nslice,m))
+   f_ = np.zeros((nslice,m))
+   e_ = np.zeros((nslice,m)) + np.inf
+   for k in range(nslice):
+      n = len(data[k][0])
+      x_[k,:n], f_[k,:n], e_[k,:n] = data[k]
+   fa = {'x':x_,'y':f_,'err':e_}
+   
+   Z = batchfit(fit_gaussians,np.array(p0),functkw=fa,parinfo=parinfo,
+         autoderivative=False,quiet=(chatter < 3))
+   
+   result = []
+   for k in range(nslice):
+      flag = np.zeros(6, dtype=int )   
+      flag[5] = Z.status[k]
+      params = p0[k][2:]
+      if Z.status[k] > 0:
+         params = Z.params[k,2:]
+         perror = Z.perror[k]
+      else:
+         perror = None
+         if chatter > 1:
+            print("get_components_batch: slice %i fit error: %s"%(k,Z.errmsg[k]))
+      if fiterrors: 
+         result.append( ((Z.params[k],perror,flag), (y,meas[k])) )
+      else: 
+         result.append( ((tuple(params),flag), (y,meas[k])) )
+   return result   
+   
+
+def fit_amplitudes(img, var, cols, Ypositions, sigmas, bgwidth=10):
+   '''Amplitudes of the orders at fixed positions and widths for many columns
+   
+   Parameters
+   ----------
+   img : 2D array
+      image with the dispersion along the second axis, e.g., net counts
+   var : 2D array
+      variance of img
+   cols : array of int (ncol)
+      the columns of img to solve
+   Ypositions : array (ncol, norder)
+      for each column the y positions of the orders
+   sigmas : array (ncol, norder) or (norder)
+      width of the gaussian profile of each order, see singlegaussian()
+   bgwidth : int
+      number of pixels outside 4 sigma of the outer orders used for the 
+      background
+      
+   Returns
+   -------
+   params, perror : arrays (ncol, 2+3*norder)
+      the parameters as in runfit1/runfit2/runfit3: bg0, bg1, then 
+      amplitude, position and sigma for each order; and their errors 
+      (zero for the fixed positions and sigmas)
+   
+   Notes
+   -----
+   The model bg0 + bg1*y + sum of singlegaussian(y,amp,Ypos,sig) is linear 
+   in the amplitudes and the background. For each column the weighted 
+   least squares solution (weights 1/var) is found from the normal 
+   equations, for all columns at once. The amplitudes are not limited, 
+   so they can be negative. Pixels that are not finite or have var <= 0 
+   are skipped.
+   
+   History
+   -------
+   2017-06-20 linear solution for the order amplitudes at the calibrated positions
+   '''
+   import numpy as np
+   
+   cols = np.atleast_1d(np.asarray(cols,dtype=int))
+   ncol = len(cols)
+   ypos = np.asarray(Ypositions,dtype=float).reshape(ncol,-1)
+   nord = ypos.shape[1]
+   sig = np.asarray(sigmas,dtype=float)*np.ones((ncol,nord))
+   y = np.arange(img.shape[0],dtype=float)
+   f = img[:,cols].T 
+   v = var[:,cols].T
+   
+   # design matrix (ncol, ny, nord+2): gaussian profiles, background
+   dy = (y[np.newaxis,:,np.newaxis]-ypos[:,np.newaxis,:])/sig[:,np.newaxis,:]
+   A = np.empty((ncol,len(y),nord+2))
+   A[:,:,0] = 1.
+   A[:,:,1] = y
+   A[:,:,2:] = np.where(np.abs(dy) < 4., np.exp(-dy*dy), 0.)
+   
+   ylo = (ypos-4*sig).min(axis=1) - bgwidth
+   yhi = (ypos+4*sig).max(axis=1) + bgwidth
+   good = (y >= ylo[:,np.newaxis]) & (y <= yhi[:,np.newaxis]) & np.isfinite(f) \
+        & np.isfinite(v) & (v > 0)
+   w = np.where(good, 1./np.where(good,v,1.), 0.)
+   f = np.where(good, f, 0.)
+   
+   # normal equations 
+   Aw = A*w[:,:,np.newaxis]
+   N = np.einsum('cyi,cyj->cij',Aw,A)
+   b = np.einsum('cyi,cy->ci',Aw,f)
+   covar = np.linalg.pinv(N)
+   p = np.einsum('cij,cj->ci',covar,b)
+   perr = np.sqrt(np.abs(np.diagonal(covar,axis1=1,axis2=2)))
+   
+   params = np.zeros((ncol,2+3*nord))
+   perror = np.zeros((ncol,2+3*nord))
+   params[:,0:2] = p[:,0:2]
+   perror[:,0:2] = perr[:,0:2]
+   params[:,2::3] = p[:,2:]
+   perror[:,2::3] = perr[:,2:]
+   params[:,3::3] = ypos
+   params[:,4::3] = sig
+   return params, perror
+   
+
 def Fun1(p,y,x):
    '''compute the residuals for gaussian fit in get_components '''
    a0, x0, sig0 = p
@@ -4814,20 +5468,22 @@ def pix_from_wave( disp, wave,spectralorder=1 ):
    
    Note
    ----
-   polyinverse() was used which is inaccurate
+   polyinverse() was used which is inaccurate.
+   The pixel-wavelength table of the monotonic part of the dispersion 
+   around the anchor is made once for each `disp` (see 
+   pix_from_wave_table()) and interpolated, followed by Newton steps 
+   on the dispersion polynomial. The accuracy is better than 0.001A.  
    
    example
    -------
    d = pix_from_wave([3.2,2600.], lambda ) 
    
+   2017-06-20 table interpolation and Newton steps replace the fixed 100 iterations
    '''    
-   from scipy import interpolate
    import numpy as np
-   from stsci.convolve import boxcar
    
-   wave = np.asarray( wave )
+   wave = np.asarray( wave, dtype=float )
    wave = np.atleast_1d(wave)
-   wone = np.ones(len(wave))
    
    grism = None
    if (disp[-1] > 2350.0) & (disp[-1] < 2750.) : grism = 'UV'
@@ -4835,52 +5491,76 @@ def pix_from_wave( disp, wave,spectralorder=1 ):
    if grism == None:
       raise RuntimeError("The dispersion coefficients do not seem correct. Aborting.")    
    
-   if spectralorder == 1:
-     # initial guess
-     dinv = polyinverse( disp, np.arange(-370,1150) )
-     d = np.polyval(dinv, wave )
-     if len(wave) < 20:
-        dp = np.polyval(dinv, wave+10 )  # CRAP polyval!
-        y = (dp-d)/10.0
-        y[y <= 0] = y[y > 0].mean()
-        dpdw = y
-     else:      
-        fd = interpolate.interp1d(wave,d,bounds_error=False,fill_value=0.3,kind='quadratic') 
-        dp = fd(wave+20)
-        y = (dp-d)/20.0
-        y[y <= 0] = y[y > 0].mean()
-        dpdw = boxcar(y,(100,),mode='reflect')     
-     
-     count = 100
-     
-     while (np.abs(np.polyval(disp,d) - wave) > 0.5 * wone).all() | count > 0:
-     
-        dw = np.polyval(disp,d) - wave
-        d -= dpdw*dw*0.5 
-        
-        count -= 1
-        
-     return d
-     
-   if spectralorder == 2:
-     # initial guess
-     dinv = polyinverse( disp, np.arange(-640,1300) )
-     d = np.polyval(dinv, wave )
-     dp = np.polyval(dinv, wave+1.0 )
-     dpdw = dp-d
-     count = 100
-     
-     while (np.abs(np.polyval(disp,d) - wave) > 0.5 * wone).all() | count > 0:
+   table = pix_from_wave_table(disp, spectralorder=spectralorder)
+   if type(table) == typeNone: 
+      return
+   dtab, wtab = table
+   
+   d = np.interp(wave, wtab, dtab)
+   
+   # Newton steps; outside the table they extrapolate the dispersion 
+   ddisp = np.polyder(disp)
+   for count in range(5):
+      dw = np.polyval(disp,d) - wave
+      if (np.abs(dw) < 1.e-4).all(): break
+      d -= dw/np.polyval(ddisp,d)   
+   return d
+   
+   
+def pix_from_wave_table(disp, spectralorder=1):
+   '''Table of pixel distance and wavelength of the dispersion, for pix_from_wave().
+   
+   Parameters
+   ----------
+   disp : list
+     the dispersion polynomial coefficients
+   kwargs : dict   
+   - **spectralorder** : int
+     the spectral order number (1 or 2)
+   
+   Returns
+   -------
+   (pix, wave) : tuple of ndarray 
+     pixel distance (0.5 pix steps) and wavelength, sorted by increasing 
+     wavelength, over the part of the pixel range around the anchor where 
+     the dispersion is monotonic, or None for other spectral orders.   
      
-        dw = np.polyval(disp,d) - wave
-        d -= dpdw*dw*0.5 
-        
-        count -= 1
-        
-     return d
-
-   pix = np.polyval( disp, wave )
-   return   
+   Notes
+   -----
+   The tables are kept in _pix_from_wave_tables, by disp and spectralorder.  
+   '''
+   import numpy as np
+   
+   key = (tuple(np.ravel(disp).tolist()), spectralorder)
+   if key in _pix_from_wave_tables:
+      return _pix_from_wave_tables[key]
+      
+   if spectralorder == 1:
+      dis = np.arange(-370,1150.5,0.5)
+   elif spectralorder == 2:   
+      dis = np.arange(-640,1300.5,0.5)
+   else:
+      return   
+      
+   wav = np.polyval(disp, dis)
+   # the monotonic part including the anchor (dis = 0)
+   i0 = dis.searchsorted(0.)
+   sign = np.sign(np.diff(wav))
+   s0 = sign[i0]
+   k1 = i0
+   while (k1 > 0) and (sign[k1-1] == s0): k1 -= 1
+   k2 = i0
+   while (k2 < len(sign)-1) and (sign[k2+1] == s0): k2 += 1
+   dis = dis[k1:k2+2]
+   wav = wav[k1:k2+2]
+   if s0 < 0:
+      dis = dis[::-1]
+      wav = wav[::-1]
+      
+   if len(_pix_from_wave_tables) > 100: 
+      _pix_from_wave_tables.clear()
+   _pix_from_wave_tables[key] = (dis, wav)
+   return dis, wav
 
 
 
@@ -4988,22 +5668,97 @@ def predict_second_order(dis,spnet,C_1,C_2,d12,qual,dismin,dismax,wheelpos):
 '''
     
 def runfit3(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,amp3,pos3,sig3,amp2lim=None,
-    fixsig=False, fixsiglim=0.2, fixpos=False,chatter=0):
+    fixsig=False, fixsiglim=0.2, fixpos=False,chatter=0,autoderivative=False,start=None):
    '''Three gaussians plus a linear varying background 
    
    for the rotated image, multiply err by 2.77 to get right chi-squared (.fnorm/(nele-nparm))
+   
+   mpfit uses the analytic derivatives of fit3 unless autoderivative is set
+   
+   start: optional start values (amp1,pos1,sig1,amp2,...) used instead of the 
+      guesses; the parameter limits are still set from the guesses (see runfit_start)
    '''
    import numpy as np
    #import numpy.oldnumeric as Numeric
    import mpfit 
    
-   if np.isfinite(bg): 
-     bg0 = bg
-   else: bg0 = 0.0
+   p0, parinfo = runfit3_parinfo(bg,amp1,pos1,sig1,amp2,pos2,sig2,amp3,pos3,sig3,
+       amp2lim=amp2lim,fixsig=fixsig,fixsiglim=fixsiglim,fixpos=fixpos)
+   if type(start) != typeNone:
+      p0, parinfo = runfit_start(p0, parinfo, start)
    
-   bg1 = 0.0  
-   if np.isfinite(sig1):
-      sig1 = np.abs(sig1)
+   # define the variables for the function 'myfunct'
+   fa = {'x':x,'y':f,'err':err}
+     
+   if chatter > 4: 
+      print("parinfo has been set to: ") 
+      for par in parinfo: print(par)
+
+   Z = mpfit.mpfit(fit3,p0,functkw=fa,parinfo=parinfo,quiet=True,
+          autoderivative=int(autoderivative))
+   
+   '''.status :
+      An integer status code is returned.  All values greater than zero can
+      represent success (however .status == 5 may indicate failure to
+      converge). It can have one of the following values:
+ 
+      -16
+         A parameter or function value has become infinite or an undefined
+         number.  This is usually a consequence of numerical overflow in the
+         user's model function, which must be avoided.
+ 
+      -15 to -1 
+         These are error codes that either MYFUNCT or iterfunct may return to
+         terminate the fitting process.  Values from -15 to -1 are reserved
+         for the user functions and will not clash with MPFIT.
+ 
+      0  Improper input parameters.
+         
+      1  Both actual and predicted relative reductions in the sum of squares
+         are at most ftol.
+         
+      2  Relative error between two consecutive iterates is at most xtol
+         
+      3  Conditions for status = 1 and status = 2 both hold.
+         
+      4  The cosine of the angle between fvec and any column of the jacobian
+         is at most gtol in absolute value.
+         
+      5  The maximum number of iterations has been reached.
+         
+      6  ftol is too small. No further reduction in the sum of squares is
+         possible.
+         
+      7  xtol is too small. No further improvement in the approximate solution
+         x is possible.
+         
+      8  gtol is too small. fvec is orthogonal to the columns of the jacobian
+         to machine precision.
+         '''
+   
+   if (Z.status <= 0): 
+      print('uvotgetspec.runfit3.mpfit error message = ', Z.errmsg)
+      print("parinfo has been set to: ") 
+      for par in parinfo: print(par)
+   elif (chatter > 3):   
+      print("\nparameters and errors : ")
+      for i in range(8): print("%10.3e +/- %10.3e\n"%(Z.params[i],Z.perror[i]))
+   
+   return Z     
+       
+       
+def runfit3_parinfo(bg,amp1,pos1,sig1,amp2,pos2,sig2,amp3,pos3,sig3,amp2lim=None,
+    fixsig=False, fixsiglim=0.2, fixpos=False):
+   '''start parameters and parinfo limits of the runfit3() fit; returns p0, parinfo '''
+   import numpy as np
+   
+   if np.isfinite(bg): 
+     bg0 = bg
+   else: bg0 = 0.0
+   
+   bg1 = 0.0  
+   if np.isfinite(sig1):
+      sig1 = np.abs(sig1)
    else: sig1 = 3.1 
    if np.isfinite(sig2):  
       sig2 = np.abs(sig2)
@@ -5065,9 +5820,6 @@ def runfit3(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,amp3,pos3,sig3,amp2lim=None
       sig2_hi = min([sig2+1.4,6.])
       sig3_hi = min([sig3+1.9,8.])
       
-   # define the variables for the function 'myfunct'
-   fa = {'x':x,'y':f,'err':err}
-     
    if amp2lim != None:
       amp2min, amp2max = amp2lim
       parinfo = [{  \
@@ -5096,60 +5848,7 @@ def runfit3(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,amp3,pos3,sig3,amp2lim=None
    'limited': [1,1],   'limits' : [pos3a,pos3b],       'value'  :  pos3,   'parname': 'pos3'   },{  \
    'limited': [1,1],   'limits' : [sig3_lo,sig3_hi],   'value'  :  sig3,   'parname': 'sig3'   }]  
 
-   if chatter > 4: 
-      print("parinfo has been set to: ") 
-      for par in parinfo: print(par)
-
-   Z = mpfit.mpfit(fit3,p0,functkw=fa,parinfo=parinfo,quiet=True)
-   
-   '''.status :
-      An integer status code is returned.  All values greater than zero can
-      represent success (however .status == 5 may indicate failure to
-      converge). It can have one of the following values:
- 
-      -16
-         A parameter or function value has become infinite or an undefined
-         number.  This is usually a consequence of numerical overflow in the
-         user's model function, which must be avoided.
- 
-      -15 to -1 
-         These are error codes that either MYFUNCT or iterfunct may return to
-         terminate the fitting process.  Values from -15 to -1 are reserved
-         for the user functions and will not clash with MPFIT.
- 
-      0  Improper input parameters.
-         
-      1  Both actual and predicted relative reductions in the sum of squares
-         are at most ftol.
-         
-      2  Relative error between two consecutive iterates is at most xtol
-         
-      3  Conditions for status = 1 and status = 2 both hold.
-         
-      4  The cosine of the angle between fvec and any column of the jacobian
-         is at most gtol in absolute value.
-         
-      5  The maximum number of iterations has been reached.
-         
-      6  ftol is too small. No further reduction in the sum of squares is
-         possible.
-         
-      7  xtol is too small. No further improvement in the approximate solution
-         x is possible.
-         
-      8  gtol is too small. fvec is orthogonal to the columns of the jacobian
-         to machine precision.
-         '''
-   
-   if (Z.status <= 0): 
-      print('uvotgetspec.runfit3.mpfit error message = ', Z.errmsg)
-      print("parinfo has been set to: ") 
-      for par in parinfo: print(par)
-   elif (chatter > 3):   
-      print("\nparameters and errors : ")
-      for i in range(8): print("%10.3e +/- %10.3e\n"%(Z.params[i],Z.perror[i]))
-   
-   return Z     
+   return p0, parinfo
        
        
 def fit3(p, fjac=None, x=None, y=None, err=None):
@@ -5169,18 +5868,56 @@ def fit3(p, fjac=None, x=None, y=None, err=None):
             # Non-negative status value means MPFIT should continue, negative means
             # stop the calculation.
    status = 0
-   return [status, (y-model)/err]
+   if type(fjac) == typeNone:
+      return [status, (y-model)/err]
+   pderiv = gauss_pderiv(x,p)/np.asarray(err)[:,np.newaxis]   
+   return [status, (y-model)/err, pderiv]
     
 def runfit2(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,amp2lim=None,fixsig=False,
-    fixsiglim=0.2, fixpos=False,chatter=0):
+    fixsiglim=0.2, fixpos=False,chatter=0,autoderivative=False,start=None):
    '''Three gaussians plus a linear varying background 
    
    for the rotated image, multiply err by 2.77 to get right chi-squared (.fnorm/(nele-nparm))
+   
+   mpfit uses the analytic derivatives of fit2 unless autoderivative is set
+   
+   start: optional start values (amp1,pos1,sig1,amp2,pos2,sig2), see runfit3
    '''
    import numpy as np
    #import numpy.oldnumeric as Numeric
    import mpfit 
    
+   p0, parinfo = runfit2_parinfo(bg,amp1,pos1,sig1,amp2,pos2,sig2,amp2lim=amp2lim,
+       fixsig=fixsig,fixsiglim=fixsiglim,fixpos=fixpos)
+   if type(start) != typeNone:
+      p0, parinfo = runfit_start(p0, parinfo, start)
+   
+   # define the variables for the function 'myfunct'
+   fa = {'x':x,'y':f,'err':err}
+
+   if chatter > 4: 
+      print("parinfo has been set to: ") 
+      for par in parinfo: print(par)
+
+   Z = mpfit.mpfit(fit2,p0,functkw=fa,parinfo=parinfo,quiet=True,
+          autoderivative=int(autoderivative))
+   
+   if (Z.status <= 0): 
+      print('uvotgetspec.runfit2.mpfit error message = ', Z.errmsg)
+      print("parinfo has been set to: ") 
+      for par in parinfo: print(par)
+   elif (chatter > 3):   
+      print("\nparameters and errors : ")
+      for i in range(8): print("%10.3e +/- %10.3e\n"%(Z.params[i],Z.perror[i]))
+   
+   return Z     
+       
+       
+def runfit2_parinfo(bg,amp1,pos1,sig1,amp2,pos2,sig2,amp2lim=None,fixsig=False,
+    fixsiglim=0.2, fixpos=False):
+   '''start parameters and parinfo limits of the runfit2() fit; returns p0, parinfo '''
+   import numpy as np
+   
    if np.isfinite(bg):
       bg0 = bg
    else: bg0 = 0.0   
@@ -5194,9 +5931,6 @@ def runfit2(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,amp2lim=None,fixsig=False,
 
    p0 = (bg0,bg1,amp1,pos1,sig1,amp2,pos2,sig2)
    
-   # define the variables for the function 'myfunct'
-   fa = {'x':x,'y':f,'err':err}
-
    if fixpos:
      pos1a = pos1-0.05
      pos1b = pos1+0.05
@@ -5249,21 +5983,7 @@ def runfit2(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,amp2lim=None,fixsig=False,
    'limited': [1,1],   'limits' : [pos2a,pos2b],       'value'  :  pos2,   'parname': 'pos2'   },{  \
    'limited': [1,1],   'limits' : [sig2_lo,sig2_hi],   'value'  :  sig2,   'parname': 'sig2'   }]  
 
-   if chatter > 4: 
-      print("parinfo has been set to: ") 
-      for par in parinfo: print(par)
-
-   Z = mpfit.mpfit(fit2,p0,functkw=fa,parinfo=parinfo,quiet=True)
-   
-   if (Z.status <= 0): 
-      print('uvotgetspec.runfit2.mpfit error message = ', Z.errmsg)
-      print("parinfo has been set to: ") 
-      for par in parinfo: print(par)
-   elif (chatter > 3):   
-      print("\nparameters and errors : ")
-      for i in range(8): print("%10.3e +/- %10.3e\n"%(Z.params[i],Z.perror[i]))
-   
-   return Z     
+   return p0, parinfo
        
        
 def fit2(p, fjac=None, x=None, y=None, err=None):
@@ -5276,17 +5996,49 @@ def fit2(p, fjac=None, x=None, y=None, err=None):
            amp2 * np.exp( - ((x-pos2)/sig2)**2 ) 
             
    status = 0
-   return [status, (y-model)/err]
+   if type(fjac) == typeNone:
+      return [status, (y-model)/err]
+   pderiv = gauss_pderiv(x,p)/np.asarray(err)[:,np.newaxis]   
+   return [status, (y-model)/err, pderiv]
     
-def runfit1(x,f,err,bg,amp1,pos1,sig1,fixsig=False,fixpos=False,fixsiglim=0.2,chatter=0):
+def runfit1(x,f,err,bg,amp1,pos1,sig1,fixsig=False,fixpos=False,fixsiglim=0.2,chatter=0,
+    autoderivative=False,start=None):
    '''Three gaussians plus a linear varying background 
    
    for the rotated image, multiply err by 2.77 to get right chi-squared (.fnorm/(nele-nparm))
+   
+   mpfit uses the analytic derivatives of fit1 unless autoderivative is set
+   
+   start: optional start values (amp1,pos1,sig1), see runfit3
    '''
    import numpy as np
    #import numpy.oldnumeric as Numeric
    import mpfit 
    
+   p0, parinfo = runfit1_parinfo(bg,amp1,pos1,sig1,fixsig=fixsig,fixpos=fixpos,
+       fixsiglim=fixsiglim)
+   if type(start) != typeNone:
+      p0, parinfo = runfit_start(p0, parinfo, start)
+   
+   # define the variables for the function 'myfunct'
+   fa = {'x':x,'y':f,'err':err}
+   
+   if chatter > 4: 
+      print("parinfo has been set to: ") 
+      for par in parinfo: print(par)
+
+   Z = mpfit.mpfit(fit1,p0,functkw=fa,parinfo=parinfo,quiet=True,
+          autoderivative=int(autoderivative))
+   
+   if (Z.status <= 0): print('uvotgetspec.runfit1.mpfit error message = ', Z.errmsg)
+      
+   return Z     
+       
+       
+def runfit1_parinfo(bg,amp1,pos1,sig1,fixsig=False,fixpos=False,fixsiglim=0.2):
+   '''start parameters and parinfo limits of the runfit1() fit; returns p0, parinfo '''
+   import numpy as np
+   
    if np.isfinite(bg):
       bg0 = bg
    else: bg0 = 0.00  
@@ -5299,9 +6051,6 @@ def runfit1(x,f,err,bg,amp1,pos1,sig1,fixsig=False,fixpos=False,fixsiglim=0.2,ch
 
    p0 = (bg0,bg1,amp1,pos1,sig1)
    
-   # define the variables for the function 'myfunct'
-   fa = {'x':x,'y':f,'err':err}
-   
    if fixsig:
       sig1_lo = sig1-fixsiglim
       sig1_hi = sig1+fixsiglim
@@ -5325,15 +6074,39 @@ def runfit1(x,f,err,bg,amp1,pos1,sig1,fixsig=False,fixpos=False,fixsiglim=0.2,ch
    'limited': [1,1],   'limits' : [pos1a,pos1b],         'value' :  pos1,   'parname': 'pos1'   },{  \
    'limited': [1,1],   'limits' : [sig1_lo,sig1_hi],     'value' :  sig1,   'parname': 'sig1'   }]  
 
-   if chatter > 4: 
-      print("parinfo has been set to: ") 
-      for par in parinfo: print(par)
-
-   Z = mpfit.mpfit(fit1,p0,functkw=fa,parinfo=parinfo,quiet=True)
+   return p0, parinfo
+       
+       
+def runfit_start(p0, parinfo, start):
+   '''replace the start values of the gaussian parameters in p0 and parinfo
    
-   if (Z.status <= 0): print('uvotgetspec.runfit1.mpfit error message = ', Z.errmsg)
-      
-   return Z     
+   Parameters
+   ----------
+   p0, parinfo : 
+      as returned by runfit1_parinfo(), runfit2_parinfo() or runfit3_parinfo()
+   start : array
+      (amp1,pos1,sig1,...) start values, e.g., the solution of the 
+      neighbouring image slice. Values which are not finite are skipped.
+   
+   Returns
+   -------
+   p0, parinfo with the start values clipped to the parameter limits. 
+   The limits are not changed, so that they stay centred on the 
+   predicted positions and widths.
+   '''
+   import numpy as np
+   import copy
+   
+   p0 = list(p0)
+   parinfo = copy.deepcopy(parinfo)
+   for k, value in enumerate(np.ravel(start)[:len(p0)-2]):
+      if not np.isfinite(value): continue
+      par = parinfo[k+2]
+      if par['limited'][0]: value = max(value, par['limits'][0])
+      if par['limited'][1]: value = min(value, par['limits'][1])
+      p0[k+2] = value
+      par['value'] = value
+   return tuple(p0), parinfo
        
        
 def fit1(p, fjac=None, x=None, y=None, err=None):
@@ -5344,9 +6117,202 @@ def fit1(p, fjac=None, x=None, y=None, err=None):
    model = bg0 + bg1*x + amp1 * np.exp( - ((x-pos1)/sig1)**2 ) 
    
    status = 0
-   return  [status, 1e8*(y-model)]  
+   if type(fjac) == typeNone:
+      return  [status, 1e8*(y-model)]  
+   return  [status, 1e8*(y-model), 1e8*gauss_pderiv(x,p)]  
 
 
+def gauss_pderiv(x, p):
+   '''derivatives of the model of fit1, fit2, fit3 and fit_gaussians: a linear 
+   background p[0:2] plus gaussians with (amp, pos, sig) in p[2:5], p[5:8], p[8:11].
+   p is one parameter set (npar) with x (m), or one set per problem (nprob,npar) 
+   with x (nprob,m); the result has shape x.shape+(npar,).'''
+   import numpy as np
+   
+   x = np.asarray(x, dtype=float)
+   p = np.asarray(p, dtype=float)
+   npar = p.shape[-1]
+   pderiv = np.zeros(x.shape+(npar,))
+   pderiv[...,0] = 1.0
+   pderiv[...,1] = x
+   for k in range((npar-2)//3):
+      amp, pos, sig = [p[...,2+3*k+j,np.newaxis] for j in range(3)]
+      u = (x-pos)/sig
+      g = np.exp( - u**2 )
+      pderiv[...,2+3*k] = g
+      pderiv[...,3+3*k] = 2.0*amp*g*u/sig
+      pderiv[...,4+3*k] = 2.0*amp*g*u*u/sig
+   return pderiv
+
+
+def fit_gaussians(p, fjac=None, x=None, y=None, err=None):
+   '''linear background plus gaussians for batchfit: p[:,0:2] are bg0, bg1 and 
+   each next three (amp, pos, sig) a gaussian, for the data x, y, err (nprob,m).
+   With fjac the derivatives of the model are returned too.'''
+   import numpy as np
+
+   # the gaussians are the derivatives to the amplitudes (see gauss_pderiv)
+   pderiv = gauss_pderiv(x,p)
+   model = p[:,0,np.newaxis] + p[:,1,np.newaxis]*x + \
+      (pderiv[:,:,2::3]*p[:,np.newaxis,2::3]).sum(axis=2)
+   status = 0
+   if type(fjac) == typeNone:
+      return [status, (y-model)/err]
+   return [status, (y-model)/err, pderiv/err[:,:,np.newaxis]]
+
+
+def _calcache_dir():
+   '''directory for cached calibration products: calspline_cachedir, $UVOTPY_CACHE or ~/.uvotpy/cache'''
+   import os
+   cachedir = calspline_cachedir
+   if cachedir == None:
+      cachedir = os.getenv('UVOTPY_CACHE')
+   if cachedir == None:
+      cachedir = os.path.join(os.path.expanduser('~'),'.uvotpy','cache')
+   return cachedir   
+
+
+def get_calspline_tck(calfile, mode, x, y, surfaces, key=(), kx=1, ky=1, s=0, chatter=0):
+   '''Return the bivariate spline fits of the wavecal surfaces, fitting them only once.
+   
+   Parameters
+   ----------
+   calfile : str
+      path of the wavecal file the surfaces were read from
+   mode : str
+      interpolation mode of getCalData(), e.g., 'bisplines' or 'extrapolate'
+   x, y : ndarray
+      the field positions (PHI_X, PHI_Y) of the grid points
+   surfaces : list of (name, ndarray)
+      the values of each surface at the grid points
+   key : tuple
+      anything else the fit depends on
+   kx, ky, s : 
+      passed to scipy.interpolate.bisplrep
+   chatter : int
+      verbosity
+      
+   Returns
+   -------
+   tck : dict
+      the tck tuple of interpolate.bisplrep() for each surface name 
+   
+   Notes
+   -----
+   The fits depend only on the calibration file, so they are kept in 
+   memory and in a pickle file in `calspline_cachedir` (default 
+   $UVOTPY_CACHE, or ~/.uvotpy/cache), keyed by the calfile path, its 
+   modification time, the mode, and the fit parameters. A changed calfile 
+   is therefore fitted again. Set `calspline_cache = False` to always fit. 
+   
+   History
+   -------
+   2017-06-20 cache the fits instead of refitting each call  
+   '''
+   import os
+   import hashlib
+   try:
+      import cPickle as pickle
+   except ImportError:
+      import pickle
+   from scipy import interpolate
+   
+   def fit(names):
+      tck = {}
+      for name, z in surfaces:
+         if name in names:
+            tck[name] = interpolate.bisplrep(x, y, z, xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, 
+               kx=kx,ky=ky,s=s)
+      return tck
+      
+   names = [name for name, z in surfaces]
+   if not calspline_cache: 
+      return fit(names)
+      
+   calfile = os.path.abspath(calfile)   
+   cachekey = (calfile, os.path.getmtime(calfile), mode, kx, ky, s) + tuple(key)
+   tck = _calspline_tck.setdefault(cachekey,{})
+   missing = [name for name in names if name not in tck]
+   if len(missing) == 0:
+      return tck
+      
+   cachedir = _calcache_dir()
+   cachefile = os.path.join(cachedir,'calspline_'+
+      hashlib.md5(repr(cachekey).encode('utf-8')).hexdigest()+'.pkl')
+   if os.access(cachefile,os.R_OK):
+      try:
+         f = open(cachefile,'rb')
+         tck.update(pickle.load(f))
+         f.close()
+         if chatter > 2: print("get_calspline_tck: read spline fits from %s"%(cachefile))
+      except Exception:
+         if chatter > 0: print("get_calspline_tck: WARNING - cannot read %s"%(cachefile))
+      missing = [name for name in names if name not in tck]
+      if len(missing) == 0:
+         return tck
+   
+   if chatter > 2: print("get_calspline_tck: fitting %s"%(missing))    
+   tck.update(fit(missing))
+   # write to a temporary file first, since other processes may read the cache   
+   try:
+      if not os.path.isdir(cachedir):
+         os.makedirs(cachedir)
+      tmpfile = cachefile+'.%i'%(os.getpid())   
+      f = open(tmpfile,'wb')
+      pickle.dump(tck,f,2)
+      f.close()
+      os.rename(tmpfile,cachefile)
+   except (IOError, OSError):
+      if chatter > 0: print("get_calspline_tck: WARNING - cannot write cache %s"%(cachefile))
+   return tck   
+
+   
+def get_wavecal_file(wheelpos, caldir=None, chatter=0):
+   '''Return the path of the wavelength calibration file for wheelpos.
+   
+   The directory is caldir, or else $UVOTPY/calfiles, or else the 
+   grism directory in $CALDB.
+   '''
+   import os
+   if caldir == None:
+      uvotpy = os.getenv('UVOTPY')
+      caldb  = os.getenv('CALDB')
+      if uvotpy != None: 
+         caldir = uvotpy+'/calfiles/'
+      elif caldb != None:
+         caldir = caldb+'/data/swift/uvota/bcf/grism/'
+      else:
+         print("CALDB nor UVOTPY environment variable set.")     
+      
+   if wheelpos == 200: 
+      calfile = 'swugu0200wcal20041120v001.fits'
+      oldcalfile='swwavcal20090406_v1_mssl_ug200.fits'
+      calfile = caldir+'/'+calfile
+      if chatter > 1: print('reading UV Nominal calfile '+calfile)
+   elif wheelpos == 160: 
+      calfile='swugu0160wcal20041120v002.fits'
+      oldcalfile= 'swwavcal20090626_v2_mssl_uc160_wlshift6.1.fits'
+      calfile = caldir+'/'+calfile
+      if chatter > 1: print('reading UV clocked calfile '+calfile) 
+   elif wheelpos == 955: 
+      calfile='swugv0955wcal20041120v001.fits'
+      oldcalfile= 'swwavcal20100421_v0_mssl_vc955_wlshift-8.0.fits'
+      calfile = caldir+'/'+calfile
+      if chatter > 1: print('reading V Clockedcalfile '+calfile) 
+   elif wheelpos == 1000: 
+      calfile='swugv1000wcal20041120v001.fits'
+      oldcalfile= 'swwavcal20100121_v0_mssl_vg1000.fits'
+      calfile = caldir+'/'+calfile
+      if chatter > 1: print('reading V Nominal calfile  '+calfile) 
+   else:
+      if chatter > 1: 
+         print("Could not find a valid wave calibration file for wheelpos = ",wheelpos)
+         print("Aborting")
+         print("******************************************************************")
+      raise IOError("missing calibration file")
+   return calfile   
+
+   
 def getCalData(Xphi, Yphi, wheelpos,date, chatter=3,mode='bilinear',
    kx=1,ky=1,s=0,calfile=None,caldir=None, msg=''):
    '''Retrieve the calibration data for the anchor and dispersion (wavelengths).
@@ -5375,7 +6341,9 @@ def getCalData(Xphi, Yphi, wheelpos,date, chatter=3,mode='bilinear',
      
      - **mode** : str
      
-       interpolation method. Use 'bilinear' only.
+       interpolation method. Use 'bilinear' only, or 'calmap' to look up 
+       the bilinear interpolation in the precomputed map made by 
+       uvotcalmap.make_calmap(). In that case `data` is returned as None.
      
      - **kx**, **ky** : int, {1,2,3}
        order of interpolation. Use linear interpolation only. 
@@ -5430,50 +6398,25 @@ def getCalData(Xphi, Yphi, wheelpos,date, chatter=3,mode='bilinear',
    # rx,ry = uvotmisc.uvotrotvec(xf,yf,-64.6)
    #==================================================================
    if calfile == None:
-      #
-      #  get the calibration file
-      #
-      try:
-         uvotpy = os.getenv('UVOTPY')
-         caldb  = os.getenv('CALDB')
-         if uvotpy != None: 
-            caldir = uvotpy+'/calfiles/'
-         elif caldb != None:
-            caldir = caldb+'/data/swift/uvota/bcf/grism/'
-      except:
-         print("CALDB nor UVOTPY environment variable set.")     
-      
-      #if caldir == None: 
-      #   # hardcoded development system 
-      #   caldir = '/Volumes/users/Users/kuin/dev/uvotpy.latest/calfiles'
-         
-      if wheelpos == 200: 
-         calfile = 'swugu0200wcal20041120v001.fits'
-         oldcalfile='swwavcal20090406_v1_mssl_ug200.fits'
-         calfile = caldir+'/'+calfile
-         if chatter > 1: print('reading UV Nominal calfile '+calfile)
-      elif wheelpos == 160: 
-         calfile='swugu0160wcal20041120v002.fits'
-         oldcalfile= 'swwavcal20090626_v2_mssl_uc160_wlshift6.1.fits'
-         calfile = caldir+'/'+calfile
-         if chatter > 1: print('reading UV clocked calfile '+calfile) 
-      elif wheelpos == 955: 
-         calfile='swugv0955wcal20041120v001.fits'
-         oldcalfile= 'swwavcal20100421_v0_mssl_vc955_wlshift-8.0.fits'
-         calfile = caldir+'/'+calfile
-         if chatter > 1: print('reading V Clockedcalfile '+calfile) 
-      elif wheelpos == 1000: 
-         calfile='swugv1000wcal20041120v001.fits'
-         oldcalfile= 'swwavcal20100121_v0_mssl_vg1000.fits'
-         calfile = caldir+'/'+calfile
-         if chatter > 1: print('reading V Nominal calfile  '+calfile) 
-      else:
-          if chatter > 1: 
-             print("Could not find a valid wave calibration file for wheelpos = ",wheelpos)
-             print("Aborting")
-             print("******************************************************************")
-             raise IOError("missing calibration file")
-               
+      calfile = get_wavecal_file(wheelpos, caldir=caldir, chatter=chatter)
+      
+   if mode == 'calmap':
+      # look up the precomputed map; outside the map use the calibration file
+      from . import uvotcalmap
+      cmap = uvotcalmap.get_calmap(wheelpos, calfile=calfile, chatter=chatter)
+      if cmap.inside(Xphi,Yphi):
+         r = cmap.lookup(Xphi,Yphi)
+         msg += "wavecal file : %s\n"%(calfile.split('/')[-1])
+         anker  = np.array([r['xp1'],r['yp1']]) 
+         anker2 = np.array([r['xp2'],r['yp2']]) 
+         C_1 = np.array([r['c14'],r['c13'],r['c12'],r['c11'],r['c10']])
+         C_2 = np.array([r['c22'],r['c21'],r['c20']])
+         if chatter > 0: 
+            print('getCalData. calibration map lookup')
+            print('getCalData. anker [DET-pix]   = ', anker)
+            print('getCalData. second order anker at = ', anker2, '  [DET-pix] ') 
+         return anker, anker2, C_1, C_2, r['theta'], None, msg
+      mode = 'bilinear'   
 
    msg += "wavecal file : %s\n"%(calfile.split('/')[-1])
    #  look up the data corresponding to the (Xphi,Yphi) point in the 
@@ -5640,41 +6583,36 @@ def getCalData(Xphi, Yphi, wheelpos,date, chatter=3,mode='bilinear',
       # find the anchor positions by extrapolation
       anker  = np.zeros(2)
       anker2 = np.zeros(2)
-      tck1x = interpolate.bisplrep(xf, yf, xp1, xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19,kx=3,ky=3,s=None) 
-      tck1y = interpolate.bisplrep(xf, yf, yp1, xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19,kx=3,ky=3,s=None) 
-      tck2x = interpolate.bisplrep(xf, yf, xp1, xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19,kx=3,ky=3,s=None) 
-      tck2y = interpolate.bisplrep(xf, yf, yp1, xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19,kx=3,ky=3,s=None) 
+      second = ((ix == N1-1) ^ (iy == 0))
+      surfaces = [('xp1',xp1),('yp1',yp1),('th',th),('c10',c10),('c11',c11),
+         ('c12',c12),('c13',c13),('c14',c14)]
+      if second:
+         surfaces += [('c20',c20),('c21',c21),('c22',c22)] 
+      tck = get_calspline_tck(calfile, 'extrapolate', xf, yf, surfaces,
+         key=(second,), kx=3, ky=3, s=None, chatter=chatter)
      
-      anker[0]  = xp1i = interpolate.bisplev(rx,ry, tck1x) 
-      anker[1]  = yp1i = interpolate.bisplev(rx,ry, tck1y)      
-      anker2[0] = xp2i = interpolate.bisplev(rx,ry, tck2x) 
-      anker2[1] = yp2i = interpolate.bisplev(rx,ry, tck2y) 
+      # the second order anchor is extrapolated from the first order anchor fit 
+      anker[0]  = xp1i = interpolate.bisplev(rx,ry, tck['xp1']) 
+      anker[1]  = yp1i = interpolate.bisplev(rx,ry, tck['yp1'])      
+      anker2[0] = xp2i = xp1i 
+      anker2[1] = yp2i = yp1i 
       
       # find the angle  
       
-      tck = interpolate.bisplrep(xf, yf, th,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-      thi = interpolate.bisplev(rx,ry, tck)
+      thi = interpolate.bisplev(rx,ry, tck['th'])
       
       # find the dispersion
       
-      tck = interpolate.bisplrep(xf, yf, c10,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-      c10i = interpolate.bisplev(rx,ry, tck)
-      tck = interpolate.bisplrep(xf, yf, c11,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-      c11i = interpolate.bisplev(rx,ry, tck)
-      tck = interpolate.bisplrep(xf, yf, c12,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-      c12i = interpolate.bisplev(rx,ry, tck)
-      tck = interpolate.bisplrep(xf, yf, c13,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-      c13i = interpolate.bisplev(rx,ry, tck)
-      tck = interpolate.bisplrep(xf, yf, c14,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-      c14i = interpolate.bisplev(rx,ry, tck)
-      
-      if ((ix == N1-1) ^ (iy == 0)):
-         tck = interpolate.bisplrep(xf, yf, c20,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-         c20i = interpolate.bisplev(rx,ry, tck)
-         tck = interpolate.bisplrep(xf, yf, c21,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-         c21i = interpolate.bisplev(rx,ry, tck)
-         tck = interpolate.bisplrep(xf, yf, c22,xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=3,ky=3,s=None) 
-         c22i = interpolate.bisplev(rx,ry, tck)
+      c10i = interpolate.bisplev(rx,ry, tck['c10'])
+      c11i = interpolate.bisplev(rx,ry, tck['c11'])
+      c12i = interpolate.bisplev(rx,ry, tck['c12'])
+      c13i = interpolate.bisplev(rx,ry, tck['c13'])
+      c14i = interpolate.bisplev(rx,ry, tck['c14'])
+      
+      if second:
+         c20i = interpolate.bisplev(rx,ry, tck['c20'])
+         c21i = interpolate.bisplev(rx,ry, tck['c21'])
+         c22i = interpolate.bisplev(rx,ry, tck['c22'])
       else:
          c20i = c21i = c22i = np.NaN 
       if chatter > 2: 
@@ -5704,33 +6642,28 @@ def getCalData(Xphi, Yphi, wheelpos,date, chatter=3,mode='bilinear',
          m = N1*N1
          if chatter > 2: print('\n getCalData. splines ') 
          qx = qy = np.where( (np.isfinite(xrf.reshape(m))) & (np.isfinite(yrf.reshape(m)) ) )
-         tck1 = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], xp1.reshape(m)[qx],xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s) 
-         tck2 = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], yp1.reshape(m)[qx],xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s) 
-         xp1i = interpolate.bisplev(rx,ry, tck1)
-         yp1i = interpolate.bisplev(rx,ry, tck2)
-         tck3 = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], th.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         thi  = interpolate.bisplev(rx,ry, tck3)
+         surfaces = [('xp1',xp1.reshape(m)[qx]),('yp1',yp1.reshape(m)[qx]),('th',th.reshape(m)),
+            ('c10',c10.reshape(m)),('c11',c11.reshape(m)),('c12',c12.reshape(m)),
+            ('c13',c13.reshape(m)),('c14',c14.reshape(m)),
+            ('c20',c20.reshape(m)),('c21',c21.reshape(m)),('c22',c22.reshape(m))]
+         tck = get_calspline_tck(calfile, mode, xrf.reshape(m)[qx], yrf.reshape(m)[qy], 
+            surfaces, kx=kx, ky=ky, s=s, chatter=chatter)
+         xp1i = interpolate.bisplev(rx,ry, tck['xp1'])
+         yp1i = interpolate.bisplev(rx,ry, tck['yp1'])
+         thi  = interpolate.bisplev(rx,ry, tck['th'])
          xp2i = 0
          yp2i = 0
              
          if chatter > 2: print('getCalData. x,y,theta = ',xp1i,yp1i,thi, ' second order ', xp2i, yp2i)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c10.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c10i = interpolate.bisplev(rx,ry, tck)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c11.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c11i = interpolate.bisplev(rx,ry, tck)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c12.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c12i = interpolate.bisplev(rx,ry, tck)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c13.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c13i = interpolate.bisplev(rx,ry, tck)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c14.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c14i = interpolate.bisplev(rx,ry, tck)
+         c10i = interpolate.bisplev(rx,ry, tck['c10'])
+         c11i = interpolate.bisplev(rx,ry, tck['c11'])
+         c12i = interpolate.bisplev(rx,ry, tck['c12'])
+         c13i = interpolate.bisplev(rx,ry, tck['c13'])
+         c14i = interpolate.bisplev(rx,ry, tck['c14'])
          if chatter > 2: print('getCalData. dispersion first order = ',c10i,c11i,c12i,c13i,c14i)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c20.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c20i = interpolate.bisplev(rx,ry, tck)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c21.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c21i = interpolate.bisplev(rx,ry, tck)
-         tck  = interpolate.bisplrep(xrf.reshape(m)[qx], yrf.reshape(m)[qy], c22.reshape(m),xb=-0.19,xe=+0.19,yb=-0.19,ye=0.19, kx=kx,ky=ky,s=s)
-         c22i = interpolate.bisplev(rx,ry, tck)
+         c20i = interpolate.bisplev(rx,ry, tck['c20'])
+         c21i = interpolate.bisplev(rx,ry, tck['c21'])
+         c22i = interpolate.bisplev(rx,ry, tck['c22'])
          if chatter > 2: print('getCalData. dispersion second order = ', c20i,c21i, c22i)
       #
       if mode == 'bilinear':
@@ -5782,13 +6715,20 @@ def bilinear(x1,x2,x1a,x2a,f,chatter=0):
    
    requirement: x1a[i] is increasing with i 
                 x2a[j] is increasing with j
+                
+   x1, x2 may be arrays of points; points outside the grid then get 
+   the value at the border of the grid.             
    20080303 NPMK                
+   20170620 arrays of points
    '''
    import numpy as np
    
    # check that the arrays are numpy arrays
    x1a = np.asarray(x1a)
    x2a = np.asarray(x2a)
+   
+   if (np.ndim(x1) > 0) | (np.ndim(x2) > 0):
+      return _bilinear_points(x1,x2,x1a,x2a,f)
       
    #  find the index for sorting the arrays
    n1 = len(x1a)
@@ -5848,11 +6788,130 @@ def bilinear(x1,x2,x1a,x2a,f,chatter=0):
    return y    
  
 
+def _bilinear_points(x1,x2,x1a,x2a,f):
+   '''bilinear() for arrays of points x1, x2'''
+   import numpy as np
+   x1, x2 = np.broadcast_arrays(np.asarray(x1,dtype=float), np.asarray(x2,dtype=float))
+   f = np.asarray(f)
+   x1a_ind = x1a.argsort()
+   x2a_ind = x2a.argsort()
+   k1s = np.clip(x1a[x1a_ind].searchsorted(x1)-1, 0, len(x1a)-2)
+   k2s = np.clip(x2a[x2a_ind].searchsorted(x2)-1, 0, len(x2a)-2)
+   ki = x1a_ind[k1s]
+   kip1 = x1a_ind[k1s+1]
+   kj = x2a_ind[k2s]
+   kjp1 = x2a_ind[k2s+1]
+   t = np.clip((x1 - x1a[ki])/(x1a[kip1]-x1a[ki]), 0., 1.)
+   u = np.clip((x2 - x2a[kj])/(x2a[kjp1]-x2a[kj]), 0., 1.)
+   return ((1.-t)*(1.-u)*f[kj,ki] + t*(1.-u)*f[kj,kip1] + 
+      t*u*f[kjp1,kip1] + (1.-t)*u*f[kjp1,ki])
+   
+
+def getCalData_array(Xphi, Yphi, wheelpos, calfile=None, caldir=None, 
+   curvature=False, chatter=0):
+   '''Retrieve the calibration data for arrays of input angles.
+   
+   Parameters
+   ----------
+   Xphi, Yphi : array
+      input angles in degrees, from, e.g., `findInputAngle`.
+   wheelpos : int, {160,200,955,1000}
+      filter wheel position selects grism
+   calfile : str
+      calibration file name (default from get_wavecal_file)
+   caldir : str
+      path of directory calibration files
+   curvature : bool
+      also return the curvature coefficients of spec_curvature() at 
+      the first order anchors
+   chatter : int
+      verbosity
+      
+   Returns
+   -------
+   anker, anker2 : array (n,2)
+      first and second order anchor positions [DET-pix] 
+   C_1, C_2 : array (n,5), (n,3)
+      dispersion coefficients in first and second order
+   theta : array (n)
+      angle of the dispersion on the detector
+   curves : dict or None
+      with `curvature`, the curvature coefficients for order 0,1,2,3 as 
+      arrays (n,ncoef), highest term first
+   msg : str   
+   
+   Notes
+   -----
+   This is getCalData(mode='bilinear') for n positions: the calibration 
+   file is read once and the interpolation done for all positions 
+   together. Positions outside the calibration grid, where getCalData 
+   extrapolates the calibration, are passed one by one to getCalData. 
+   '''
+   import numpy as np
+   try:
+      from astropy.io import fits as pyfits
+   except:   
+      import pyfits
+      
+   Xphi, Yphi = np.broadcast_arrays(np.atleast_1d(np.asarray(Xphi,dtype=float)),
+      np.atleast_1d(np.asarray(Yphi,dtype=float)))
+   Xphi = Xphi.ravel()
+   Yphi = Yphi.ravel()
+   n = len(Xphi)
+   if calfile == None:
+      calfile = get_wavecal_file(wheelpos, caldir=caldir, chatter=chatter)
+   msg = "wavecal file : %s\n"%(calfile.split('/')[-1])
+   
+   cal = pyfits.open(calfile)
+   if chatter > 0: print("opening the wavelength calibration file: %s"%(calfile))
+   data = cal[1].data
+   N1 = int(np.sqrt(len(data)))
+   if N1**2 != len(data): 
+      raise RuntimeError("getCalData_array: calfile array not square" )
+   columns = [col.upper() for col in cal[1].columns.names]
+   xf = data.field('PHI_X').reshape(N1,N1)
+   yf = data.field('PHI_Y').reshape(N1,N1)
+   x1a = xf[0,:]
+   x2a = yf[:,0]
+   inside = (Xphi > x1a.min()) & (Xphi < x1a.max()) & (Yphi > x2a.min()) & (Yphi < x2a.max())
+   q = np.where(inside)[0]
+   
+   names = ['DETX1ANK','DETY1ANK','DETX2ANK','DETY2ANK','SP1SLOPE',
+      'DISP1_4','DISP1_3','DISP1_2','DISP1_1','DISP1_0','DISP2_2','DISP2_1','DISP2_0']
+   val = {}
+   for name in names:
+      val[name] = np.zeros(n)
+      if name in columns:
+         # DISP1_4 is zero for wheelpos=955
+         val[name][q] = bilinear(Xphi[q], Yphi[q], x1a, x2a, 
+            data.field(name).reshape(N1,N1))
+   cal.close()
+   anker  = np.array([val['DETX1ANK'],val['DETY1ANK']]).T
+   anker2 = np.array([val['DETX2ANK'],val['DETY2ANK']]).T
+   C_1 = np.array([val['DISP1_4'],val['DISP1_3'],val['DISP1_2'],val['DISP1_1'],val['DISP1_0']]).T
+   C_2 = np.array([val['DISP2_2'],val['DISP2_1'],val['DISP2_0']]).T
+   theta = val['SP1SLOPE']
+   
+   # outside the grid getCalData extrapolates 
+   for k in np.where(~inside)[0]:
+      anker[k], anker2[k], C_1[k], C_2[k], theta[k], dat, msg1 = getCalData(Xphi[k],Yphi[k],
+         wheelpos, None, calfile=calfile, chatter=chatter)
+         
+   curves = None   
+   if curvature:
+      curves = {}
+      for order in [0,1,2,3]:
+         curves[order] = np.asarray(spec_curvature(wheelpos,[anker[:,0],anker[:,1]],order=order)).T
+   if chatter > 1: 
+      print('getCalData_array. %i positions, %i outside the calibration grid'%(n,n-len(q)))   
+   return anker, anker2, C_1, C_2, theta, curves, msg
+
+
 def findInputAngle(RA,DEC,filestub, ext, wheelpos=200, 
        lfilter='uvw1', lfilter_ext=None, 
        lfilt2=None,    lfilt2_ext=None, 
        method=None, attfile=None, msg="",
-       catspec=None, indir='./', chatter=2):
+       catspec=None, indir='./', chatter=2, ctx=None):
    '''Find the angles along the X,Y axis for the target distance from the bore sight.
    
    Parameters
@@ -5892,6 +6951,9 @@ def findInputAngle(RA,DEC,filestub, ext, wheelpos=200,
         
       - **chatter** : int
         verbosity
+        
+      - **ctx** : ExtractionContext
+        records the temporary (fake lenticular) file for clean up by getSpec()
 
    Returns
    -------
@@ -5980,8 +7042,7 @@ def findInputAngle(RA,DEC,filestub, ext, wheelpos=200,
                             indir=indir,
                 chatter=chatter) 
        # note that the path rawfile  = indir+'/'+filestub+'ufk_sk.img'
-       tempnames.append(filestub)
-       tempntags.append('fakefilestub')
+       _get_context(ctx).add_tempfile(filestub,'fakefilestub')
    
    if lfilter_ext == None: 
        lfext = ext 
@@ -6285,20 +7346,17 @@ def get_radec(file='radec.usno', objectid=None, tool='astropy', chatter=0):
          
 
 def get_initspectrum(net,var,fitorder, wheelpos, anchor, C_1=None,C_2=None,dist12=None, 
-        xrange=None, nave = 3, predict2nd=True, chatter=0):
+        xrange=None, nave = 3, predict2nd=True, linear=False, chatter=0):
     """ wrapper for call 
         boxcar smooth image over -nave- pixels 
     """
-    try:
-       from convolve import boxcar
-    except:
-       from stsci.convolve import boxcar   
+    from .uvotsmooth import boxcar
     return splitspectrum(boxcar(net,(nave,)),boxcar(var,(nave,)),fitorder,wheelpos,
      anchor, C_1=C_1, C_2=C_2, dist12=dist12,
-     xrange=xrange,predict2nd=predict2nd, chatter=chatter)
+     xrange=xrange,predict2nd=predict2nd, linear=linear, chatter=chatter)
 
 def splitspectrum(net,var,fitorder,wheelpos,anchor,C_1=None,C_2=None,dist12=None,
-         xrange=None,predict2nd=True,plotit=-790,chatter=0):
+         xrange=None,predict2nd=True,plotit=-790,linear=False,chatter=0):
    ''' This routine will compute the counts in the spectrum 
        using the mean profiles of the orders modeled as gaussians with fixed sigma
        for each order. The counts are weighted according to the position in the 
@@ -6314,15 +7372,25 @@ def splitspectrum(net,var,fitorder,wheelpos,anchor,C_1=None,C_2=None,dist12=None
        
        anchor is needed to decide if the orders split up or down
        
+       linear: if True the amplitudes of the orders are solved for all columns at 
+       once with the positions and sigmas fixed at the track (fit_amplitudes), 
+       instead of fitting each column with get_components. The results are not 
+       numerically the same: the get_components fits (fixsig, fixpos) still let 
+       the sigma move by 0.2 and the position by 0.05 pixel, so the counts differ 
+       where the track or sigma is off (typically < 1%, up to tens of percent in 
+       faint or blended columns).
+       
    2010-08-21 NPMKuin (MSSL) initial code 
    2011-08-23 to do:  quality in output
    2011-09-05 mods to handle order merging
    2011-09-11 normal extraction added as well as optimal extraction for region [-sig,+sig] wide.
               larger widths violate assumption of gaussian profile. Lorentzian profile might work 
               for more extended widths.  
+   2017-06-20 linear option: batched linear solution for the amplitudes   
                  
    '''
-   from numpy import zeros,sqrt,pi,arange, array, where, isfinite, polyval, log10
+   from numpy import zeros,sqrt,pi,arange, array, where, isfinite, polyval, log10, isin, \
+        newaxis, exp, maximum, minimum, seterr
    
    # the typical width of the orders as gaussian sigma [see singlegaussian()] in pixels
    sig0 = 4.8
@@ -6416,487 +7484,238 @@ def splitspectrum(net,var,fitorder,wheelpos,anchor,C_1=None,C_2=None,dist12=None
       ileft = 2
       irite = nx -2
    else:
-      ileft = xrang[0]
-      irite = xrang[1]              
-        
-   for i in range(ileft,irite):
-      #if i in q3[0]: 
-      #   ans = raw_input('continue?')
-      #   chatter = 5
-         
+      ileft = xrange[0]
+      irite = xrange[1]              
+   
+   # the columns with each combination of orders 
+   cols = arange(ileft,irite)
+   in0 = isin(cols,q0[0])
+   in1 = isin(cols,q1[0])
+   in2 = isin(cols,q2[0])
+   in3 = isin(cols,q3[0])
+   close12 = abs(y2[cols]-y1[cols]) < req_dist_12
+   close13 = abs(y3[cols]-y1[cols]) < req_dist_13
+   only1 = in1 & ~in2
+   in12  = in1 & in2 & ~in3
+   in123 = in1 & in2 & in3
+   overlap = (in12 & close12) | (in123 & close12 & close13)
+   ytrack = [y0,y1,y2,y3]
+   
+   # amplitude and sigma of each order [order, column]; the sigma of the 
+   # track is replaced by the fitted one. The first order sum uses the track 
+   # sigma.
+   amp = zeros(nx*4).reshape(4,nx)
+   sig = zeros(nx*4).reshape(4,nx)
+   for k, coef in enumerate([sig0coef,sig1coef,sig2coef,sig3coef]):
+      sig[k,cols] = polyval(coef,cols)
+   sigbox1 = sig[1].copy()   
+   
+   if linear:
+      # the amplitudes of the orders present in each column, with the positions 
+      # and sigmas of the track. Where the orders are too close only the first 
+      # order is solved for, like below. The amplitudes are kept positive, 
+      # like the 1.e-7 floor used for the second order below. 
+      groups = [((1,),     only1 | overlap),
+                ((1,2),    in12 & ~close12),
+                ((1,2,3),  in123 & ~(close12 & close13))]
+      for orders, sel in groups:
+         icol = cols[sel]
+         if len(icol) == 0: continue
+         Ypos = array([ytrack[k][icol] for k in orders]).T
+         sigmas = array([sig[k,icol] for k in orders]).T
+         params, perror = fit_amplitudes(net,var,icol,Ypos,sigmas)
+         for j, k in enumerate(orders):
+            amp[k,icol] = params[:,2+3*j].clip(1.e-7)
+   
+   # the amplitudes of the first, second and third orders, column by column 
+   for i in cols[in1]:
       if chatter > 3: print("get_initspectrum.curved_extraction [trackfull] fitting i = %2i x=%6.2f"%(i,x[i]))
-
-         # do/try the zeroth order 
-         
-      if i in q0[0]: 
-         if chatter > 4: print(" zeroth order")
-         # normalization factor for singlegaussian is sqrt(pi).sigma.amplitude 
-         # but use the measured counts within 3 sigma.
-         sig0 = polyval(sig0coef, i)
-         j1 = int(y0[i] - nxsig*sig0)
-         j2 = int(y0[i] + nxsig*sig0 + 1)
-         # get weighted sum now. Renormalize to get total counts in norm.
-         yr = arange(j1,j2)
-         prob = singlegaussian(yr,1.0,y0[i],sig0)
-         P = (prob/prob.sum()).flatten()
-         V = var[j1:j2,i].flatten()*varFudgeFactor
-         net0 = net[j1:j2,i].flatten()
-         net0[net0 < 0.] = 0.
-         qfin = isfinite(net0)
-
-         variance[0,i] = (V[qfin]).sum()
-         counts[0,i] = net0[qfin].sum() 
-         
-         # optimal extraction
-         j1 = int(y0[i] - sig0)
-         j2 = int(y0[i] + sig0)
-         yr = arange(j1,j2)
-         prob = singlegaussian(yr,1.0,y0[i],sig0)
-         P = (prob/prob.sum()).flatten()
-         V = var[j1:j2,i].flatten()*varFudgeFactor
-         net0 = net[j1:j2,i].flatten()
-         net0[net0 < 0.] = 0.
-         qfin = isfinite(net0)
-         var_opt[0,i]   = 1.0/ (( P[qfin]*P[qfin]/V[qfin]).sum())
-         count_opt[0,i] = var_opt[0,i] * ( P[qfin] * net0[qfin] / V[qfin] ).sum()
-         newsigmas[0,i] = sig0
-         borderup  [0,i] = y0[i] - bs*sig0
-         borderdown[0,i] = y0[i] + bs*sig0
-
-         
-
-         # do the first order  
-         
-      if ((i in q1[0]) & (i not in q2[0])) :
+      Xpos = array([i])
+      k = i - ileft
+      
+      if only1[k]:
          if chatter > 4: print(" first order")
-         sig1 = polyval(sig1coef,i) 
-         j1 = int(y1[i] - nxsig*sig1)
-         j2 = int(y1[i] + nxsig*sig1 + 1)
-
-         Xpos = array([i])
-         Ypos = array(y1[i])
-         sigmas = array([sig1])
-         Z = get_components(Xpos,net,Ypos,wheelpos,chatter=chatter,\
-                composite_fit=True,caldefault=True,sigmas=sigmas,
-                fiterrors=False,fixsig=True,fixpos=True,amp2lim=None)
-         a1   = Z[0][0][0]      
-         sig1 = Z[0][0][2]
-
-         # get weighted sum now. Renormalize to get total counts in norm.
-         yr = arange(j1,j2)
-         prob = singlegaussian(yr,1.0,y1[i],sig1)
-         P = (prob/prob.sum()).flatten()
-         V = var[j1:j2,i].flatten()*varFudgeFactor
-         net1 = net[j1:j2,i].flatten()
-         net1[net1 < 0.] = 0.
-         qfin = isfinite(net1)
-         counts[1,i] = net1[qfin].sum()
-         variance[1,i] = (V[qfin]).sum()
-         
-         # optimal extraction 
-         j1 = int(y1[i] - sig1)
-         j2 = int(y1[i] + sig1 + 1)
-         # get weighted sum now. Renormalize to get total counts in norm.
-         yr = arange(j1,j2)
-         prob = singlegaussian(yr,1.0,y1[i],sig1)
-         P = (prob/prob.sum()).flatten()
-         V = var[j1:j2,i].flatten()*varFudgeFactor
-         net1 = net[j1:j2,i].flatten()
-         net1[net1 < 0.] = 0.
-         qfin = isfinite(net1)
-         var_opt[1,i]   = 1.0/ (( P[qfin]*P[qfin]/V[qfin]).sum())
-         count_opt[1,i] = var_opt[1,i] * ( P[qfin] * net1[qfin] / V[qfin] ).sum()
-         newsigmas    [1,i] = sig1
-         borderup  [1,i] = y1[i] - bs*sig1
-         borderdown[1,i] = y1[i] + bs*sig1
-         fractions [1,i] = 1.
+         if not linear:
+            Z = get_components(Xpos,net,array(y1[i]),wheelpos,chatter=chatter,\
+                   composite_fit=True,caldefault=True,sigmas=array([sig[1,i]]),
+                   fiterrors=False,fixsig=True,fixpos=True,amp2lim=None)
+            amp[1,i] = Z[0][0][0]      
+            sig[1,i] = Z[0][0][2]
             
-
-      # do the first and second order  
-         
-      if ((i in q1[0]) & (i in q2[0]) & (i not in q3[0])):
-         if chatter > 4: print(" first and second orders")
-         sig1 = polyval(sig1coef,i)
-         sig2 = polyval(sig2coef,i)
-         
-         if abs(y2[i]-y1[i]) < req_dist_12:
-            # do not fit profiles; use predicted second order 
-            
-            # first order fit
-            Xpos = array([i])
-            if top:
-               j1 = int(y1[i] - nxsig*sig1)
-               j2 = int(y2[i] + nxsig*sig2 + 1)
-               Ypos = array([y1[i]])
-               sigmas = array([sig1])
-            else:
-               j1 = int(y2[i] - nxsig * sig2)
-               j2 = int(y1[i] + nxsig * sig1)
-               Ypos = array([y1[i]])
-               sigmas = array([sig1])
-         
-            Z = get_components(Xpos,net,Ypos,wheelpos,chatter=chatter,\
-                composite_fit=True,caldefault=True,sigmas=sigmas,
-                fixsig=True,fixpos=True,fiterrors=False)
-            
-            
-            a1 = Z[0][0][2] 
-            sig1 = Z[0][0][4]
+      elif overlap[k]:
+         # do not fit profiles; first order fit, less the predicted second order 
+         if chatter > 4: print(" overlapping orders")
+         if not linear:
+            Z = get_components(Xpos,net,array([y1[i]]),wheelpos,chatter=chatter,\
+                   composite_fit=True,caldefault=True,sigmas=array([sig[1,i]]),
+                   fiterrors=False,fixsig=True,fixpos=True)
+            amp[1,i] = Z[0][0][0]
+            sig[1,i] = Z[0][0][2]
             
-            quality[i] += qflag['overlap']
+         quality[i] += qflag['overlap']
             
-            # find second order prediction min, max -> amp2lim
-            
-            ilo = dis2.searchsorted(i)
+         # find second order prediction min, max -> amp2lim
+         ilo = dis2.searchsorted(i)
+         if in12[k]: 
             a2 = SO[1][3][ilo-1:ilo+1].mean()
-            
-            if a1 > a2: 
-               a1 -= a2
-            else: a1 = 0.   
-                 
-         else:
-            # orders 1,2 separated enough to fit profiles
+         else:    
+            a2 = SO[1][2][ilo-1:ilo+1].mean()
+         if amp[1,i] > a2: 
+            amp[1,i] -= a2
+         else: amp[1,i] = 0.   
+         amp[2,i] = a2
+         amp[3,i] = 0.
+               
+      elif in12[k]:
+         # orders 1,2 separated enough to fit profiles
+         if chatter > 4: print(" first and second orders")
+         if not linear:
             if top:
-               j1 = int(y1[i] - nxsig*sig1)
-               j2 = int(y2[i] + nxsig*sig2 + 1)
                Ypos = array([y1[i],y2[i]])
-               sigmas = array([sig1,sig2])
+               sigmas = array([sig[1,i],sig[2,i]])
             else:
-               j1 = int(y2[i] - nxsig * sig2)
-               j2 = int(y1[i] + nxsig * sig1)
                Ypos = array([y2[i],y1[i]])
-               sigmas = array([sig2,sig1])
-              
-            # fit for the amplitudes of first and second order
-            Xpos = array([i])
-         
+               sigmas = array([sig[2,i],sig[1,i]])
             Z = get_components(Xpos,net,Ypos,wheelpos,chatter=chatter,\
-                composite_fit=True,caldefault=True,sigmas=sigmas,
-                fiterrors=False,fixsig=True,fixpos=True,amp2lim=amp2lim)
-                
+                   composite_fit=True,caldefault=True,sigmas=sigmas,
+                   fiterrors=False,fixsig=True,fixpos=True,amp2lim=amp2lim)
             # amplitudes of first and second order determine the flux ratio             
             if top:
-               a1 = Z[0][0][0] 
-               a2 = Z[0][0][3]
-               sig1 = Z[0][0][2]
-               sig2 = Z[0][0][5] 
+               ip = [1,2]
             else:
-               a2 = Z[0][0][0] 
-               a1 = Z[0][0][3] 
-               sig2 = Z[0][0][2]
-               sig1 = Z[0][0][5] 
-            if a1 <= 0. : a1 = 1.e-6  
-            if a2 <= 0. : a2 = 1.e-7  
-         
-            if chatter > 4: 
-               print('get_initspectrum: i=%5i a1=%6.1f   a2=%6.1f  y1=%6.1f  y2=%6.1f ' % (i,a1,a2,y1[i],y2[i]))
-         
-         yr   = arange( max([int(y1[i]-3.*sig1),0]) , min([int(y2[i]+3.*sig1),200]) ) # base 1 pixels
-         ff1 = singlegaussian(yr,a1,y1[i],sig1)
-         ff2 = singlegaussian(yr,a2,y2[i],sig2)  
-         fft = ff1+ff2    # total
-         frac1 = ff1/fft  # fraction of counts belonging to first order for each pixel
-         frac2 = ff2/fft  # fractional contribution of other order to counts 
-                             #   normalised by total for each pixel  (= divide by ff1t)
-         Var = var[yr,i] * varFudgeFactor
-         P1 = (ff1/fft.sum()).flatten()  # probability normalised fraction per pixel
-         net1 = net[yr ,i].flatten() * frac1  # counts that belong to first order
-         net1[net1 < 0.] = 0.
-         qfin = isfinite(net1)
-         net1_tot = net1[qfin].sum()
-         V1 = Var * (1.+ frac2)   # variance of pixel - add other order as noise source
-                 
-         counts[1,i] = net1_tot
-         # compute a simple weighted pixel-by-pixel variance, and add it. Weight by normalized net counts/pixel.
-         variance[1,i] = (V1[qfin]).sum()
-
-         P2 = (ff2/fft.sum()).flatten()
-         V2 = Var * (1.+ frac1) 
-         net2 = net[yr ,i].flatten() * frac2
-         net2[net2 < 0.] = 0.
-         qfin = isfinite(net2)
-         net2_tot = net2[qfin].sum()
-
-         counts[2,i] = net2_tot 
-         variance[2,i] = (V2[qfin]).sum()
-
-         fractions [1,i] = frac1.sum()
-         fractions [2,i] = frac2.sum()
-         
-         # optimal extraction order 1
-         yr1   = arange( max([0,int(y1[i]-sig1)]) , min([int(y1[i]+sig1),200]) ) # base 1 pixels
-         Var = var[yr1,i] * varFudgeFactor
-         ff1 = singlegaussian(yr1,a1,y1[i],sig1)
-         ff2 = singlegaussian(yr1,a2,y2[i],sig2)  
-         fft = ff1+ff2    # total
-         frac1 = ff1/fft  # fraction of counts belonging to first order for each pixel
-         frac2 = ff2/fft  # fractional contribution of other order to counts 
-                             #   normalised by total for each pixel  (= divide by ff1t)
-         P1 = (ff1/fft.sum()).flatten()  # probability normalised fraction per pixel
-         net1 = net[yr1 ,i].flatten() * frac1  # counts that belong to first order
-         net1[net1 < 0.] = 0.
-         qfin = isfinite(net1)
-         net1_tot = net1[qfin].sum()
-         V1 = Var * (1.+ frac2)   # variance of pixel - add other order as noise source
-         var_opt[1,i]   = 1.0/ (( P1[qfin]*P1[qfin]/V1[qfin]).sum())
-         count_opt[1,i] = var_opt[1,i] * ( P1[qfin] * net1[qfin] / V1[qfin] ).sum()
-         newsigmas[1,i] = sig1
-             
-         yr2   = arange( max([0,int(y2[i]-sig2)]) , min([int(y2[i]+sig2),200]) ) # base 1 pixels
-         Var = var[yr2,i] * varFudgeFactor
-         ff1 = singlegaussian(yr2,a1,y1[i],sig1)
-         ff2 = singlegaussian(yr2,a2,y2[i],sig2)  
-         fft = ff1+ff2    # total
-         frac1 = ff1/fft  # fraction of counts belonging to first order for each pixel
-         frac2 = ff2/fft  # fractional contribution of other order to counts 
-                             #   normalised by total for each pixel  (= divide by ff1t)
-         P2 = (ff2/fft.sum()).flatten()
-         V2 = Var * (1.+ frac1) 
-         net2 = net[yr2 ,i].flatten() * frac2
-         net2[net2 < 0.] = 0.
-         qfin = isfinite(net2)
-         net2_tot = net2[qfin].sum()
-         var_opt[2,i]   = 1.0/ (( P2[qfin]*P2[qfin]/V2[qfin]).sum())
-         count_opt[2,i] = var_opt[2,i] * ( P2[qfin] * net2[qfin] / V2[qfin] ).sum()
-         newsigmas[2,i] = sig2
-         
-         borderup  [1,i] = y1[i] - bs*sig1
-         borderdown[1,i] = y1[i] + bs*sig1
-         borderup  [2,i] = y2[i] - bs*sig2
-         borderdown[2,i] = y2[i] + bs*sig2
-
-
-         if ((plotit > 0) & (i >= plotit)):
-            from pylab import plot, legend, figure, clf,title,text
-            print(Z[0])
-            print('*********************')
-            print(qfin)
-            print(net1)
-            print(counts[1,i],count_opt[1,i],variance[2,i],var_opt[2,i])
-            figure(11) ; clf()
-            plot(yr,net[yr,i],'y',lw=2)
-            plot(yr,ff1,'k')
-            plot(yr,ff2,'r')
-            plot(yr,net1/P1,'bv')
-            plot(yr,net2/P2,'c^',alpha=0.7)
-            legend(['net','ff1','ff2','net1/P1','net2/P2'])
-            title("%7.1e %6.1f %4.1f %7.1e %6.1f %4.1f"%(a1,y1[i],sig1,a2,y2[i],sig2))
-            figure(12) ; clf()
-            plot(yr,P1,'k')
-            plot(yr,P2,'r')
-            plot(yr,frac1,'b')
-            plot(yr,frac2,'m')               
-            legend(['P1','P2','frac1','frac2'])     
-            
-            gogo = input('continue?')
-                            
-      # do the first, second and third order case  
-      
-      if ((i in q1[0]) & (i in q2[0]) & (i in q3[0])):
-            if chatter > 4: print("first, second and third order")
-            sig1 = polyval(sig1coef,i)
-            sig2 = polyval(sig2coef,i)
-            sig3 = polyval(sig3coef,i)
-            
-            if ((abs(y2[i]-y1[i]) < req_dist_12) & (abs(y3[i]-y1[i]) < req_dist_13)):
-               # do not fit profiles; use only predicted second order 
-            
-               # first order fit
-               Xpos = array([i])
-               if top:
-                  j1 = int(y1[i] - nxsig*sig1)
-                  j2 = int(y2[i] + nxsig*sig2 + 1)
-                  Ypos = array([y1[i]])
-                  sigmas = array([sig1])
-               else:
-                  j1 = int(y2[i] - nxsig * sig2)
-                  j2 = int(y1[i] + nxsig * sig1)
-                  Ypos = array([y1[i]])
-                  sigmas = array([sig1])
-         
-               Z = get_components(Xpos,net,Ypos,wheelpos,chatter=chatter,\
-                composite_fit=True,caldefault=True,sigmas=sigmas,
-                fiterrors=False,fixsig=True,fixpos=True)
-            
-               #a1 = Z[0][0][2]
-               #sig1 = Z[0][0][4] 
-               a1 = Z[0][0][0]
-               sig1 = Z[0][0][2]
+               ip = [2,1]
+            for j, k in enumerate(ip):
+               amp[k,i] = Z[0][0][3*j] 
+               sig[k,i] = Z[0][0][3*j+2]
+         if amp[1,i] <= 0. : amp[1,i] = 1.e-6  
+         if amp[2,i] <= 0. : amp[2,i] = 1.e-7  
+         if chatter > 4: 
+            print('get_initspectrum: i=%5i a1=%6.1f   a2=%6.1f  y1=%6.1f  y2=%6.1f ' % (i,amp[1,i],amp[2,i],y1[i],y2[i]))
             
-               # find second order prediction min, max -> amp2lim
-            
-               ilo = dis2.searchsorted(i)
-               a2 = SO[1][2][ilo-1:ilo+1].mean()
-            
-               if a1 > a2: 
-                  a1 -= a2
-               else: a1 = 0.   
-
-               a3 = 0.
-               
-               quality[i] += qflag['overlap']
-
+      else:
+         if chatter > 4: print("first, second and third order")
+         if not linear:
+            if top:
+               Ypos = array([y1[i],y2[i],y3[i]])
+               sigmas = array([sig[1,i],sig[2,i],sig[3,i]])
             else:
-               if top:
-                  j1 = int(y1[i] - nxsig*sig1)
-                  j2 = int(y3[i] + nxsig*sig3 + 1)
-                  Ypos = array([y1[i],y2[i],y3[i]])
-                  sigmas = array([sig1,sig2,sig3])
-               else:
-                  j1 = int(y3[i] - nxsig*sig3)
-                  j2 = int(y1[i] + nxsig*sig1)
-                  Ypos = array([y3[i],y2[i],y1[i]])
-                  sigmas = array([sig3,sig2,sig1])
-                  
-               # fit for the amplitudes of first and second order
-               Xpos = array([i])
-            
-               Z = get_components(Xpos,net,Ypos,wheelpos,chatter=chatter,\
+               Ypos = array([y3[i],y2[i],y1[i]])
+               sigmas = array([sig[3,i],sig[2,i],sig[1,i]])
+            Z = get_components(Xpos,net,Ypos,wheelpos,chatter=chatter,\
                    composite_fit=True,caldefault=True,sigmas=sigmas,
                    fiterrors=False,amp2lim=amp2lim,fixsig=True,fixpos=True)
-                
-               if top:
-                  a1 = Z[0][0][0] 
-                  a2 = Z[0][0][3] 
-                  a3 = Z[0][0][6] 
-                  sig1 = Z[0][0][2] 
-                  sig2 = Z[0][0][5] 
-                  sig3 = Z[0][0][8] 
-               else:
-                  a1 = Z[0][0][6] 
-                  a2 = Z[0][0][3] 
-                  a3 = Z[0][0][0] 
-                  sig1 = Z[0][0][8] 
-                  sig2 = Z[0][0][5] 
-                  sig3 = Z[0][0][2] 
-
-            yr1 = arange(int( y1[i]-nxsig*sig1) , int(y1[i]+nxsig*sig1) )
-            ff1 =     singlegaussian(yr1,a1,y1[i],sig1)
-            ff1t = ff1+singlegaussian(yr1,a2,y2[i],sig2)+singlegaussian(yr1,a3,y3[i],sig3)
-            frac1 = ff1/ff1t 
-               
-            yr2 = arange( int(y2[i]-nxsig*sig2) , int(y2[i]+nxsig*sig2) )
-            ff2 = singlegaussian(yr2,a2,y2[i],sig2) 
-            ff2t = ff2 + singlegaussian(yr2,a1,y1[i],sig1) + singlegaussian(yr2,a3,y3[i],sig3)
-            frac2 = ff2/ff2t
-               
-            yr3 = arange( int(y3[i]-nxsig*sig3 ),int( y3[i]+nxsig*sig3 ))
-            ff3 = singlegaussian(yr3,a3,y3[i],sig3)
-            ff3t = ff3+singlegaussian(yr3,a1,y1[i],sig1)+singlegaussian(yr3,a2,y2[i],sig2)
-            frac3 = ff3/ff3t
-               
-            fra21 = singlegaussian(yr2,a1,y1[i],sig1)
-            fra21 /= (fra21+singlegaussian(yr2,a2,y2[i],sig2)+singlegaussian(yr2,a3,y3[i],sig3))
-            fra31 = singlegaussian(yr3,a1,y1[i],sig1)
-            fra31 /= (fra31+singlegaussian(yr3,a2,y2[i],sig2)+singlegaussian(yr3,a3,y3[i],sig3))
-               
-            fra12 = singlegaussian(yr1,a2,y2[i],sig2) 
-            fra12 /= (fra12+singlegaussian(yr1,a1,y1[i],sig1) + singlegaussian(yr1,a3,y3[i],sig3))
-            fra32 = singlegaussian(yr3,a2,y2[i],sig2) 
-            fra32 /= (fra32+singlegaussian(yr3,a1,y1[i],sig1) + singlegaussian(yr3,a3,y3[i],sig3))
-               
-            fra13 = singlegaussian(yr1,a3,y3[i],sig3)
-            fra13 /= (fra13+singlegaussian(yr1,a1,y1[i],sig1)+singlegaussian(yr1,a2,y2[i],sig2))
-            fra23 = singlegaussian(yr2,a3,y3[i],sig3)
-            fra23 /= (fra23+singlegaussian(yr2,a1,y1[i],sig1)+singlegaussian(yr2,a2,y2[i],sig2))
-               
-            Var1 = var[yr1,i].flatten()* varFudgeFactor
-            Var2 = var[yr2,i].flatten()* varFudgeFactor
-            Var3 = var[yr3,i].flatten()* varFudgeFactor
-
-            P1 = (ff1/ff1.sum()).flatten()  # probability of first order photon 
-            P2 = (ff2/ff2.sum()).flatten()
-            P3 = (ff3/ff3.sum()).flatten()
-            V1 = Var1 * (1.+ fra12+fra13) # variance of pixel 
-            V2 = Var2 * (1.+ fra21+fra23) 
-            V3 = Var3 * (1.+ fra31+fra32) 
-            net1 = net[yr1 ,i].flatten() * frac1  # counts that belong to first order
-            net2 = net[yr2 ,i].flatten() * frac2
-            net3 = net[yr3 ,i].flatten() * frac3               
-            net1[ net1 < 0.] = 0.
-            net2[ net2 < 0.] = 0.
-            net3[ net3 < 0.] = 0.
-            qfin1 = isfinite(net1)
-            qfin2 = isfinite(net2)
-            qfin3 = isfinite(net3)
-            counts[1,i] = net1[qfin1].sum()
-            counts[2,i] = net2[qfin2].sum()     
-            counts[3,i] = net3[qfin3].sum()     
-            variance[1,i] = (V1[qfin1]).sum()
-            variance[2,i] = (V2[qfin2]).sum()
-            variance[3,i] = (V3[qfin3]).sum()
-            
-            borderup  [1,i] = y1[i] - bs*sig1
-            borderdown[1,i] = y1[i] + bs*sig1
-            borderup  [2,i] = y2[i] - bs*sig2
-            borderdown[2,i] = y2[i] + bs*sig2
-            borderup  [3,i] = y3[i] - bs*sig3
-            borderdown[3,i] = y3[i] + bs*sig3
-            fractions [1,i] = frac1.sum()
-            fractions [2,i] = frac2.sum()
-            fractions [3,i] = frac3.sum()
-
-            # optimal extraction
-            
-            yr1 = arange(int( y1[i]-sig1) , int(y1[i]+sig1) )
-            ff1 =     singlegaussian(yr1,a1,y1[i],sig1)
-            ff1t = ff1+singlegaussian(yr1,a2,y2[i],sig2)+singlegaussian(yr1,a3,y3[i],sig3)
-            frac1 = ff1/ff1t 
-               
-            yr2 = arange( int(y2[i]-sig2) , int(y2[i]+sig2) )
-            ff2 = singlegaussian(yr2,a2,y2[i],sig2) 
-            ff2t = ff2 + singlegaussian(yr2,a1,y1[i],sig1) + singlegaussian(yr2,a3,y3[i],sig3)
-            frac2 = ff2/ff2t
-               
-            yr3 = arange( int(y3[i]-sig3 ),int( y3[i]+sig3 ))
-            ff3 = singlegaussian(yr3,a3,y3[i],sig3)
-            ff3t = ff3+singlegaussian(yr3,a1,y1[i],sig1)+singlegaussian(yr3,a2,y2[i],sig2)
-            frac3 = ff3/ff3t
-               
-            fra21 = singlegaussian(yr2,a1,y1[i],sig1)
-            fra21 /= (fra21+singlegaussian(yr2,a2,y2[i],sig2)+singlegaussian(yr2,a3,y3[i],sig3))
-            fra31 = singlegaussian(yr3,a1,y1[i],sig1)
-            fra31 /= (fra31+singlegaussian(yr3,a2,y2[i],sig2)+singlegaussian(yr3,a3,y3[i],sig3))
-               
-            fra12 = singlegaussian(yr1,a2,y2[i],sig2) 
-            fra12 /= (fra12+singlegaussian(yr1,a1,y1[i],sig1) + singlegaussian(yr1,a3,y3[i],sig3))
-            fra32 = singlegaussian(yr3,a2,y2[i],sig2) 
-            fra32 /= (fra32+singlegaussian(yr3,a1,y1[i],sig1) + singlegaussian(yr3,a3,y3[i],sig3))
-               
-            fra13 = singlegaussian(yr1,a3,y3[i],sig3)
-            fra13 /= (fra13+singlegaussian(yr1,a1,y1[i],sig1)+singlegaussian(yr1,a2,y2[i],sig2))
-            fra23 = singlegaussian(yr2,a3,y3[i],sig3)
-            fra23 /= (fra23+singlegaussian(yr2,a1,y1[i],sig1)+singlegaussian(yr2,a2,y2[i],sig2))
-               
-            Var1 = var[yr1,i].flatten()* varFudgeFactor
-            Var2 = var[yr2,i].flatten()* varFudgeFactor
-            Var3 = var[yr3,i].flatten()* varFudgeFactor
-
-            P1 = (ff1/ff1.sum()).flatten()  # probability of first order photon 
-            P2 = (ff2/ff2.sum()).flatten()
-            P3 = (ff3/ff3.sum()).flatten()
-            V1 = Var1 * (1.+ fra12+fra13) # variance of pixel 
-            V2 = Var2 * (1.+ fra21+fra23) 
-            V3 = Var3 * (1.+ fra31+fra32) 
-            net1 = net[yr1 ,i].flatten() * frac1  # counts that belong to first order
-            net2 = net[yr2 ,i].flatten() * frac2
-            net3 = net[yr3 ,i].flatten() * frac3               
-            net1[ net1 < 0.] = 0.
-            net2[ net2 < 0.] = 0.
-            net3[ net3 < 0.] = 0.
-            qfin1 = isfinite(net1)
-            qfin2 = isfinite(net2)
-            qfin3 = isfinite(net3)
-            var_opt[1,i]   = 1.0/ (( P1[qfin1]*P1[qfin1]/V1[qfin1]).sum())
-            count_opt[1,i] = var_opt[1,i] * ( P1[qfin1] * net1[qfin1] / V1[qfin1] ).sum()
-            newsigmas[1,i] = sig1
-            var_opt[2,i]   = 1.0/ (( P2[qfin2]*P2[qfin2]/V2[qfin2]).sum())
-            count_opt[2,i] = var_opt[2,i] * ( P2[qfin2] * net2[qfin2] / V2[qfin2] ).sum()
-            newsigmas[2,i] = sig2
-            var_opt[3,i]   = 1.0/ (( P3[qfin3]*P3[qfin3]/V3[qfin3]).sum())
-            count_opt[3,i] = var_opt[3,i] * ( P3[qfin3] * net3[qfin3] / V3[qfin3] ).sum() 
-            newsigmas[3,i] = sig3
-
+            if top:
+               ip = [1,2,3]
+            else:
+               ip = [3,2,1]
+            for j, k in enumerate(ip):
+               amp[k,i] = Z[0][0][3*j] 
+               sig[k,i] = Z[0][0][3*j+2]
+   
+   # the sums over the rows of all columns at once. The profiles are those of 
+   # singlegaussian(); the windows arange(j1,j2) of each column become masks.
+   rows = arange(net.shape[0])[:,newaxis]
+   
+   def window(lo,hi):
+      return (rows >= lo.astype(int)) & (rows < hi.astype(int))
+      
+   def profile(a,y,s):
+      d = rows - y
+      return where(abs(d) < 4*s, a*exp(-(d/s)**2), 0.)
+      
+   def wsum(w,z):
+      return where(w,z,0.).sum(axis=0)   
+      
+   def extract(c,w,frac,V,P=None):
+      # sum of the counts in the window (with net counts < 0 set to zero) 
+      # and their variance, or the optimal extraction with probability P 
+      netk = net[:,c] * frac
+      netk = where(netk < 0., 0., netk)
+      qfin = w & isfinite(netk)
+      if type(P) == typeNone:
+         return wsum(qfin,netk), wsum(qfin,V)
+      varopt = 1.0/wsum(qfin,P*P/V)
+      return varopt * wsum(qfin,P*netk/V), varopt   
+      
+   olderr = seterr(divide='ignore',invalid='ignore')
+   
+   # the zeroth order 
+   c = cols[in0]
+   if len(c) > 0:
+      y, s = y0[c], sig[0,c]
+      V = var[:,c]*varFudgeFactor
+      counts[0,c], variance[0,c] = extract(c,window(y-nxsig*s,y+nxsig*s+1),1.,V)
+      # optimal extraction
+      w = window(y-s,y+s)
+      prob = profile(1.,y,s)
+      count_opt[0,c], var_opt[0,c] = extract(c,w,1.,V,prob/wsum(w,prob))
+      newsigmas [0,c] = s
+      borderup  [0,c] = y - bs*s
+      borderdown[0,c] = y + bs*s
+   
+   # the first order alone 
+   c = cols[only1]
+   if len(c) > 0:
+      y, s, sb = y1[c], sig[1,c], sigbox1[c]
+      V = var[:,c]*varFudgeFactor
+      counts[1,c], variance[1,c] = extract(c,window(y-nxsig*sb,y+nxsig*sb+1),1.,V)
+      # optimal extraction
+      w = window(y-s,y+s+1)
+      prob = profile(1.,y,s)
+      count_opt[1,c], var_opt[1,c] = extract(c,w,1.,V,prob/wsum(w,prob))
+      newsigmas [1,c] = s
+      borderup  [1,c] = y - bs*s
+      borderdown[1,c] = y + bs*s
+      fractions [1,c] = 1.
+   
+   # the first and second orders: the counts in a pixel are divided over the 
+   # orders in proportion to their profiles; the other order adds to the variance
+   c = cols[in12]
+   if len(c) > 0:
+      s1, s2 = sig[1,c], sig[2,c]
+      ff1 = profile(amp[1,c],y1[c],s1)
+      ff2 = profile(amp[2,c],y2[c],s2)
+      fft = ff1+ff2    # total
+      frac1 = ff1/fft  # fraction of counts belonging to first order for each pixel
+      frac2 = ff2/fft  
+      V = var[:,c]*varFudgeFactor
+      w = window(maximum(y1[c]-3.*s1,0),minimum(y2[c]+3.*s1,200))
+      counts[1,c], variance[1,c] = extract(c,w,frac1,V*(1.+frac2))
+      counts[2,c], variance[2,c] = extract(c,w,frac2,V*(1.+frac1))
+      fractions [1,c] = wsum(w,frac1)
+      fractions [2,c] = wsum(w,frac2)
+      # optimal extraction 
+      w = window(maximum(y1[c]-s1,0),minimum(y1[c]+s1,200))
+      count_opt[1,c], var_opt[1,c] = extract(c,w,frac1,V*(1.+frac2),ff1/wsum(w,fft))
+      w = window(maximum(y2[c]-s2,0),minimum(y2[c]+s2,200))
+      count_opt[2,c], var_opt[2,c] = extract(c,w,frac2,V*(1.+frac1),ff2/wsum(w,fft))
+      for k in [1,2]:
+         newsigmas [k,c] = sig[k,c]
+         borderup  [k,c] = ytrack[k][c] - bs*sig[k,c]
+         borderdown[k,c] = ytrack[k][c] + bs*sig[k,c]
+         
+   # the first, second and third orders
+   c = cols[in123]
+   if len(c) > 0:
+      ff = [None]+[profile(amp[k,c],ytrack[k][c],sig[k,c]) for k in [1,2,3]]
+      fft = ff[1]+ff[2]+ff[3]
+      V = var[:,c]*varFudgeFactor
+      for k in [1,2,3]:
+         y, s = ytrack[k][c], sig[k,c]
+         frac = ff[k]/fft 
+         Vk = V * (1.+ (fft-ff[k])/fft)    # the other orders add to the variance
+         w = window(y-nxsig*s,y+nxsig*s)
+         counts[k,c], variance[k,c] = extract(c,w,frac,Vk)
+         fractions[k,c] = wsum(w,frac)
+         # optimal extraction
+         w = window(y-s,y+s)
+         count_opt[k,c], var_opt[k,c] = extract(c,w,frac,Vk,ff[k]/wsum(w,ff[k]))
+         newsigmas [k,c] = s
+         borderup  [k,c] = y - bs*s
+         borderdown[k,c] = y + bs*s
+   
+   seterr(**olderr)
+   
    return count_opt, var_opt, borderup, borderdown, (fractions,counts, variance, newsigmas) 
 
 
@@ -7360,10 +8179,7 @@ def rebin(binin,func,binout, mode='interpolate',N=20):
    
    
    '''  
-   try:
-      from convolve import boxcar
-   except:
-      from stsci.convolve import boxcar
+   from .uvotsmooth import boxcar
          
    if mode == 'interpolate':
       f = boxcar(func,(N,)) 
@@ -8411,10 +9227,7 @@ def oldcoi_func(pixno,wave,countrate,bkgrate,sig1coef=[3.2],option=1,
    #  from uvotpy import uvotgetspec as uvotgrism
    #except:  
    #  import uvotgrism
-   try:
-      from convolve import boxcar
-   except:
-      from stsci.convolve import boxcar   
+   from .uvotsmooth import boxcar
    from scipy import interpolate
     
    if not do_coi_correction:   # global - use when old CALDB used for fluxes.
@@ -8586,7 +9399,7 @@ def coi_func(pixno,wave,countrate,bkgrate,
    sigma1_limits=[2.6,4.0], 
    ccc = [], ccb = [], ca=[],cb=[],
    debug=False,
-   chatter=5):
+   chatter=5, ctx=None):
    '''Compute the coincidence loss correction factor to the (net) count rate 
    as a function of wavelength  
    
@@ -8621,6 +9434,9 @@ def coi_func(pixno,wave,countrate,bkgrate,
                        
       - **wheelpos** : [160,200,955,1000]
          filter wheel position, one of these values.
+         
+      - **ctx** : ExtractionContext
+         its `do_coi_correction` parameter is used instead of the global one 
    
    Returns
    -------
@@ -8653,10 +9469,7 @@ def coi_func(pixno,wave,countrate,bkgrate,
    #  from uvotpy import uvotgetspec as uvotgrism
    #except:  
    #  import uvotgrism
-   try:
-      from convolve import boxcar
-   except:
-      from stsci.convolve import boxcar   
+   from .uvotsmooth import boxcar
    from scipy import interpolate
    
    # backwards compatibility for testing
@@ -8666,7 +9479,7 @@ def coi_func(pixno,wave,countrate,bkgrate,
    sigma1_limits=[2.6,4.0], trackwidth = 2.5, ccc = [-1.5,+1.5,-1.5,+1.5,-1.5,+1.5,+0.995],
    ccb = [+0.72,-0.72,0.995], ca=[0,0,3.2],cb=[0,0,3.2],debug=False,chatter=1)
    
-   if not do_coi_correction:   # global - use when old CALDB used for fluxes.
+   if not _get_context(ctx).do_coi_correction:   # use when old CALDB used for fluxes.
       # set factor to one:
       return interpolate.interp1d(wave,wave/wave,kind='nearest',bounds_error=False,fill_value=1.0 ) 
       
@@ -66,6 +66,8 @@ __version__ = "1.6.0"
 #               Jan 2015 fixed a typo (bracket) in write_rmf_file
 # version 1.6.0 March 11 2016, update all the fits header.update statements to revised standard astropy
 
+from collections import OrderedDict
+
 try:
   from uvotpy import uvotplot,uvotmisc,uvotwcs,rationalfit,mpfit,uvotio
 except:
@@ -74,6 +76,13 @@ except:
 
 typeNone = type(None)
 interactive=uvotgetspec.interactive
+rmf_cache = True            # rmf_matrix: keep response matrices in memory and on disk
+rmf_cache_size = 16         # number of response matrices kept in memory
+rmf_cache_maxbytes = 200000000  # size of the response matrix files in the cache directory (bytes)
+rmf_cache_anchor_step = 10. # the anchor is rounded to this many pixels in the cache key
+_rmf_matrices = OrderedDict()
+_lsf_tables = {}
+_calfiles_index = {}
 
 def get_uvot_observation(coordinate=None,name=None,obsid=None,chatter=0):
    '''the purpose is to grab the uvot data from the archive  '''
@@ -95,7 +104,7 @@ def rate2flux(wave, rate, wheelpos,
     fudgespec=1., 
     frametime=0.0110329, 
     #sig1coef=[3.2], sigma1_limits=[2.6,4.0],  obsoleted uvotpy version 2.0.2
-    debug=False, chatter=1):
+    debug=False, chatter=1, ctx=None):
    ''' 
    Convert net count rate to flux 
    
@@ -159,6 +168,9 @@ def rate2flux(wave, rate, wheelpos,
         
    respfunc : bool
         return the response function (used by writeSpectrum())
+        
+   ctx : uvotgetspec.ExtractionContext
+        parameters for the sensitivity and coi corrections (default: globals)
               
    Returns
    -------
@@ -280,7 +292,7 @@ def rate2flux(wave, rate, wheelpos,
    if respfunc: return specrespfunc  # feed for writeSpectrum()          
 
    if swifttime != None: 
-      senscorr = sensitivityCorrection(swifttime)
+      senscorr = sensitivityCorrection(swifttime,ctx=ctx)
       print("Sensitivity correction factor for degradation over time = ", senscorr)
       msg += "Sensitivity correction factor for degradation over time = %s\n"%( senscorr)
    else: 
@@ -299,7 +311,7 @@ def rate2flux(wave, rate, wheelpos,
            fudgespec=fudgespec,
            frametime=frametime, 
            background=False, 
-           debug=False,chatter=1)
+           debug=False,chatter=1,ctx=ctx)
       bgcoi = uvotgetspec.coi_func(pixno,wave,
            co_sprate,
            co_bgrate,
@@ -307,7 +319,7 @@ def rate2flux(wave, rate, wheelpos,
            fudgespec=fudgespec,
            frametime=frametime, 
            background=True, \
-           debug=False,chatter=1)
+           debug=False,chatter=1,ctx=ctx)
        
       netrate = rate*fcoi(wave)
       flux = hnu*netrate*senscorr/specrespfunc(wave)/binwidth   # [erg/s/cm2/angstrom]
@@ -321,7 +333,7 @@ def rate2flux(wave, rate, wheelpos,
    return (flux, wave, coi_valid)
    
    
-def sensitivityCorrection(swifttime,wave=None,sens_rate=0.01):
+def sensitivityCorrection(swifttime,wave=None,sens_rate=0.01,ctx=None):
    '''
    give the sensitivity correction factor 
    Actual flux = observed flux(date-obs) times the sensitivity correction  
@@ -336,6 +348,9 @@ def sensitivityCorrection(swifttime,wave=None,sens_rate=0.01):
       
    wave : array, optional
       the wavelength for (future) in case sensitivity(time, wavelength)    
+      
+   ctx : uvotgetspec.ExtractionContext, optional
+      if given, its `senscorr` switch is used instead of uvotgetspec.senscorr   
          
    Notes
    -----
@@ -344,7 +359,11 @@ def sensitivityCorrection(swifttime,wave=None,sens_rate=0.01):
    
    '''
    # added boolean switch for sensitivity calibration activities 2015-06-30
-   if uvotgetspec.senscorr:
+   if ctx == None: 
+       do_senscorr = uvotgetspec.senscorr
+   else:
+       do_senscorr = ctx.senscorr    
+   if do_senscorr:
        sens_corr = 1.0/(1.0 - sens_rate*(swifttime-126230400.000)/31556952.0 )  
        return sens_corr
    else: 
@@ -874,13 +893,7 @@ def XYSpecResp(wheelpos=None,spectralorder=1,anker=[1129,1022], test=None, chatt
       raise
    else: 
       calfiles += "/calfiles/"
-   status = os.system("ls -1 "+calfiles+" > tmp.1")
-   if status != 0:
-      print("FAIL: ls -1 "+calfiles+" > tmp.1")
-   f = open("tmp.1")
-   clist = f.readlines()
-   f.close()      
-   status = os.system("rm tmp.1") 
+   clist = calfiles_index(calfiles)
    
    if len(clist) == 0: 
       print("WARNING XYSpecResp: calfiles directory seems empty")
@@ -897,57 +910,108 @@ def XYSpecResp(wheelpos=None,spectralorder=1,anker=[1129,1022], test=None, chatt
    if wheelpos == 1000:
       arf1 = 'swugv1000_1_20041120v999.arf'
       arf2 = None
-      
-   if arf1 != None: 
-      cl = arf1.split("_") 
-      cl1 = arf1       
-      _axy = [int(cl[1].split('ay')[0].split('ax')[1]),int(cl[1].split('ay')[1]) ]
-      _dxy = cl[2]
-      _ver = cl[4].split('.')[0].split('v') # [date,version]
-      _dist = (Xank-_axy[0])**2 + (Yank-_axy[1])**2
-   else:
-      _axy = [1100,1100]
-      _dxy = 'dx150dy150'
-      _ver = ['20041120', '001']
-      _dist = (Xank-_axy[0])**2 + (Yank-_axy[1])**2
-   if chatter > 2: print("initial: _axy = %s\n_dxy = %s\n_ver = %s\n_dist = %7.2f\n" %(_axy, _dxy, _ver, _dist))
-      
-   for cl in clist:
-       cl1 = cl
-       cl = cl.split("\n")[0] 
-       if chatter > 2:  print('processing: ',cl)
-       #print 'wheelpos  : ',cl[5:9]
-       try:       
-          if int(cl[5:9]) == wheelpos:
-             cl = cl.split("_")
-             if (cl[3] == 'o'+str(spectralorder)):
-                #print "spectral order OK: ", cl[3]
-                axy = [int(cl[1].split('ay')[0].split('ax')[1]),int(cl[1].split('ay')[1]) ]
-                dxy = cl[2]
-                ver = cl[4].split('.')[0].split('v') # [date,version]
-                dist = (Xank-axy[0])**2 + (Yank-axy[1])**2
-                if chatter > 2: print("order=%i\naxy = %s\ndxy = %s\nver = %s\ndist = %7.2f\n_dist = %7.2f\n" %(spectralorder,axy, dxy, ver, dist,_dist))
-                if ((spectralorder == 1) & (dist < _dist)) : 
-                   arf1 = cl1
-                   cl1 = arf1
-                   print("1_____using "+arf1)
-                if ((spectralorder == 2) & (dist < _dist)) : 
-                   arf2 = cl1
-                   cl1 = arf2
-                   print("2_____using "+arf2)
-                if ((spectralorder == 1) & (dist == _dist) & (ver[1] > _ver[1])) : 
-                   arf1 = cl1
-                   cl1 = arf1
-                   print("3_____using "+arf1)
-                if ((spectralorder == 2) & (dist == _dist) & (ver[1] > _ver[1])) : 
-                   arf2 = cl1
-                   cl1 = arf2
-                   print("4_____using "+arf2)
-       except:
-          pass  
+   
+   # the response with the anchor nearest to (Xank,Yank) replaces the default
+   # of its order; the default (without anchor) is not compared against
+   cal = nearest_calfile(wheelpos, spectralorder, [Xank,Yank], calfiles=calfiles, chatter=chatter)
+   if cal != None:
+      if spectralorder == 2:
+         arf2 = cal['file']
+         print("using "+arf2)
+      else:   
+         arf1 = cal['file']
+         print("using "+arf1)
                 
    return SpecResp(wheelpos,spectralorder,arf1=arf1,arf2=arf2)
 
+def calfiles_index(calfiles=None, rescan=False):
+   '''Index of the effective area (ARF) files in the calfiles directory.
+   
+   Parameters
+   ----------
+   calfiles : str, optional
+      directory; default $UVOTPY/calfiles/
+   rescan : bool
+      read the directory again
+      
+   Returns
+   -------
+   index : list of dict
+      one entry per ARF file, with keys 'file' (name), 'wheelpos', 'order',
+      'anchor' ([ax,ay] in det pixels, or None), 'size' ([dx,dy] or None),
+      'date' ('yyyymmdd') and 'version' (int).
+      
+   Notes
+   -----
+   The directory is read once per process. The file names are either 
+   ``swugu0160_ax1080ay1000_dx100dy100_o2_20041120v001.arf`` or, without 
+   anchor, ``swugu0160_1_20041120v999.arf`` and ``swugu0160_20041120v102.arf``
+   (first order).  
+   '''
+   import os
+   import re
+   if calfiles == None:
+      calfiles = os.path.join(os.getenv('UVOTPY'),'calfiles')
+   calfiles = os.path.abspath(calfiles)
+   if (calfiles in _calfiles_index) and not rescan:
+      return _calfiles_index[calfiles]
+   anchored = re.compile(r'^swug[uv](\d{4})_ax(\d+)ay(\d+)_dx(\d+)dy(\d+)_o(\d)_(\d{8})v(\d+)\.arf$')
+   plain = re.compile(r'^swug[uv](\d{4})_(?:(\d)_)?(\d{8})v(\d+)\.arf$')
+   index = []
+   for name in sorted(os.listdir(calfiles)):
+      m = anchored.match(name)
+      if m != None:
+         g = m.groups()
+         index.append({'file':name, 'wheelpos':int(g[0]), 'order':int(g[5]),
+            'anchor':[int(g[1]),int(g[2])], 'size':[int(g[3]),int(g[4])],
+            'date':g[6], 'version':int(g[7])})
+         continue
+      m = plain.match(name)
+      if m != None:
+         g = m.groups()
+         if g[1] == None:
+            order = 1
+         else:
+            order = int(g[1])
+         index.append({'file':name, 'wheelpos':int(g[0]), 'order':order,
+            'anchor':None, 'size':None, 'date':g[2], 'version':int(g[3])})
+   _calfiles_index[calfiles] = index
+   return index
+
+
+def nearest_calfile(wheelpos, spectralorder, anker, calfiles=None, chatter=0):
+   '''Select the ARF file in the calfiles directory with the anchor 
+   nearest to `anker`.
+   
+   Parameters
+   ----------
+   wheelpos : int
+   spectralorder : int
+   anker : list
+      anchor position [x,y] in det pixels
+   calfiles : str, optional
+      directory; default $UVOTPY/calfiles/
+      
+   Returns
+   -------
+   entry : dict or None
+      the calfiles_index() entry; of equally distant anchors the most recent
+      version; None if no file for this wheelpos and order has an anchor.
+   '''
+   best = None
+   for cal in calfiles_index(calfiles):
+      if (cal['wheelpos'] != wheelpos) or (cal['order'] != spectralorder) or (cal['anchor'] == None):
+         continue
+      dist = (anker[0]-cal['anchor'][0])**2 + (anker[1]-cal['anchor'][1])**2
+      if chatter > 2: 
+         print("%s dist = %7.2f"%(cal['file'],dist))
+      if (best == None) or (dist < best[0]) or \
+         ((dist == best[0]) & ((cal['date'],cal['version']) > (best[1]['date'],best[1]['version']))): 
+         best = (dist, cal)
+   if best == None:
+      return None
+   return best[1]
+
 def _specresp (wheelpos, spectralorder, arf1 = None, arf2 = None, chatter=1):
    ''' Read the spectral response file [or a placeholder] and 
     
@@ -1138,6 +1202,54 @@ def SpecResp (wheelpos, spectralorder, arf1 = None, arf2 = None):
    specrespfunc = interpolate.interp1d(wmean, xresp, kind='linear', bounds_error=False ) 
    return specrespfunc
 
+def _fluxcal_default(wheelpos, spectralorder):
+   '''name of the default effective area file in $UVOTPY/calfiles, the 
+   extension name and the model extension name (see readFluxCalFile)'''
+   # here the "latest" version of the calibration files has been hardcoded    
+   # latest update:   
+   if spectralorder == 1: 
+          if wheelpos == 200:          
+             calfile = 'swugu0200_20041120v105.arf'
+             extname = "SPECRESPUGRISM200"
+             model   = "ZEMAXMODEL_200"
+          elif wheelpos == 160:
+             calfile = 'swugu0160_20041120v105.arf'
+             extname = "SPECRESPUGRISM160"
+             model   = "ZEMAXMODEL_160"
+          elif wheelpos == 955: 
+             calfile = 'swugv0955_20041120v104.arf'
+             extname = "SPECRESPVGRISM0955"
+             model   = "ZEMAXMODEL_955"
+          elif wheelpos == 1000: 
+             calfile = 'swugv1000_20041120v105.arf'
+             extname = "SPECRESPVGRISM1000"
+             model   = "ZEMAXMODEL_1000"
+          else:   
+             raise RuntimeError( "FATAL: [uvotio.readFluxCalFile] invalid filterwheel position encoded" )
+             
+   elif spectralorder == 2:          
+          if wheelpos == 200:          
+             calfile =  'swugu0200_2_20041120v999.arf' #'swugu0200_20041120v105.arf'
+             extname = "SPECRESP0160GRISM2NDORDER"
+             model   = ""
+          elif wheelpos == 160:
+             calfile = 'swugu0160_2_20041120v999.arf'  #'swugu0160_20041120v105.arf'
+             extname = "SPECRESP0160GRISM2NDORDER"
+             model   = ""
+          elif wheelpos == 955: 
+             calfile = 'swugv0955_2_20041120v999.arf' #'swugv0955_20041120v104.arf'
+             extname = "SPECRESPVGRISM955"
+             model   = ""
+          elif wheelpos == 1000: 
+             calfile = 'swugv1000_2_20041120v999.arf'  #swugv1000_20041120v105.arf'
+             extname = "SPECRESPVGRISM1000"
+             model   = ""
+          else:   
+             raise RuntimeError( "FATAL: [uvotio.readFluxCalFile] invalid filterwheel position encoded" )
+   else:         
+             raise RuntimeError("spectral order not 1 or 2 - no effective area available")
+   return calfile, extname, model
+
 def readFluxCalFile(wheelpos,anchor=None,option="default",spectralorder=1,
     arf=None,msg="",chatter=0):
    """Read the new flux calibration file, or return None.
@@ -1204,56 +1316,15 @@ def readFluxCalFile(wheelpos,anchor=None,option="default",spectralorder=1,
          anchor = np.array(anchor, dtype=float)  
 
    check_extension = False
-   # here the "latest" version of the calibration files has been hardcoded    
-   # latest update:   
-   if spectralorder == 1: 
-          if wheelpos == 200:          
-             calfile = 'swugu0200_20041120v105.arf'
-             extname = "SPECRESPUGRISM200"
-             model   = "ZEMAXMODEL_200"
-          elif wheelpos == 160:
-             calfile = 'swugu0160_20041120v105.arf'
-             extname = "SPECRESPUGRISM160"
-             model   = "ZEMAXMODEL_160"
-          elif wheelpos == 955: 
-             calfile = 'swugv0955_20041120v104.arf'
-             extname = "SPECRESPVGRISM0955"
-             model   = "ZEMAXMODEL_955"
-          elif wheelpos == 1000: 
-             calfile = 'swugv1000_20041120v105.arf'
-             extname = "SPECRESPVGRISM1000"
-             model   = "ZEMAXMODEL_1000"
-          else:   
-             raise RuntimeError( "FATAL: [uvotio.readFluxCalFile] invalid filterwheel position encoded" )
-             
-   elif spectralorder == 2:          
+   calfile, extname, model = _fluxcal_default(wheelpos, spectralorder)
+   if spectralorder == 2:          
           # HACK: force second order to 'nearest' option 2015-06-30 
           option == "nearest"
           check_extension = True
-          if wheelpos == 200:          
-             calfile =  'swugu0200_2_20041120v999.arf' #'swugu0200_20041120v105.arf'
-             extname = "SPECRESP0160GRISM2NDORDER"
-             model   = ""
-          elif wheelpos == 160:
-             calfile = 'swugu0160_2_20041120v999.arf'  #'swugu0160_20041120v105.arf'
-             extname = "SPECRESP0160GRISM2NDORDER"
-             model   = ""
-          elif wheelpos == 955: 
-             calfile = 'swugv0955_2_20041120v999.arf' #'swugv0955_20041120v104.arf'
-             extname = "SPECRESPVGRISM955"
-             model   = ""
-          elif wheelpos == 1000: 
-             calfile = 'swugv1000_2_20041120v999.arf'  #swugv1000_20041120v105.arf'
-             extname = "SPECRESPVGRISM1000"
-             model   = ""
-          else:   
-             raise RuntimeError( "FATAL: [uvotio.readFluxCalFile] invalid filterwheel position encoded" )
           if chatter > 3:
              print("[uvotio.readFluxCalFile] "+calfile)
              print("       extname="+extname)
              print("       model="+model+"|")  
-   else:         
-             raise RuntimeError("spectral order not 1 or 2 - no effective area available")
              
              
    if chatter > 1:
@@ -1261,17 +1332,14 @@ def readFluxCalFile(wheelpos,anchor=None,option="default",spectralorder=1,
    if arf != None:
       if arf.upper() == "CALDB":
    # try to get the file from the CALDB
-         os.getenv("CALDB")
-         command="quzcif swift uvota - "+grismname+\
-          " SPECRESP now now  wheelpos.eq."+str(wheelpos)+" > quzcif.out"
-         os.system(command) 
-         f = open("quzcif.out")
-         records = f.readlines()
-         f.close()
-         os.system("rm -f quzcif.out")
-         arf, extens = records[0].split()  
-         arf = CALDB + "/data/swift/uvota/cpf/arf/"+arf     
-         hdu = fits.open(arf)
+         from .uvotcaldb import quzcif, caldb_hdulist
+         records = quzcif("swift","uvota","-",grismname,"SPECRESP","now","now",
+            "wheelpos.eq."+str(wheelpos))
+         if len(records) == 0:
+            raise IOError("uvotio.readFluxCalFile: no SPECRESP file in the CALDB for "+
+               grismname+" wheelpos="+str(wheelpos))
+         arf, extens = records[0]
+         hdu = caldb_hdulist(arf)
        
       else:
       # path to arf is supplied
@@ -1674,7 +1742,7 @@ def uvotify (spectrum, fileout=None, disp=None, wheelpos=160, lsffile=None, clea
 def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None, 
     arf1=None, arf2=None, fit_second=True, write_rmffile=True,
     used_lenticular=True, fileversion=2, calibration_mode=True,
-    history=None, chatter=1, clobber=False ) :
+    history=None, chatter=1, clobber=False, ctx=None ) :
     
    '''Write a standard UVOT output file - Curved extraction only, not optimal extraction.
   
@@ -1720,6 +1788,10 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
    
    - **clobber** : bool
      overwrite files   
+     
+   - **ctx** : uvotgetspec.ExtractionContext
+     parameters of the extraction (trackwidth, interactive, senscorr, 
+     do_coi_correction). If None, they are taken from the uvotgetspec globals.
 
   Returns
   -------
@@ -1805,6 +1877,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
     - 2012-09-14 added coi correction 
     - 2013-03-06 edited header
     - 2015-02-13 change quality flag in SPECTRUM extension to conform to XSPEC range
+    - 2017-06-20 pass the extraction context instead of using globals
   '''       
    try:
       from astropy.io import fits
@@ -1825,7 +1898,8 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
    h_c_ang = h_planck * lightspeed * 1e8 # ergs-Angstrom
    ch = chatter
    
-   trackwidth = uvotgetspec.trackwidth # half-width of the extraction in terms of sigma
+   if ctx == None: ctx = uvotgetspec.ExtractionContext()
+   trackwidth = ctx.trackwidth # half-width of the extraction in terms of sigma
    wave2 = None
    sp2netcnt = None
    bg2netcnt = None
@@ -1932,7 +2006,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
    exposure=hdr['exposure']
    expospec1 = expospec[1,q1[0]].flatten()
    wave =  polyval(C_1, x[q1[0]])
-   senscorr = sensitivityCorrection(hdr['tstart'])
+   senscorr = sensitivityCorrection(hdr['tstart'],ctx=ctx)
    background_strip1 = background_strip1[q1[0]]
    background_strip2 = background_strip2[q1[0]]
      
@@ -1983,7 +2057,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
        wheelpos = wheelpos,
        frametime=hdr['framtime'], 
        background=False, 
-       debug=False,chatter=1)
+       debug=False,chatter=1,ctx=ctx)
    print("writing output file: computing coincidence loss background")    
    bgcoi = uvotgetspec.coi_func(dis,wave,
        co_sp1rate,
@@ -1992,7 +2066,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
        wheelpos = wheelpos,
        frametime=hdr['framtime'], 
        background=True, \
-       debug=False,chatter=1)
+       debug=False,chatter=1,ctx=ctx)
 
    if len(coi_valid1) == len(quality):
        quality[coi_valid1 == False] =  qflags["too_bright"]
@@ -2025,7 +2099,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
               co_sprate = (co_first[q1[0]][qwave]/expospec1),
               co_bgrate = (co_back[q1[0]][qwave]/expospec1),
               debug=False, 
-              chatter=1)
+              chatter=1, ctx=ctx)
       #specresp1func = XYSpecResp(wheelpos=hdr['wheelpos'],spectralorder=1, Xank=anker[0], Yank=anker[1]) 
       
    hnu = h_c_ang/(wave)
@@ -2129,7 +2203,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
                     coi_length=29,
                     frametime=hdr['framtime'], 
                     background=False, 
-                    debug=False,chatter=1)
+                    debug=False,chatter=1,ctx=ctx)
          bgcoi2 = uvotgetspec.coi_func(pix2,wave2,
                 (co_second[q2[0]]/expospec2).flatten(),
                 (co_back[q2[0]]/expospec2).flatten(),
@@ -2138,7 +2212,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
                     coi_length=29,
                     frametime=hdr['framtime'], 
                     background=True, 
-                    debug=False,chatter=1)
+                    debug=False,chatter=1,ctx=ctx)
 
 
          if len(coi_valid2) == len(qual2):
@@ -2255,7 +2329,7 @@ def writeSpectrum(ra,dec,filestub,ext, Y, fileoutstub=None,
            # write_rmf_file (rmffile2, wave2, hdr['wheelpos'],2, C_2, 
            #     arf1=None, arf2=arf2, clobber=clobber,chatter=chatter   )
            print("no RMF file for second order available")
-         if interactive:
+         if ctx.interactive:
             answer =  input('       DO YOU WANT TO REWRITE THE OUTPUT FILES (answer yes/NO)? ')
             if len(answer) < 1:  answer = 'NO'
             answer = answer.upper()
@@ -3653,21 +3727,22 @@ def write_rmf_file (rmffilename, wave, wheelpos, disp,
    2015-02-09 There was a major overhaul of this routine, which is now 
               much improved.           
    2015-02-13 remove trimming of channels            
+   2017-06-20 the matrix is made for all channels at once 
+   2017-06-20 only the channels of each row above LO_THRES are written 
+   2017-06-20 the matrix is computed by rmf_matrix(), which caches it
    ''' 
    try:
       from astropy.io import fits
    except:   
       import pyfits as fits
    import numpy as np
-   import os
-   from scipy.ndimage import convolve
-   import uvotio
-   import uvotgetspec
-   from scipy import interpolate
    import datetime
    
    version = '150208'
    
+   # minimum value in the matrix 
+   lo_thres = 1.0e-10
+   
    if not ((lsfVersion == '001') | (lsfVersion == '002') | (lsfVersion == '003') ):
       raise IOError("please update the calfiles directory with new lsf file.")
    
@@ -3675,6 +3750,138 @@ def write_rmf_file (rmffilename, wave, wheelpos, disp,
    datestring = now.isoformat()[0:4]+now.isoformat()[5:7]+now.isoformat()[8:10]
    if chatter > 0: print("computing RMF file.")
    
+   NN = len(wave)  # number of channels in spectrum (backward since we will use energy)
+   if NN < 20:
+      print("write_rmf_file: not enough valid data points.\n"+\
+      " No rmf file written for wheelpos=",wheelpos,", order=",spectralorder)
+      return
+   
+   energy_lo, energy_hi, n_grp, f_chan, n_chan, matrixrows = rmf_matrix(wave, wheelpos, disp,
+       anchor=anchor, spectralorder=spectralorder, effarea1=effarea1, 
+       lsfVersion=lsfVersion, lo_thres=lo_thres, msg=msg, chatter=chatter) 
+
+   channel = np.arange(NN) + 1  # start channel numbers with 1 
+
+   # for output
+   if wheelpos < 500: 
+      filtername = "UGRISM"
+   else:
+      filtername = "VGRISM"
+
+   if chatter > 0 : print("writing RMF file")
+
+   hdu = fits.PrimaryHDU()
+   hdulist=fits.HDUList([hdu])
+   hdulist[0].header['TELESCOP']=('SWIFT   ','Telescope (mission) name')                       
+   hdulist[0].header['INSTRUME']=('UVOTA   ','Instrument Name')  
+   hdulist[0].header['COMMENT'] ="revision 2015-02-08, version 003" 
+    
+   col11 = fits.Column(name='ENERG_LO',format='E',array=energy_lo,unit='KeV')
+   col12 = fits.Column(name='ENERG_HI',format='E',array=energy_hi,unit='KeV') 
+   col13 = fits.Column(name='N_GRP',format='1I',array=n_grp,unit='None')
+   col14 = fits.Column(name='F_CHAN',format='1I',array=f_chan,unit='None')
+   col15 = fits.Column(name='N_CHAN',format='1I',array=n_chan,unit='None' )
+   col16 = fits.Column(name='MATRIX',format='PE()',array=matrixrows,unit='cm**2' )
+   cols1 = fits.ColDefs([col11,col12,col13,col14,col15,col16])
+   tbhdu1 = fits.BinTableHDU.from_columns(cols1)    
+   tbhdu1.header['EXTNAME'] =('MATRIX','Name of this binary table extension')
+   tbhdu1.header['TELESCOP']=('SWIFT','Telescope (mission) name')
+   tbhdu1.header['INSTRUME']=('UVOTA','Instrument name')
+   tbhdu1.header['FILTER']  =(filtername,'filter name')
+   tbhdu1.header['CHANTYPE']=('PI', 'Type of channels (PHA, PI etc)')
+   tbhdu1.header['HDUCLASS']=('OGIP','format conforms to OGIP standard')
+   tbhdu1.header['HDUCLAS1']=('RESPONSE','RESPONSE DATA')
+   tbhdu1.header['HDUCLAS2']=('RSP_MATRIX','contains response matrix')   
+   tbhdu1.header['HDUCLAS3']=('FULL','type of stored matrix')   
+   tbhdu1.header['HDUVERS'] =('1.3.0','version of the file format')      
+   tbhdu1.header['ORIGIN']  =('UVOTPY revision 2015-02-08','source of FITS file')
+   tbhdu1.header['TLMIN4']  =( 1, 'First legal channel number')                           
+   tbhdu1.header['TLMAX4']  =(NN, 'Last legal channel number')                           
+   tbhdu1.header['NUMGRP']  =(int(n_grp.sum()), 'Sum of the N_GRP column')                           
+   tbhdu1.header['NUMELT']  =(int(n_chan.sum()), 'Sum of the N_CHAN column')                           
+   tbhdu1.header['DETCHANS']=(NN, 'Number of raw detector channels')                           
+   tbhdu1.header['LO_THRES']=(lo_thres, 'Minimum value in MATRIX column to apply')                           
+   tbhdu1.header['DATE']    =(now.isoformat(), 'File creation date') 
+   hdulist.append(tbhdu1)
+   
+   col21 = fits.Column(name='CHANNEL',format='I',array=channel,unit='channel')
+   col22 = fits.Column(name='E_MIN',format='E',array=energy_lo,unit='keV')
+   col23 = fits.Column(name='E_MAX',format='E',array=energy_hi,unit='keV')
+   cols2 = fits.ColDefs([col21,col22,col23])
+   tbhdu2 = fits.BinTableHDU.from_columns(cols2)    
+   tbhdu2.header['EXTNAME'] =('EBOUNDS','Name of this binary table extension')
+   tbhdu2.header['TELESCOP']=('SWIFT','Telescope (mission) name')
+   tbhdu2.header['INSTRUME']=('UVOTA','Instrument name')
+   tbhdu2.header['FILTER']  =(filtername,'filter name')
+   tbhdu2.header['CHANTYPE']=('PI', 'Type of channels (PHA, PI etc)')
+   tbhdu2.header['HDUCLASS']=('OGIP','format conforms to OGIP standard')
+   tbhdu2.header['HDUCLAS1']=('RESPONSE','RESPONSE DATA')
+   tbhdu2.header['HDUCLAS2']=('EBOUNDS','type of stored matrix')   
+   tbhdu2.header['HDUVERS'] =('1.2.0','version of the file format')      
+   tbhdu2.header['DETCHANS']=(NN, 'Number of raw detector channels')                           
+   tbhdu2.header['TLMIN1']  =( 1, 'First legal channel number')                           
+   tbhdu2.header['TLMAX1']  =(NN, 'Last legal channel number')                              
+   tbhdu2.header['DATE']    =(now.isoformat(), 'File creation date')                           
+   hdulist.append(tbhdu2)     
+   hdulist.writeto(rmffilename,clobber=clobber)
+
+
+
+def rmf_matrix(wave, wheelpos, disp, anchor=[1000,1000], spectralorder=1,
+    effarea1=None, lsfVersion='001', lo_thres=1.0e-10, msg="", chatter=1):
+   '''
+   Compute the response matrix for write_rmf_file(), or take it from the cache. 
+   
+   Parameters
+   ----------
+   wave, wheelpos, disp, anchor, spectralorder, effarea1, lsfVersion, chatter :
+      see write_rmf_file()
+   lo_thres : float
+      values of the matrix below lo_thres are set to zero
+      
+   Returns
+   -------
+   energy_lo, energy_hi : ndarray
+      energy boundaries (keV) of the channels, increasing 
+   n_grp, f_chan, n_chan : ndarray   
+      number of groups, first channel and number of channels of each row 
+   matrixrows : ndarray of objects
+      the channels of each row from f_chan on 
+   
+   Notes
+   -----
+   Unless effarea1 is given, the matrices are kept in memory (the last 
+   `rmf_cache_size`) and as pickle files in the calibration cache directory 
+   (see uvotgetspec.calspline_cachedir; at most `rmf_cache_maxbytes`, least
+   recently used removed first). The key is wheelpos, spectralorder, 
+   lsfVersion, lo_thres, the anchor rounded to `rmf_cache_anchor_step` pixels, 
+   the path and modification time of the effective area and LSF files, 
+   and a hash of the wavelengths (to 0.001A) and the dispersion. When
+   cached, the matrix is computed at the rounded anchor, so that it does 
+   not depend on which anchor of the bin came first.
+   Set `rmf_cache = False` to always compute the matrix.
+   
+   History
+   -------
+   2017-06-20 taken from write_rmf_file; cache added 
+   2017-06-27 calibration files in the cache key; computed at the rounded anchor
+   '''
+   import numpy as np
+   from scipy.ndimage import convolve1d
+   import uvotio
+   import uvotgetspec
+   from scipy import interpolate
+   
+   cachekey = None
+   if rmf_cache & (type(effarea1) == typeNone):
+      # the matrix is computed at the centre of the anchor bin of the key
+      step = rmf_cache_anchor_step
+      anchor = [float(step*np.round(float(z)/step)) for z in anchor]
+      cachekey = _rmf_cache_key(wave, wheelpos, disp, anchor, spectralorder, lsfVersion, lo_thres)
+      rmf = _rmf_cache_get(cachekey, chatter=chatter)
+      if type(rmf) != typeNone:
+         return rmf
+   
    # telescope and image intensifier broadening   
    if lsfVersion == '001':
        if wheelpos < 500:
@@ -3713,20 +3920,13 @@ def write_rmf_file (rmffilename, wave, wheelpos, disp,
    #    wave = wave[(np.isfinite(flux) & (flux >= 0.))]            
                    
    NN = len(wave)  # number of channels in spectrum (backward since we will use energy)
-   if NN < 20:
-      print("write_rmf_file: not enough valid data points.\n"+\
-      " No rmf file written for wheelpos=",wheelpos,", order=",spectralorder)
-      return
-   
    iNL = np.arange(0,NN,1,dtype=int)  # index energy array spectrum
    NL = len(iNL)   # number of sample channels
    
-   aa = uvotgetspec.pix_from_wave(disp, wave, spectralorder=spectralorder)  # slow !
+   aa = uvotgetspec.pix_from_wave(disp, wave, spectralorder=spectralorder)
    tck_Cinv = interpolate.splrep(wave,aa,)  # B-spline coefficients to look up pixel position (wave)
    
-   channel = list(range(NN))
    aarev   = list(range(NN-1,-1,-1))  # reverse channel numbers (not 1-offset)
-   channel = np.array(channel) + 1  # start channel numbers with 1 
 
    # spectral response as function of energy
    resp = specrespfunc(wave[aarev]) 
@@ -3747,9 +3947,6 @@ def write_rmf_file (rmffilename, wave, wheelpos, disp,
    d_mid = np.array(interpolate.splev(wave[aarev], tck_Cinv,) + 0.5,dtype=int) # increasing energy
    
    # output arrays
-   n_grp = np.ones(NN)
-   f_chan = np.ones(NN)
-   n_chan = np.ones(NN) * NN
    matrix = np.zeros( NN*NN, dtype=float).reshape(NN,NN)
    
    # (only for original version pre-2015-02-05) instrumental profile gaussian assuming first order
@@ -3761,99 +3958,143 @@ def write_rmf_file (rmffilename, wave, wheelpos, disp,
    # get the LSF data for selected wavelengths/energies   
    lsfwav,lsfepix,lsfdata,lsfener = _read_lsf_file(lsfVersion=lsfVersion,wheelpos=wheelpos,)
                   
-   #provide a spectral response for NN energies 
-         
-   for k in iNL:   # increasing energy
-              
-         # find the LSF for the current energy channel     
-         lsf = _interpolate_lsf(e_mid[k],lsfener,lsfdata,lsfepix,)
+   # provide a spectral response for NN energies: the LSF of all energy channels at once
+   lsf = _interpolate_lsf(e_mid,lsfener,lsfdata,lsfepix,)
 
-         # convolution lsf with instrument_fwhm 
-         if lsfVersion == '001':
-            lsf = convolve(lsf,ww.copy(),)
+   # convolution lsf with instrument_fwhm 
+   if lsfVersion == '001':
+      lsf = convolve1d(lsf,ww,axis=1)
          
-         # lsf should already be normalised normalised to one
-         # assign wave to lsf array relative to w at index k in matrix (since on diagonal)   
-         # rescale lsf from half-pixels (centre is on a boundary) to channels 
+   # lsf should already be normalised normalised to one
+   # assign wave to lsf array relative to w at index k in matrix (since on diagonal)   
+   # rescale lsf from half-pixels (centre is on a boundary) to channels by adding 
+   # neighboring half-pixel LSF, in reverse order since the energy increases 
+   npair = len(lsfepix)//2
+   lsfchan = (lsf[:,0:2*npair:2] + lsf[:,1:2*npair:2])[:,::-1]
+   
+   # where to put in matrix row k: the channels around k, as far as they are 
+   # in the matrix; centre is in middle of a channel
+   rows = iNL[:,np.newaxis] + np.zeros(npair,dtype=int)
+   cols = iNL[:,np.newaxis] - (npair+1)//2 + np.arange(npair)
+   q = (cols >= 0) & (cols < NN)
+   matrix[rows[q],cols[q]] = (lsfchan*resp[:,np.newaxis])[q]
 
-         # find the range in pixels around the e_mid pixel at index k
-         pdel = len(lsfepix)/2/2  # one-way difference; half->whole pixels
+   # apply the threshold lo_thres and keep in each row one group of channels,
+   # from the first to the last non-zero value
+   matrix[matrix < lo_thres] = 0.
+   above = matrix > 0.
+   inrow = above.any(axis=1)
+   first = np.argmax(above,axis=1)
+   last  = NN - 1 - np.argmax(above[:,::-1],axis=1)
+   n_grp  = np.where(inrow, 1, 0)
+   f_chan = np.where(inrow, first + 1, 0)  # channel numbers start with 1 
+   n_chan = np.where(inrow, last - first + 1, 0)
+   matrixrows = np.empty(NN,dtype=object)
+   for k in iNL:
+      matrixrows[k] = matrix[k,first[k]:first[k]+n_chan[k]].astype(np.float32)
+   
+   rmf = (energy_lo, energy_hi, n_grp, f_chan, n_chan, matrixrows)
+   if type(cachekey) != typeNone:
+      _rmf_cache_put(cachekey, rmf, chatter=chatter)
+   return rmf
 
-         # where to put in matrix row :
-         qrange = np.arange( np.max([k-pdel,0]),  np.min([k+pdel,NN]), 1,dtype=int)
 
-         # skipping by lsfepix twos so that we can add neighboring half-pixel LSF 
-         qpix = np.arange(pdel*4-2,-1,-2,dtype=int)
-         
-         
-         matrixrow   = np.zeros(NN)      
-         matrixrow[qrange] = lsf[qpix]+lsf[qpix+1]
-         # centre is in middle of a channel
-         matrix[k,:] = matrixrow*resp[k]
+def _rmf_cache_key(wave, wheelpos, disp, anchor, spectralorder, lsfVersion, lo_thres):
+   '''cache key of a response matrix (see rmf_matrix)'''
+   import os
+   import hashlib
+   import numpy as np
+   grid = hashlib.md5(np.round(np.asarray(wave,dtype=float),3).tobytes())
+   grid.update(np.asarray(disp,dtype=float).tobytes())
+   step = rmf_cache_anchor_step
+   anc = tuple([int(np.round(float(z)/step)) for z in anchor])
+   # the calibration files read by readFluxCalFile() and _read_lsf_file()
+   arffile = os.path.join(os.getenv("UVOTPY"),"calfiles",_fluxcal_default(wheelpos, spectralorder)[0])
+   calfiles = tuple([(os.path.abspath(f), os.path.getmtime(f)) for f in 
+      [arffile, _lsf_filename(lsfVersion)]])
+   key = (int(wheelpos), int(spectralorder), str(lsfVersion), float(lo_thres), anc, 
+      calfiles, grid.hexdigest())
+   return hashlib.md5(repr(key).encode('utf-8')).hexdigest()
 
-   # for output
-   if wheelpos < 500: 
-      filtername = "UGRISM"
-   else:
-      filtername = "VGRISM"
 
-   if chatter > 0 : print("writing RMF file")
+def _rmf_cache_file(cachekey):
+   import os
+   return os.path.join(uvotgetspec._calcache_dir(),'rmf_'+cachekey+'.pkl')
 
-   hdu = fits.PrimaryHDU()
-   hdulist=fits.HDUList([hdu])
-   hdulist[0].header['TELESCOP']=('SWIFT   ','Telescope (mission) name')                       
-   hdulist[0].header['INSTRUME']=('UVOTA   ','Instrument Name')  
-   hdulist[0].header['COMMENT'] ="revision 2015-02-08, version 003" 
-    
-   col11 = fits.Column(name='ENERG_LO',format='E',array=energy_lo,unit='KeV')
-   col12 = fits.Column(name='ENERG_HI',format='E',array=energy_hi,unit='KeV') 
-   col13 = fits.Column(name='N_GRP',format='1I',array=n_grp,unit='None')
-   col14 = fits.Column(name='F_CHAN',format='1I',array=f_chan,unit='None')
-   col15 = fits.Column(name='N_CHAN',format='1I',array=n_chan,unit='None' )
-   col16 = fits.Column(name='MATRIX',format='PE(NN)',array=matrix,unit='cm**2' )
-   cols1 = fits.ColDefs([col11,col12,col13,col14,col15,col16])
-   tbhdu1 = fits.BinTableHDU.from_columns(cols1)    
-   tbhdu1.header['EXTNAME'] =('MATRIX','Name of this binary table extension')
-   tbhdu1.header['TELESCOP']=('SWIFT','Telescope (mission) name')
-   tbhdu1.header['INSTRUME']=('UVOTA','Instrument name')
-   tbhdu1.header['FILTER']  =(filtername,'filter name')
-   tbhdu1.header['CHANTYPE']=('PI', 'Type of channels (PHA, PI etc)')
-   tbhdu1.header['HDUCLASS']=('OGIP','format conforms to OGIP standard')
-   tbhdu1.header['HDUCLAS1']=('RESPONSE','RESPONSE DATA')
-   tbhdu1.header['HDUCLAS2']=('RSP_MATRIX','contains response matrix')   
-   tbhdu1.header['HDUCLAS3']=('FULL','type of stored matrix')   
-   tbhdu1.header['HDUVERS'] =('1.3.0','version of the file format')      
-   tbhdu1.header['ORIGIN']  =('UVOTPY revision 2015-02-08','source of FITS file')
-   tbhdu1.header['TLMIN4']  =( 1, 'First legal channel number')                           
-   tbhdu1.header['TLMAX4']  =(NN, 'Last legal channel number')                           
-   tbhdu1.header['NUMGRP']  =(NN, 'Sum of the N_GRP column')                           
-   tbhdu1.header['NUMELT']  =(NN, 'Sum of the N_CHAN column')                           
-   tbhdu1.header['DETCHANS']=(NN, 'Number of raw detector channels')                           
-   tbhdu1.header['LO_THRES']=(1.0E-10, 'Minimum value in MATRIX column to apply')                           
-   tbhdu1.header['DATE']    =(now.isoformat(), 'File creation date') 
-   hdulist.append(tbhdu1)
+
+def _rmf_cache_get(cachekey, chatter=0):
+   '''response matrix from memory or disk, or None'''
+   import os
+   try:
+      import cPickle as pickle
+   except ImportError:
+      import pickle
+   if cachekey in _rmf_matrices:
+      rmf = _rmf_matrices.pop(cachekey)
+      _rmf_matrices[cachekey] = rmf   # most recently used last
+      if chatter > 2: print("rmf_matrix: response matrix taken from memory")
+      return rmf
+   cachefile = _rmf_cache_file(cachekey)   
+   if not os.access(cachefile,os.R_OK):
+      return
+   try:
+      f = open(cachefile,'rb')
+      rmf = pickle.load(f)
+      f.close()
+      os.utime(cachefile,None)  # for the eviction order
+   except Exception:
+      if chatter > 0: print("rmf_matrix: WARNING - cannot read %s"%(cachefile))
+      return
+   if chatter > 2: print("rmf_matrix: response matrix read from %s"%(cachefile))
+   _rmf_cache_put(cachekey, rmf, todisk=False)
+   return rmf   
    
-   col21 = fits.Column(name='CHANNEL',format='I',array=channel,unit='channel')
-   col22 = fits.Column(name='E_MIN',format='E',array=energy_lo,unit='keV')
-   col23 = fits.Column(name='E_MAX',format='E',array=energy_hi,unit='keV')
-   cols2 = fits.ColDefs([col21,col22,col23])
-   tbhdu2 = fits.BinTableHDU.from_columns(cols2)    
-   tbhdu2.header['EXTNAME'] =('EBOUNDS','Name of this binary table extension')
-   tbhdu2.header['TELESCOP']=('SWIFT','Telescope (mission) name')
-   tbhdu2.header['INSTRUME']=('UVOTA','Instrument name')
-   tbhdu2.header['FILTER']  =(filtername,'filter name')
-   tbhdu2.header['CHANTYPE']=('PI', 'Type of channels (PHA, PI etc)')
-   tbhdu2.header['HDUCLASS']=('OGIP','format conforms to OGIP standard')
-   tbhdu2.header['HDUCLAS1']=('RESPONSE','RESPONSE DATA')
-   tbhdu2.header['HDUCLAS2']=('EBOUNDS','type of stored matrix')   
-   tbhdu2.header['HDUVERS'] =('1.2.0','version of the file format')      
-   tbhdu2.header['DETCHANS']=(NN, 'Number of raw detector channels')                           
-   tbhdu2.header['TLMIN1']  =( 1, 'First legal channel number')                           
-   tbhdu2.header['TLMAX1']  =(NN, 'Last legal channel number')                              
-   tbhdu2.header['DATE']    =(now.isoformat(), 'File creation date')                           
-   hdulist.append(tbhdu2)     
-   hdulist.writeto(rmffilename,clobber=clobber)
 
+def _rmf_cache_put(cachekey, rmf, todisk=True, chatter=0):
+   '''keep the response matrix in memory and write it to the disk cache'''
+   import os
+   import glob
+   try:
+      import cPickle as pickle
+   except ImportError:
+      import pickle
+   _rmf_matrices[cachekey] = rmf
+   while len(_rmf_matrices) > max(rmf_cache_size,0):
+      _rmf_matrices.popitem(last=False)
+   if not todisk:
+      return
+   cachefile = _rmf_cache_file(cachekey)   
+   cachedir = os.path.dirname(cachefile)
+   # write to a temporary file first, since other processes may read the cache   
+   try:
+      if not os.path.isdir(cachedir):
+         os.makedirs(cachedir)
+      tmpfile = cachefile+'.%i'%(os.getpid())   
+      f = open(tmpfile,'wb')
+      pickle.dump(rmf,f,2)
+      f.close()
+      os.rename(tmpfile,cachefile)
+   except Exception:
+      if chatter > 0: print("rmf_matrix: WARNING - cannot write cache %s"%(cachefile))
+      return
+   # remove the least recently used files above rmf_cache_maxbytes   
+   files = []
+   for name in glob.glob(os.path.join(cachedir,'rmf_*.pkl')):
+      try:
+         st = os.stat(name)
+         files.append((st.st_mtime, st.st_size, name))
+      except OSError:
+         pass
+   files.sort()
+   total = sum([z[1] for z in files])
+   for mtime, size, name in files:
+      if (total <= rmf_cache_maxbytes) | (name == cachefile): 
+         break
+      try:
+         os.remove(name)
+         total -= size
+      except OSError:
+         pass
 
 
 def _interpolate_lsf(en,lsfener,lsfdata,lsfepix,):
@@ -3862,7 +4103,7 @@ def _interpolate_lsf(en,lsfener,lsfdata,lsfepix,):
     
     parameters
     ===========
-    en : float (not a list/array)
+    en : float or numpy array
        energy (keV) for wavelength for which LSF is desired
     lsfwav : numpy array
        list of wavelengths at which we have LSF
@@ -3874,7 +4115,7 @@ def _interpolate_lsf(en,lsfener,lsfdata,lsfepix,):
        
     returns
     =======
-    lsf[channels] for wavelength w
+    lsf[channels] for wavelength w, or lsf[en,channels] for an array en
     
     method
     ========
@@ -3882,51 +4123,54 @@ def _interpolate_lsf(en,lsfener,lsfdata,lsfepix,):
         
     """
     import numpy as np
-    if  not ((type(en) == float) | (type(en) == np.float32)):  
-        print("en = ",en)
-        print("type en = ", type(en))
-        raise IOError("_interpolate_lsf only works on one *en* element at a time")
+    en = np.asarray(en)
     #  find index of the nearest LSF
     indx = np.argsort(lsfener) # indices  
     jj = lsfener.searchsorted(en,sorter=indx)
     j = indx[jj-1] 
-    k = lsfener.shape[0]
-    if j == 0: 
-            lsf = lsfdata[0,:].flatten()
-    elif ((j > 0) & (j < k) ):
-            e1 = lsfener[j-1]
-            e2 = lsfener[j]
-            frac = (en-e1)/(e2-e1)
-            lsf1 = lsfdata[j-1,:].flatten()
-            lsf2 = lsfdata[j,:].flatten()
-            lsf = ((1-frac) * lsf1 + frac * lsf2)        
-    else:
-            lsf = lsfdata[k-1,:].flatten()
+    # j == 0: the first LSF 
+    j1 = np.maximum(j-1,0)
+    e1 = lsfener[j1]
+    e2 = lsfener[j]
+    frac = np.where(j > 0, (en-e1)/np.where(j > 0, e2-e1, 1.), 0.)[...,np.newaxis]
+    lsf = ((1-frac) * lsfdata[j1,:] + frac * lsfdata[j,:])        
             
     return lsf
 
 
-def _read_lsf_file(lsfVersion='003',wheelpos=160,):
-    """
-    2015-08-19 error in lsfepix order of row and column? 
-    """
+def _lsf_filename(lsfVersion='003'):
+    """path of the LSF file in $UVOTPY/calfiles for lsfVersion"""
     import os
-    from astropy.io import fits
-    import uvotio
-    
     UVOTPY = os.getenv('UVOTPY')
     if UVOTPY == '': 
         raise IOError( 'The UVOTPY environment variable has not been set; aborting RMF generation ')
 
     if lsfVersion == '001':
-        try:  
-            lsffile = fits.open(  UVOTPY+'/calfiles/zemaxlsf0160_v001.fit' ) 
-        except:
+        lsffile = UVOTPY+'/calfiles/zemaxlsf0160_v001.fit'
+        if not os.access(lsffile, os.R_OK):
             print("WARNING: the oldest zemaxlsf calfile has been read in (= wheelpos 160; version 001)")
-            lsffile = fits.open(  UVOTPY+'/calfiles/zemaxlsf.fit' ) 
+            lsffile = UVOTPY+'/calfiles/zemaxlsf.fit'
     else:
           # in later versions the instrumental broadening is already included in the Line Spread Function
-          lsffile = fits.open(  UVOTPY+'/calfiles/zemaxlsf0160_v'+lsfVersion+'.fit' ) 
+          lsffile = UVOTPY+'/calfiles/zemaxlsf0160_v'+lsfVersion+'.fit'
+    return lsffile
+
+
+def _read_lsf_file(lsfVersion='003',wheelpos=160,):
+    """
+    2015-08-19 error in lsfepix order of row and column? 
+    2017-06-20 the tables are read once (kept in _lsf_tables)
+    """
+    import os
+    from astropy.io import fits
+    import uvotio
+    
+    lsfname = _lsf_filename(lsfVersion)
+    tablekey = (os.path.abspath(lsfname), os.path.getmtime(lsfname), wheelpos < 500)
+    if tablekey in _lsf_tables:
+        return _lsf_tables[tablekey]
+        
+    lsffile = fits.open( lsfname )
                
     if wheelpos < 500: 
         lsfextension = 1
@@ -3940,5 +4184,6 @@ def _read_lsf_file(lsfVersion='003',wheelpos=160,):
     lsfwav = uvotio.kev2angstrom(lsfener)        # LSF wavelength
     lsflen = lsfdata.shape[1]
     lsffile.close()
+    _lsf_tables[tablekey] = (lsfwav,lsfepix,lsfdata,lsfener)
    
     return lsfwav,lsfepix,lsfdata,lsfener
@@ -529,19 +529,12 @@ def swclockcorr(met):
     date = times[3][:10]
     time = times[3][11:19]
     # get file with corrections
-    caldb = os.getenv("CALDB")
-    command="quzcif swift sc - -  clock  "+date+" "+time+" - > quzcif.out"
-    os.system(command)
-    f = open("quzcif.out")
+    from .uvotcaldb import quzcif, caldb_hdulist
     try:
-       tcorfile, ext = f.read().split()
-       ext = int(ext)
-       f.close()
+       tcorfile, ext = quzcif("swift","sc","-","-","clock",date,time,"-")[0]
+       xx = caldb_hdulist(tcorfile)
     except:
-       f.close()
        return np.polyval(np.array([4.92294757e-08,  -8.36992570]),met), False   
-    os.system("rm -f quzcif.out")
-    xx = fits.open(tcorfile)
     x = xx[ext].data
     k = (met >= x['tstart']) & (met < x['tstop'])
     if np.sum(k) != 1: 
@@ -550,7 +543,6 @@ def swclockcorr(met):
     t1 = old_div((met - x['tstart'][k]),86400.0)
     tcorr = x['toffset'][k] + ( x['C0'][k] + 
        x['C1'][k]*t1 + x['C2'][k]*t1*t1)*1.0e-6
-    xx.close()
     return tcorr[0], True   
    
 def get_dispersion_from_header(header,order=1):
@@ -749,21 +741,12 @@ def encircled_energy(uvotfilter, areapix):
    =====
    This applies solely for point sources.    
    """
-   import os
-   caldb = os.getenv("CALDB")
+   from .uvotcaldb import quzcif, caldb_hdulist
    if uvotfilter == 'wh': uvotfilter = 'white'
-   command="quzcif swift uvota - "+uvotfilter.upper()+\
-           " REEF 2009-10-30 12:00:00 - > quzcif.out"
-   print(command)          
-   if not os.system(command):
-      print("not " +command)       
-   f = open("quzcif.out")
-   reeffile, ext = f.read().split()
-   ext = int(ext)
-   f.close()
-   os.system("rm -f quzcif.out")
+   reeffile, ext = quzcif("swift","uvota","-",uvotfilter.upper(),"REEF",
+      "2009-10-30","12:00:00","-")[0]
    print(reeffile, ext)
-   f = fits.getdata(reeffile,ext)
+   f = caldb_hdulist(reeffile)[ext].data
    r = f['radius'] # in arc sec
    E = f['reef'] 
    x = sqrt(old_div(areapix,pi))*0.502 # lookup radius
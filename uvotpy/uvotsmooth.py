@@ -0,0 +1,156 @@
+# -*- coding: iso-8859-15 -*-
+#
+# This software was written by N.P.M. Kuin (Paul Kuin)
+# Copyright N.P.M. Kuin
+# All rights reserved
+# This software is licenced under a 3-clause BSD style license
+#
+#Redistribution and use in source and binary forms, with or without
+#modification, are permitted provided that the following conditions are met:
+#
+#Redistributions of source code must retain the above copyright notice,
+#this list of conditions and the following disclaimer.
+#
+#Redistributions in binary form must reproduce the above copyright notice,
+#this list of conditions and the following disclaimer in the documentation
+#and/or other materials provided with the distribution.
+#
+#Neither the name of the University College London nor the names
+#of the code contributors may be used to endorse or promote products
+#derived from this software without specific prior written permission.
+#
+#THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+#THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+#PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+#CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+#EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+#PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+#OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+#OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+#ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+   Boxcar smoothing of 1-D and 2-D arrays with summed-area tables.
+
+   boxcar() replaces stsci.convolve.boxcar(), with the same arguments and
+   edge modes. The window sums are differences of cumulative sums along
+   each axis, so the cost does not depend on the size of the box.
+'''
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+__version__ = '0.1 20170620'
+
+import numpy as np
+
+# edge modes of boxcar() and the equivalent numpy.pad() mode
+boxcar_modes = {'nearest':'edge', 'reflect':'symmetric', 'wrap':'wrap', 'constant':'constant'}
+
+
+def boxcar(data, boxshape, output=None, mode='nearest', cval=0.0, ignore_nan=False):
+   '''Boxcar smoothing of a 1-D or 2-D array.
+
+   Parameters
+   ----------
+   data : array
+      the 1-D or 2-D array to smooth
+   boxshape : tuple of int
+      size of the box along each axis of data, e.g., (coi_length,)
+      or (50,7)
+   output : array, optional
+      array of the shape of data to put the result in
+   mode : {'nearest','reflect','wrap','constant'}
+      how the data are extended beyond the edges:
+      'nearest' repeats the edge value, 'reflect' mirrors the data
+      including the edge value, 'wrap' wraps around, and 'constant' uses cval.
+   cval : float
+      value beyond the edges for mode 'constant'
+   ignore_nan : bool
+      if True, average only the finite values in each box; a box without
+      any finite value gives NaN.
+
+   Returns
+   -------
+   smoothed : ndarray (float)
+      the mean over the box centred on each element. For an even box size
+      the box extends one element further to the lower index side.
+
+   Notes
+   -----
+   Each axis is smoothed in turn with the difference of the cumulative sum
+   of the extended data, in O(N) independent of the box size. The data are
+   offset by their mean before summing to limit the rounding error.
+
+   Example
+   -------
+   >>> boxcar(np.array([10, 0, 0, 0, 0, 0, 1000]), (3,), mode="nearest").round(2)
+   array([  6.67,   3.33,   0.  ,   0.  ,   0.  , 333.33, 666.67])
+   >>> boxcar(np.array([10, 0, 0, 0, 0, 0, 1000]), (3,), mode="constant").round(2)
+   array([  3.33,   3.33,   0.  ,   0.  ,   0.  , 333.33, 333.33])
+
+   History
+   -------
+   2017-06-20 replaces stsci.convolve.boxcar
+   '''
+   data = np.asarray(data, dtype=float)
+   boxshape = tuple(boxshape)
+   if not data.ndim in [1,2]:
+      raise ValueError("boxcar: data must be a 1-D or 2-D array")
+   if len(boxshape) != data.ndim:
+      raise ValueError("boxcar: boxshape %s does not match the data shape %s"%
+         (str(boxshape),str(data.shape)))
+   if not mode in boxcar_modes:
+      raise ValueError("boxcar: mode must be one of %s"%(str(list(boxcar_modes.keys()))))
+
+   if ignore_nan:
+      good = np.isfinite(data)
+      if good.any():
+         ref = data[good].mean()
+      else:
+         ref = 0.
+      values = np.where(good, data-ref, 0.)
+      weight = good.astype(float)
+      for axis, size in enumerate(boxshape):
+         values = _window_sum(values, int(size), axis, mode, cval-ref)
+         weight = _window_sum(weight, int(size), axis, mode, 1.0)
+      with np.errstate(divide='ignore', invalid='ignore'):
+         result = np.where(weight > 0.5, values/weight, np.nan) + ref
+   else:
+      if data.size > 0:
+         ref = data.mean()
+      else:
+         ref = 0.
+      if not np.isfinite(ref):
+         ref = 0.
+      result = data - ref
+      for axis, size in enumerate(boxshape):
+         result = _window_sum(result, int(size), axis, mode, cval-ref)/int(size)
+      result += ref
+
+   if output is None:
+      return result
+   output[...] = result
+   return output
+
+
+def _window_sum(data, size, axis, mode, cval):
+   '''sum over a window of `size` elements along `axis` from cumulative sums'''
+   if size < 1:
+      raise ValueError("boxcar: box size must be at least 1")
+   if size == 1:
+      return data.copy()
+   n = data.shape[axis]
+   before = size//2
+   pad = [(0,0)]*data.ndim
+   pad[axis] = (before, size-1-before)
+   if mode == 'constant':
+      padded = np.pad(data, pad, mode='constant', constant_values=cval)
+   else:
+      padded = np.pad(data, pad, mode=boxcar_modes[mode])
+   zero = list(padded.shape)
+   zero[axis] = 1
+   csum = np.cumsum(np.concatenate((np.zeros(zero), padded), axis=axis), axis=axis)
+   return np.take(csum, np.arange(size, n+size), axis=axis) - np.take(csum, np.arange(n), axis=axis)
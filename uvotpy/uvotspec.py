@@ -44,7 +44,7 @@ from builtins import object
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from stsci.convolve import boxcar
+from .uvotsmooth import boxcar
 from astropy.io import fits
 from matplotlib.lines import Line2D
 
@@ -1657,8 +1657,8 @@ class fit_spectrum(object):
         limits gives the parameter range
         value gives the starting(or fixed) value
         parname gives the parameter name
-        if the value needs to be fixed, the limits must be set to a very small range 
-          for running mpfit (1e-5 * value?) 
+        if the value needs to be fixed, add 'fixed':1 (mpfit does not accept 
+          equal lower and upper limits) 
         
         
         """
@@ -1739,7 +1739,7 @@ class fit_spectrum(object):
             component_number=len(self.models)
             cn = "%02s"%(component_number)
             return {"model":"poly_background", "parinfo":[
-              {"limited":[1,1],"limits":[1,1],"value":1,  "parname":'order'+cn}, # fixed! limits=value
+              {"limited":[0,0],"limits":[0,0],"fixed":1,"value":1,"parname":'order'+cn}, # fixed
               {"limited":[0,0],"limits":[0,0],"value":0.0,"parname":'coef0'+cn},
               {"limited":[0,0],"limits":[0,0],"value":0.0,"parname":'coef1'+cn},
               {"limited":[0,0],"limits":[0,0],"value":0.0,"parname":'coef2'+cn},
@@ -1748,9 +1748,8 @@ class fit_spectrum(object):
               {"limited":[0,0],"limits":[0,0],"value":0.0,"parname":'coef5'+cn},
               {"limited":[0,0],"limits":[0,0],"value":0.0,"parname":'coef6'+cn},
               ]},['x','y','err']
-        order = p[0]
-        if type(order) != int:
-           print("problem model_poly_background order not an int:", order)      
+        # p may hold a block of parameter sets (see fit_function)
+        order = int(np.round(np.ravel(p[0])[0]))
         model = np.polyval(p[1:order+2],x)      
         status = 0
         return [status, (y-model)/err]
@@ -1776,14 +1775,15 @@ class fit_spectrum(object):
         call the fitter
         
         """
+        import mpfit
         x = self.spectrum.wavelength
         y = self.spectrum.flux
         err = self.spectrum.fluxerr
         # build initial parameter value list 
         p0 = []
         pinfo = []
-        for x in self.fit_parameters:
-           par = x["parinfo"]
+        for fitparms in self.fit_parameters:
+           par = fitparms["parinfo"]
            for pv in par:
                p0.append(pv['value'])
                pinfo.append(pv)
@@ -1791,8 +1791,10 @@ class fit_spectrum(object):
         # build argument list
         fkw={'x':x,'y':y,'err':err}
            
-        # call L-M fitter   
-        Z = mpfit.mpfit(fit_function,p0,functkw=fkw,parinfo=pinfo,quiet=True)
+        # call L-M fitter; fit_function evaluates the jacobian columns 
+        # in one call   
+        Z = mpfit.mpfit(self.fit_function,p0,functkw=fkw,parinfo=pinfo,
+            quiet=True,vectorized=1)
         if (Z.status <= 0): print('fit_spectrum.mpfit error message = ', Z.errmsg)
         
         # update the fit (parinfo...?), return results
@@ -1815,26 +1817,34 @@ class fit_spectrum(object):
            
         p : list 
            a list of parameters to fit        
+           
+        Notes
+        -----
+        p may also be a 2-D array with one parameter set per row, as 
+        passed by mpfit with vectorized=1 for the finite difference 
+        jacobian. The deviates are then returned with one row per 
+        parameter set.   
         """
-        
+        p = np.asarray(p,dtype=float)
+        # models are evaluated for all parameter sets at once: each model
+        # parameter has shape (nsets,1) and broadcasts against x
+        pp = np.atleast_2d(p)[:,:,np.newaxis]
         F = 0.
         i = 0
         nmod = len(self.models)
         for k in range(nmod):       
-            npar = len(self.fitparms[k]["parinfo"])
-            arg = "("
-            p0 = []
-            for w in range(npar):
-                p[0].append( p[i]) 
-                i += 1
-            fjac_mod = fjac[i:i+npar,i:i+npar]  
+            npar = len(self.fit_parameters[k]["parinfo"])
+            # the model functions return (y-model)/err, so with y=0 and 
+            # err=1 they return -model 
             # fjac is a dummy parameter in gauss and poly_background 
-            #any other use needs testing that the correct slice has 
-            # been made ...     
-            arg += ", fjac=fjac_mod, x=x, y=y, err=err)"                
-            F = F + eval("model_"+self.models[k]+arg)       
+            model_function = getattr(self,"model_"+self.models[k])
+            F = F - model_function(pp[:,i:i+npar].swapaxes(0,1), 
+                 fjac=None, x=x, y=0., err=1.)[1]
+            i += npar
+        if p.ndim == 1: 
+            F = F[0]       
         status = 0
-        if err != None:
+        if err is not None:
            return [status, (y-F)/err]
         else:
            return [status, (y-F)]   
@@ -1851,7 +1861,7 @@ class fit_spectrum(object):
 def fit2g_bg(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,
     amp2lim=None,fixsig=False,
     fixsiglim=0.2, fixpos=False,
-    fixamp=False, chatter=0):
+    fixamp=False, chatter=0, autoderivative=False):
    '''
    Fit two gaussians plus a linear varying background to f(x)
    
@@ -1872,6 +1882,8 @@ def fit2g_bg(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,
       - sig_hi upper limit on sigma  
       - fixamp boolean (True or False) for fixed amplitude
       - fixsig boolean (True or False) for fixed sigma
+   autoderivative : bool
+      if False, mpfit uses the analytic derivatives of the model
    
    '''
    import numpy as np
@@ -1953,7 +1965,8 @@ def fit2g_bg(x,f,err,bg,amp1,pos1,sig1,amp2,pos2,sig2,
       print("parinfo has been set to: ") 
       for par in parinfo: print(par)
 
-   Z = mpfit(_fit2g,p0,functkw=fa,parinfo=parinfo,quiet=False)
+   Z = mpfit.mpfit(_fit2g,p0,functkw=fa,parinfo=parinfo,quiet=False,
+          autoderivative=int(autoderivative))
    
    if (Z.status <= 0): 
       print('uvotgetspec.runfit2.mpfit error message = ', Z.errmsg)
@@ -1980,10 +1993,20 @@ def _fit2g(p, fjac=None, x=None, y=None, err=None):
    status = 0
    figure(12)
    plot(x,(model-y)/err)
-   return [status, (model-y)/err]
+   if fjac is None:
+      return [status, (model-y)/err]
+   # derivatives of the model; the sign is that of the deviates (model-y)/err 
+   g1 = np.exp( - ((x-pos1)/sig1)**2 )
+   g2 = np.exp( - ((x-pos2)/sig2)**2 )
+   u1 = (x-pos1)/sig1
+   u2 = (x-pos2)/sig2
+   pderiv = np.array([1 + bg1*(x-pos1), bg0*(x-pos1), 
+      g1, -bg0*bg1 + 2*amp1*g1*u1/sig1, 2*amp1*g1*u1*u1/sig1,
+      g2, 2*amp2*g2*u2/sig2, 2*amp2*g2*u2*u2/sig2]).T
+   return [status, (model-y)/err, -pderiv/np.asarray(err)[:,np.newaxis]]
     
 def dofit2poly(x,f,err,coef1=[0,1],coef2=[0,1],
-    chatter=0):
+    chatter=0,autoderivative=False):
    '''
    Fit the sum of two first order polynomials f(x)
    
@@ -1994,6 +2017,8 @@ def dofit2poly(x,f,err,coef1=[0,1],coef2=[0,1],
    err : ?
    coef? : list
       coefficients of polynomial
+   autoderivative : bool
+      if False, mpfit uses the analytic derivatives of the model
    
    PROBLEM: gives some numbers that don't make sense...
    '''
@@ -2015,7 +2040,8 @@ def dofit2poly(x,f,err,coef1=[0,1],coef2=[0,1],
       print("parinfo has been set to: ") 
       for par in parinfo: print(par)
 
-   Z = mpfit(_fit3,p0,functkw=fa,parinfo=parinfo,quiet=True)
+   Z = mpfit.mpfit(_fit3,p0,functkw=fa,parinfo=parinfo,quiet=True,
+          autoderivative=int(autoderivative))
    
    if (Z.status <= 0): 
       print('uvotspec.dofit2poly.mpfit error message = ', Z.errmsg)
@@ -2032,7 +2058,11 @@ def _fit3(p, fjac=None, x=None, y=None, err=None):
    (coef11,coef10,coef21,coef20) = p         
    model = np.polyval([coef10,coef11],x)+np.polyval([coef20,coef21],x)
    status = 0
-   return [status, (y-model)/err]
+   if fjac is None:
+      return [status, (y-model)/err]
+   x = np.asarray(x)
+   pderiv = np.array([np.ones(len(x)), x, np.ones(len(x)), x]).T
+   return [status, (y-model)/err, pderiv/np.asarray(err)[:,np.newaxis]]
 
 ########################## summung spectra #########################################
 # a routine to sum spectra. Orginal was in module uvotgetspec. This version outputs 
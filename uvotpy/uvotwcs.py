@@ -490,25 +490,17 @@ def get_pointing_from_attfile(tstart,tstop,attfile):
 
 def get_distortion_keywords(wheelpos):
    '''provide the grism header with distortion keywords '''
-   import os
-   try:
-      from astropy.io import fits
-   except:
-      import pyfits as fits
+   from .uvotcaldb import quzcif, caldb_hdulist
    
    if wheelpos < 500:
-       command="quzcif swift uvota - VGRISM GRISMDISTORTION 2009-10-30 12:00:00 - > quzcif.out"
+       grism = 'VGRISM'
        name = 'UGRISM_%04d_DISTORTION'%(wheelpos)
    else:    
-       command="quzcif swift uvota - UGRISM GRISMDISTORTION 2009-10-30 12:00:00 - > quzcif.out"
+       grism = 'UGRISM'
        name = 'VGRISM_%04d_DISTORTION'%(wheelpos)
    print(name)   
-   os.system(command)
-   f = open("quzcif.out")
-   distfile = f.read().split()[0]
-   f.close()
-   os.system("rm -f quzcif.out")
-   fdist = fits.open(distfile)
+   distfile = quzcif("swift","uvota","-",grism,"GRISMDISTORTION","2009-10-30","12:00:00","-")[0][0]
+   fdist = caldb_hdulist(distfile)
    head = fdist[name].header
    hdr = head['?_ORDER']
    hdr.update(head['A_?_?'])